@@ -0,0 +1,229 @@
+import os
+import math
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from lifecycle import WEB_CONCURRENCY
+
+TRAFFIC_CLASSES = ("interactive", "batch")
+
+
+def _parse_mapping(value: str, cast=int) -> dict:
+    """Parse "a=1,b=2" style configuration."""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            mapping[k.strip()] = cast(v.strip())
+    return mapping
+
+
+# Provider and tenant queue limits are for the whole deployment; each of the WEB_CONCURRENCY workers gets its share
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("PROVIDER_MAX_CONCURRENCY_DEFAULT", "8"))
+PROVIDER_MAX_CONCURRENCY = _parse_mapping(os.environ.get("PROVIDER_MAX_CONCURRENCY", ""))
+TENANT_MAX_QUEUE = int(os.environ.get("TENANT_MAX_QUEUE", "16"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "60"))
+TRAFFIC_WEIGHTS = {"interactive": 4.0, "batch": 1.0, **_parse_mapping(os.environ.get("TRAFFIC_WEIGHTS", ""), float)}
+# Threads that run blocking provider calls, including while they are queued for
+# a slot. Must be well above the sum of the per-worker provider limits, or calls
+# wait for a thread instead of a slot and the limits and fair queueing never apply.
+PROVIDER_THREADS = int(os.environ.get("PROVIDER_THREADS", "64"))
+
+# (tenant, traffic class) of the request currently being served; copied into
+# provider threads by AdmissionController.run_in_thread
+request_context: ContextVar[Tuple[str, str]] = ContextVar("request_context", default=("anonymous", "interactive"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a tenant's queue is full or a call waited too long for a slot."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class _ProviderScheduler:
+    """Concurrency limit plus weighted fair queueing for one provider.
+
+    Each (tenant, traffic class) flow has its own bounded FIFO. When a slot
+    frees up, the flow with the lowest virtual time is served next and its
+    virtual time advances by 1/weight, so interactive traffic gets a larger
+    share than batch and no single tenant can monopolize the provider.
+
+    Only flows with queued requests are kept; a flow that comes back after
+    its queue drained restarts at the current virtual time.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.queues: Dict[Tuple[str, str], deque] = {}
+        self.virtual_time: Dict[Tuple[str, str], float] = {}
+        self.clock = 0.0
+        self.avg_hold_seconds = 5.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0,
+                      "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def retry_after(self) -> int:
+        """Rough estimate of when a slot will free up for a new request."""
+        backlog = self.queue_depth() + 1
+        return max(1, int(backlog * self.avg_hold_seconds / self.max_concurrency))
+
+    def next_waiter(self):
+        if not self.queues:
+            return None
+        flow = min(self.queues, key=lambda f: self.virtual_time.get(f, self.clock))
+        self.clock = max(self.clock, self.virtual_time.get(flow, self.clock))
+        self.virtual_time[flow] = self.clock + 1.0 / TRAFFIC_WEIGHTS.get(flow[1], 1.0)
+        waiter = self.queues[flow].popleft()
+        self.drop_if_idle(flow)
+        return waiter
+
+    def drop_if_idle(self, flow: Tuple[str, str]):
+        """Forget a drained flow's queue (flow IDs come from request headers, so they are unbounded)."""
+        if flow in self.queues and not self.queues[flow]:
+            del self.queues[flow]
+            self.virtual_time.pop(flow, None)
+
+
+class AdmissionController:
+    """Admission control in front of provider calls."""
+
+    def __init__(self, threads: int = PROVIDER_THREADS):
+        self._lock = threading.Lock()
+        self._schedulers: Dict[str, _ProviderScheduler] = {}
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.threads_busy = 0
+        self.thread_stats = {"started": 0, "rejected": 0, "max_busy": 0}
+
+    def _scheduler(self, provider: str) -> _ProviderScheduler:
+        if provider not in self._schedulers:
+            limit = PROVIDER_MAX_CONCURRENCY.get(provider, DEFAULT_MAX_CONCURRENCY)
+            self._schedulers[provider] = _ProviderScheduler(math.ceil(limit / WEB_CONCURRENCY))
+        return self._schedulers[provider]
+
+    def limit(self, provider: str) -> int:
+        """This worker's share of the provider's concurrency limit."""
+        with self._lock:
+            return self._scheduler(provider).max_concurrency
+
+    def acquire(self, provider: str):
+        """Block until a provider slot is granted to the current request's flow."""
+        flow = request_context.get()
+        with self._lock:
+            sched = self._scheduler(provider)
+            if sched.active < sched.max_concurrency and sched.queue_depth() == 0:
+                sched.active += 1
+                sched.stats["admitted"] += 1
+                return
+            if len(sched.queues.get(flow, ())) >= math.ceil(TENANT_MAX_QUEUE / WEB_CONCURRENCY):
+                sched.stats["rejected"] += 1
+                raise AdmissionRejected(f"Too many queued requests for tenant on {provider}", sched.retry_after())
+            waiter = _Waiter()
+            sched.queues.setdefault(flow, deque()).append(waiter)
+            sched.stats["queued"] += 1
+
+        granted = waiter.event.wait(ADMISSION_MAX_WAIT_SECONDS)
+        with self._lock:
+            if not granted and not waiter.event.is_set():
+                sched.queues[flow].remove(waiter)
+                sched.drop_if_idle(flow)
+                sched.stats["timed_out"] += 1
+                raise AdmissionRejected(f"Timed out waiting for a {provider} slot", sched.retry_after())
+            waited = time.monotonic() - waiter.enqueued_at
+            sched.stats["admitted"] += 1
+            sched.stats["total_wait_seconds"] += waited
+            sched.stats["max_wait_seconds"] = max(sched.stats["max_wait_seconds"], waited)
+
+    def release(self, provider: str, held_seconds: float = None):
+        """Hand the slot to the next queued flow, or free it."""
+        with self._lock:
+            sched = self._scheduler(provider)
+            if held_seconds is not None:
+                sched.avg_hold_seconds = 0.8 * sched.avg_hold_seconds + 0.2 * held_seconds
+            waiter = sched.next_waiter()
+            if waiter:
+                waiter.event.set()  # Slot passes directly to the waiter
+            else:
+                sched.active -= 1
+
+    @contextmanager
+    def slot(self, provider: str):
+        self.acquire(provider)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(provider, time.monotonic() - start)
+
+    async def run_in_thread(self, fn: Callable, *args, **kwargs):
+        """Run a blocking client call in a provider thread, with the caller's context.
+
+        Unlike asyncio.to_thread, the pool is sized for calls that wait on
+        admission; when every thread is busy the call is rejected rather than
+        queued out of sight of the fair scheduler.
+        """
+        with self._lock:
+            if self.threads_busy >= self.threads:
+                self.thread_stats["rejected"] += 1
+                retry_after = max((s.retry_after() for s in self._schedulers.values()), default=1)
+                raise AdmissionRejected("All provider threads are busy", retry_after)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="provider")
+            self.threads_busy += 1
+            self.thread_stats["started"] += 1
+            self.thread_stats["max_busy"] = max(self.thread_stats["max_busy"], self.threads_busy)
+            future = self._executor.submit(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._thread_done)
+        return await asyncio.wrap_future(future)
+
+    def _thread_done(self, future: Future):
+        with self._lock:
+            self.threads_busy -= 1
+
+    def in_flight(self) -> int:
+        """Provider calls running or queued in this process."""
+        with self._lock:
+            queued = sum(s.active + s.queue_depth() for s in self._schedulers.values())
+            # A thread stays busy between the sub-steps of one call, while it holds no slot
+            return max(queued, self.threads_busy)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            result = {}
+            for provider, sched in self._schedulers.items():
+                admitted = sched.stats["admitted"]
+                result[provider] = {
+                    "max_concurrency": sched.max_concurrency,
+                    "active": sched.active,
+                    "queue_depth": sched.queue_depth(),
+                    "queue_depth_by_flow": {f"{t}/{c}": len(q) for (t, c), q in sched.queues.items()},
+                    "avg_wait_seconds": sched.stats["total_wait_seconds"] / admitted if admitted else 0.0,
+                    **sched.stats,
+                }
+            return result
+
+    def thread_metrics(self) -> dict:
+        with self._lock:
+            return {"threads": self.threads, "busy": self.threads_busy, **self.thread_stats}
+
+
+admission_controller = AdmissionController()
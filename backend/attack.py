@@ -0,0 +1,141 @@
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ATTACK_DATA_FILE = os.environ.get("ATTACK_DATA_FILE", str(Path(__file__).parent / "data" / "attack_enterprise.tsv"))
+
+_TACTIC_ID = re.compile(r"\bTA\d{4}\b", re.IGNORECASE)
+_TECHNIQUE_ID = re.compile(r"\bT\d{4}(?:\.\d{3})?\b", re.IGNORECASE)
+_SEPARATOR = re.compile(r"^[\s:\-–—()]+|[\s,;()]+$")
+
+
+def _key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+class AttackIndex:
+    """In-memory ATT&CK lookup tables built once from the bundled data file.
+
+    Tactics and techniques are keyed by ID and by normalized name, so every
+    lookup is a single dict access. Without the data file the index is empty
+    and threats are passed through unchanged.
+    """
+
+    def __init__(self, path: str = ATTACK_DATA_FILE):
+        start = time.perf_counter()
+        self.version = ""
+        self.tactics: Dict[str, str] = {}            # TA0001 -> Initial Access
+        self.techniques: Dict[str, str] = {}         # T1078.004 -> Valid Accounts: Cloud Accounts
+        self.technique_tactics: Dict[str, List[str]] = {}  # T1078 -> [TA0005, TA0003, ...]
+        self._by_name: Dict[str, str] = {}           # normalized name -> ID
+        self.error: Optional[str] = None
+        shortnames = {}
+
+        try:
+            f = open(path, encoding="utf-8")
+        except OSError as e:
+            self.error = f"ATT&CK data unavailable: {e}"
+            self.load_ms = 0.0
+            return
+        with f:
+            for line in f:
+                if line.startswith("#"):
+                    if not self.version and "ATT&CK" in line:
+                        self.version = line.split(" - ")[0].lstrip("# ").strip()
+                    continue
+                item_id, name, tactics = line.rstrip("\n").split("\t")
+                if item_id.startswith("TA"):
+                    self.tactics[item_id] = name
+                    shortnames[tactics] = item_id
+                else:
+                    self.techniques[item_id] = name
+                    self.technique_tactics[item_id] = tactics.split(",") if tactics else []
+                self._by_name.setdefault(_key(name), item_id)
+                if ": " in name:
+                    # Sub-techniques are also known by their own short name
+                    self._by_name.setdefault(_key(name.split(": ", 1)[1]), item_id)
+
+        for technique, tactics in self.technique_tactics.items():
+            self.technique_tactics[technique] = [shortnames[t] for t in tactics if t in shortnames]
+        self.load_ms = (time.perf_counter() - start) * 1000
+
+    def name(self, item_id: str) -> Optional[str]:
+        return self.tactics.get(item_id) or self.techniques.get(item_id)
+
+    def lookup_name(self, name: str) -> Optional[str]:
+        """ID for a tactic or technique name, if it is a known one."""
+        return self._by_name.get(_key(name))
+
+    def _normalize(self, value: str, pattern: re.Pattern, table: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Split a free-text field into known IDs and unrecognized IDs.
+
+        Each ID is checked against the table; an unknown ID whose accompanying
+        name is a known entry is corrected to that entry's ID. Text with no IDs
+        at all is matched by name.
+        """
+        matches = list(pattern.finditer(value))
+        if not matches:
+            parts = [p for p in re.split(r"[,;\n]", value) if p.strip()]
+            found = [self.lookup_name(p) for p in parts]
+            return [i for i in found if i in table], []
+
+        valid, invalid = [], []
+        for n, match in enumerate(matches):
+            item_id = match.group(0).upper()
+            end = matches[n + 1].start() if n + 1 < len(matches) else len(value)
+            label = _SEPARATOR.sub("", value[match.end():end])
+            if item_id not in table:
+                corrected = self.lookup_name(label) if label else None
+                if corrected in table:
+                    item_id = corrected
+                else:
+                    invalid.append(item_id)
+                    continue
+            if item_id not in valid:
+                valid.append(item_id)
+        return valid, invalid
+
+    def _format(self, ids: List[str]) -> str:
+        return ", ".join(f"{i} - {self.name(i)}" for i in ids)
+
+    def enrich_threat(self, threat: dict) -> dict:
+        """Validate and normalize a threat's MITRE fields in place.
+
+        Known IDs are rewritten as "ID - Canonical Name", missing tactics are
+        filled in from the techniques, and unknown IDs are removed from the
+        text and listed in invalid_mitre_ids.
+        """
+        if not self.techniques:
+            # Nothing to validate against; every ID would look unknown
+            threat.setdefault("invalid_mitre_ids", [])
+            return threat
+        tactic_text = str(threat.get("mitre_tactic") or "")
+        technique_text = str(threat.get("mitre_technique") or "")
+        tactics, bad_tactics = self._normalize(tactic_text, _TACTIC_ID, self.tactics)
+        techniques, bad_techniques = self._normalize(technique_text, _TECHNIQUE_ID, self.techniques)
+
+        if not tactics:
+            for technique in techniques:
+                tactics += [t for t in self.technique_tactics.get(technique, []) if t not in tactics]
+
+        # Leave text we could not interpret at all untouched rather than blanking it
+        if tactics or bad_tactics:
+            threat["mitre_tactic"] = self._format(tactics)
+        if techniques or bad_techniques:
+            threat["mitre_technique"] = self._format(techniques)
+        threat["invalid_mitre_ids"] = bad_tactics + bad_techniques
+        return threat
+
+    def metrics(self) -> dict:
+        return {
+            "version": self.version,
+            "tactics": len(self.tactics),
+            "techniques": len(self.techniques),
+            "load_ms": round(self.load_ms, 2),
+            "error": self.error,
+        }
+
+
+attack_index = AttackIndex()
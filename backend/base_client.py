@@ -0,0 +1,466 @@
+import os
+import json
+import re
+import time
+import functools
+import orjson
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Iterable, Iterator
+
+from admission import admission_controller
+from token_budget import token_accountant, request_usage, isolated_calls, MAX_OUTPUT_TOKENS, TRUNCATED_STOP_REASONS
+from dedup import THREAT_DEDUP, dedupe_threats
+from attack import attack_index
+from cancellation import RequestCancelled, check_cancelled, cancellation_stats
+from routing import model_router, output_problem
+from cassette import cassette, request_hash
+from progress import emit
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "").lower() in ("1", "true", "yes")
+
+
+def log(step: str, message: str, data: any = None, source: str = "API"):
+    """Log a message with timestamp and step info."""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"\n{'='*60}")
+    print(f"[{timestamp}] {source} - {step}")
+    print(f"{'='*60}")
+    print(f">> {message}")
+    if data:
+        if isinstance(data, dict) or isinstance(data, list):
+            print(f"\n{orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()[:2000]}")
+        else:
+            print(f"\n{str(data)[:2000]}")
+    print(f"{'='*60}\n")
+
+
+def load_prompt(filename: str) -> str:
+    """Load a prompt template from the prompts directory."""
+    filepath = PROMPTS_DIR / filename
+    with open(filepath, "r") as f:
+        return f.read()
+
+
+@dataclass
+class Completion:
+    """Result of a single provider call."""
+    text: str = ""
+    data: Optional[dict] = None  # Parsed structured output, when the provider returned one
+    stop_reason: Optional[str] = None
+    usage: dict = field(default_factory=dict)
+
+
+class BaseClient:
+    """Provider-independent three-step threat modeling pipeline.
+
+    Prompt loading, step orchestration, JSON parsing and normalization live here;
+    subclasses only implement the transport in `_invoke`.
+    """
+
+    provider = "base"
+    # Cheaper model tried first when MODEL_CASCADE is on
+    fast_model: Optional[str] = None
+
+    def __init__(self, model: str, structured_output: Optional[bool] = None):
+        self.model = model
+        self.structured_output = STRUCTURED_OUTPUT if structured_output is None else structured_output
+        self.log("INIT", f"Initialized {self.provider} client with model: {self.model} (structured output: {self.structured_output})")
+
+    def log(self, step: str, message: str, data: any = None):
+        log(step, message, data, source=self.provider.upper())
+
+    def _invoke(
+        self,
+        prompt: str,
+        image_base64: Optional[str] = None,
+        media_type: str = "image/png",
+        max_tokens: int = 4096,
+        step_name: str = "INVOKE",
+        structured: bool = False,
+        model: Optional[str] = None
+    ) -> Completion:
+        """Send one prompt (and optional image) to the provider.
+
+        When `structured` is set, the adapter should constrain the output to the
+        schema of `step_name` and return the parsed object in `Completion.data`.
+        `model` overrides the client's default model for this call.
+        """
+        raise NotImplementedError
+
+    def warm_up(self, ping: bool = False):
+        """Prepare the transport before the first request.
+
+        Adapters open pooled connections here; with `ping`, a minimal request is
+        also sent to the model.
+        """
+        if ping:
+            self._invoke("ping", max_tokens=1, step_name="WARMUP")
+
+    def _invoke_json(
+        self,
+        prompt: str,
+        image_base64: Optional[str] = None,
+        media_type: str = "image/png",
+        max_tokens: Optional[int] = None,
+        step_name: str = "INVOKE",
+        template: Optional[str] = None
+    ) -> dict:
+        """Invoke the provider and return the step result as a dict.
+
+        The model comes from the routing table. When the route is a cascade,
+        each model's output (normalized first, so shapes the pipeline fixes up
+        anyway do not count against it) must pass schema validation and the
+        step's quality checks, or the call escalates to the next model; the
+        last model's output is returned as-is.
+        """
+        step_key = f"{step_name}:{template}" if template else step_name
+        models = model_router.models_for(self.provider, step_key, self.model, self.fast_model)
+        emit("substep_started", step=step_name, template=template, model=models[0])
+        start = time.perf_counter()
+        for n, model in enumerate(models):
+            if n == len(models) - 1:
+                parsed = self._invoke_model_json(model, prompt, image_base64, media_type, max_tokens, step_name, step_key)
+                parsed = self._normalize_output(step_name, parsed)
+                break
+            try:
+                parsed = self._invoke_model_json(model, prompt, image_base64, media_type, max_tokens, step_name, step_key)
+                parsed = self._normalize_output(step_name, parsed)
+                problem = output_problem(step_name, parsed)
+            except ValueError as e:
+                problem = f"unparseable output ({e})"
+            if problem is None:
+                break
+            self.log(step_name, f"Escalating from {model} to {models[n + 1]}: {problem}")
+
+        seconds = time.perf_counter() - start
+        if not isolated_calls.get():
+            model_router.record(self.provider, step_key, model, n, seconds)
+        emit("substep_finished", step=step_name, template=template, model=model, escalations=n,
+             seconds=round(seconds, 3), usage=dict(request_usage.get() or {}), result=parsed)
+        return parsed
+
+    def _invoke_model_json(
+        self,
+        model: str,
+        prompt: str,
+        image_base64: Optional[str],
+        media_type: str,
+        max_tokens: Optional[int],
+        step_name: str,
+        step_key: str
+    ) -> dict:
+        """Invoke one model and parse its output.
+
+        When `max_tokens` is omitted it is chosen from recent output sizes for
+        this step (and template) on this model; a truncated response is retried
+        once at the full ceiling.
+        """
+        # Output sizes differ between models, so routed models keep their own history
+        history_key = step_key if model == self.model else f"{step_key}@{model}"
+        estimated_input = token_accountant.estimate_input(self.provider, prompt, image_base64)
+        token_accountant.check_budget(estimated_input)
+        if max_tokens is None:
+            max_tokens = token_accountant.max_tokens_for(self.provider, history_key)
+        self.log(step_name, f"Pre-flight estimate: ~{estimated_input} input tokens, max_tokens={max_tokens}, model={model}")
+
+        typical_output = token_accountant.typical_output_tokens(self.provider, history_key)
+        sent = False
+        try:
+            # Checked again once admitted: the client may have left while this call was queued
+            check_cancelled()
+            with admission_controller.slot(self.provider):
+                check_cancelled()
+                sent = True
+                completion = self._invoke_recorded(prompt, image_base64, media_type, max_tokens, step_name, model)
+        except RequestCancelled as e:
+            if sent:
+                cancellation_stats.aborted(max(0, typical_output - e.output_tokens))
+                self.log(step_name, f"Aborted after {e.output_tokens} output tokens: client disconnected")
+            else:
+                cancellation_stats.skipped(estimated_input, typical_output)
+                self.log(step_name, "Skipped: client disconnected")
+            raise
+        truncated = completion.stop_reason in TRUNCATED_STOP_REASONS
+        token_accountant.record(self.provider, history_key, estimated_input, completion.usage, truncated=truncated)
+
+        if truncated and max_tokens < MAX_OUTPUT_TOKENS:
+            self.log(step_name, f"Response truncated at max_tokens={max_tokens}, retrying with {MAX_OUTPUT_TOKENS}")
+            return self._invoke_model_json(model, prompt, image_base64, media_type, MAX_OUTPUT_TOKENS, step_name, step_key)
+
+        return self._parse_completion(completion, step_name)
+
+    def _invoke_recorded(self, prompt, image_base64, media_type, max_tokens, step_name, model) -> Completion:
+        """`_invoke`, recorded to or replayed from the cassette when CASSETTE_MODE is set (isolated calls are only replayed)."""
+        structured = self.structured_output
+        call = functools.partial(self._invoke, prompt, image_base64, media_type, max_tokens=max_tokens,
+                                 step_name=step_name, structured=structured, model=model)
+        if cassette.mode == "off" or (isolated_calls.get() and not cassette.replaying):
+            return call()
+        key = request_hash(self.provider, model, step_name, structured, prompt, image_base64, media_type)
+        return Completion(**cassette.call(key, lambda: asdict(call()), provider=self.provider, model=model, step=step_name))
+
+    def _parse_completion(self, completion: Completion, step_name: str) -> dict:
+        """Get the step result from a completion, preferring structured output."""
+        if completion.data is not None:
+            self.log(step_name, "Received structured response", completion.data)
+            return completion.data
+
+        if self.structured_output:
+            self.log(step_name, f"No structured output in response (stop_reason: {completion.stop_reason}), falling back to extraction")
+        self.log(step_name, "Raw response:", completion.text[:2000])
+        return self._extract_json(completion.text, step_name=step_name)
+
+    def _fix_json(self, text: str) -> str:
+        """Fix common JSON issues from LLM responses."""
+        text = re.sub(r',(\s*[}\]])', r'\1', text)
+        text = re.sub(r'(?<!\\)\n(?=.*")', '\\n', text)
+        text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+        return text
+
+    def _extract_json(self, text: str, step_name: str = "PARSE") -> dict:
+        """Extract JSON from model response text."""
+        self.log(step_name, "Extracting JSON from response...")
+
+        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+        if json_match:
+            self.log(step_name, "Found JSON in code block")
+            text = json_match.group(1)
+
+        try:
+            parsed = json.loads(text)
+            self.log(step_name, "Successfully parsed JSON", parsed)
+            return parsed
+        except json.JSONDecodeError:
+            start = text.find("{")
+            end = text.rfind("}") + 1
+            if start != -1 and end > start:
+                json_str = text[start:end]
+                try:
+                    parsed = json.loads(json_str)
+                    self.log(step_name, "Extracted JSON from text", parsed)
+                    return parsed
+                except json.JSONDecodeError:
+                    fixed = self._fix_json(json_str)
+                    try:
+                        parsed = json.loads(fixed)
+                        self.log(step_name, "Parsed JSON after fixing", parsed)
+                        return parsed
+                    except json.JSONDecodeError as e:
+                        self.log(step_name, f"FAILED to parse JSON: {e}")
+            self.log(step_name, f"FAILED to extract JSON. Raw text: {text[:500]}")
+            raise ValueError(f"Could not extract JSON from response: {text[:500]}")
+
+    def analyze_diagram(self, image_base64: str, media_type: str = "image/png", custom_prompt: Optional[str] = None) -> dict:
+        """Step 1: Analyze the architecture diagram."""
+        self.log("STEP-1", "STARTING ARCHITECTURE DIAGRAM ANALYSIS")
+
+        prompt = custom_prompt if custom_prompt else load_prompt("step1_analyze.txt")
+        parsed = self._invoke_json(prompt, image_base64, media_type, step_name="STEP-1")
+
+        self.log("STEP-1", "ARCHITECTURE ANALYSIS COMPLETE", {
+            "entry_points_count": len(parsed.get("entry_points", [])),
+            "data_flows_count": len(parsed.get("data_flows", [])),
+        })
+
+        return parsed
+
+    def extract_components(self, image_base64: str, media_type: str = "image/png", custom_prompts: Optional[Dict[str, str]] = None) -> dict:
+        """Step 2: Extract components directly from image using 3 specialized prompts."""
+        self.log("STEP-2", "STARTING COMPONENT EXTRACTION")
+
+        results = {}
+        prompts = custom_prompts or {}
+
+        # PROMPT 2A: Application Description
+        self.log("STEP-2A", "EXTRACTING APPLICATION DESCRIPTION")
+        prompt1 = prompts.get("app_desc") or load_prompt("step2_A_application_description.txt")
+        parsed1 = self._invoke_json(prompt1, image_base64, media_type, step_name="STEP-2A")
+        results["application_description"] = parsed1.get("application_description", "")
+
+        # PROMPT 2B: Key Features
+        self.log("STEP-2B", "EXTRACTING KEY FEATURES")
+        prompt2 = prompts.get("features") or load_prompt("step2_B_key_features.txt")
+        parsed2 = self._invoke_json(prompt2, image_base64, media_type, step_name="STEP-2B")
+        results["key_features"] = parsed2.get("key_features", [])
+
+        # PROMPT 2C: In-Scope Components
+        self.log("STEP-2C", "EXTRACTING IN-SCOPE COMPONENTS")
+        prompt3 = prompts.get("components") or load_prompt("step2_C_in_scope_components.txt")
+        parsed3 = self._invoke_json(prompt3, image_base64, media_type, step_name="STEP-2C")
+
+        results["in_scope_components"] = self._normalize_components(parsed3)
+
+        self.log("STEP-2", "COMPONENT EXTRACTION COMPLETE", {
+            "description_length": len(results.get("application_description", "")),
+            "features_count": len(results.get("key_features", [])),
+            "components_count": len(results.get("in_scope_components", []))
+        })
+
+        return results
+
+    def generate_threats(
+        self,
+        application_description: str,
+        in_scope_components: list,
+        key_features: list,
+        template: str = "baseline",
+        custom_prompt: Optional[str] = None
+    ) -> dict:
+        """Step 3: Generate threat scenarios."""
+        self.log("STEP-3", f"STARTING THREAT GENERATION (template: {template})")
+
+        prompt = self._threats_prompt(application_description, in_scope_components, key_features, template, custom_prompt)
+        parsed = self._normalize_threats(self._invoke_json(prompt, step_name="STEP-3", template=template), in_scope_components)
+
+        self.log("STEP-3", "THREAT GENERATION COMPLETE", {"threats_count": len(parsed.get("threats", []))})
+
+        return parsed
+
+    def _threats_prompt(
+        self,
+        application_description: str,
+        in_scope_components: list,
+        key_features: list,
+        template: str = "baseline",
+        custom_prompt: Optional[str] = None
+    ) -> str:
+        """Fill the Step 3 prompt template with the validated Step 2 output."""
+        if custom_prompt:
+            prompt_template = custom_prompt
+        else:
+            template_file = f"step3_{template}.txt"
+            prompt_template = load_prompt(template_file)
+
+        if in_scope_components and isinstance(in_scope_components[0], dict):
+            components_str = json.dumps([c.get("name", str(c)) for c in in_scope_components])
+        else:
+            components_str = json.dumps(in_scope_components)
+
+        return prompt_template.replace(
+            "{application_description}", application_description
+        ).replace(
+            "{in_scope_components}", components_str
+        ).replace(
+            "{key_features}", json.dumps(key_features)
+        )
+
+    def _normalize_output(self, step_name: str, parsed: dict) -> dict:
+        """Coerce output shapes the pipeline accepts into the ones the step schema expects.
+
+        Component names given as plain strings become {name, category} dicts and
+        list-valued threat fields are joined into strings.
+        """
+        if not isinstance(parsed, dict):
+            return parsed
+        if step_name == "STEP-2C" and isinstance(parsed.get("in_scope_components"), list):
+            parsed["in_scope_components"] = self._normalize_components(parsed)
+        elif step_name == "STEP-3" and isinstance(parsed.get("threats"), list):
+            for threat in parsed["threats"]:
+                if not isinstance(threat, dict):
+                    continue
+                if isinstance(threat.get("mitigations"), list):
+                    threat["mitigations"] = " ".join(map(str, threat["mitigations"]))
+                if isinstance(threat.get("mitre_technique"), list):
+                    threat["mitre_technique"] = ", ".join(map(str, threat["mitre_technique"]))
+        return parsed
+
+    def _normalize_components(self, parsed: dict) -> list:
+        """Coerce Step 2C output into a list of {name, category} dicts."""
+        components = parsed.get("in_scope_components", [])
+        return [c if isinstance(c, dict) else {"name": str(c), "category": "other"} for c in components]
+
+    def _normalize_threats(self, parsed: dict, components: list = None) -> dict:
+        """Normalize Step 3 output, validate MITRE IDs and (with THREAT_DEDUP) merge near-duplicates."""
+        self._normalize_output("STEP-3", parsed)
+        if "threats" in parsed:
+            for threat in parsed["threats"]:
+                attack_index.enrich_threat(threat)
+            if THREAT_DEDUP:
+                count = len(parsed["threats"])
+                parsed["threats"] = dedupe_threats(parsed["threats"], components=components)
+                if len(parsed["threats"]) < count:
+                    self.log("STEP-3", f"Merged {count - len(parsed['threats'])} near-duplicate threats")
+        return parsed
+
+
+def anthropic_messages(prompt: str, image_base64: Optional[str] = None, media_type: str = "image/png") -> list:
+    """Build an Anthropic Messages API user turn (shared by Claude and Bedrock)."""
+    content = []
+    if image_base64:
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": image_base64
+            }
+        })
+    content.append({"type": "text", "text": prompt})
+    return [{"role": "user", "content": content}]
+
+
+def sse_events(lines: Iterable[str]) -> Iterator[dict]:
+    """JSON payloads of a server-sent event stream's `data:` lines."""
+    for line in lines:
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield json.loads(data)
+
+
+def anthropic_stream_completion(events: Iterable[dict], tool_name: Optional[str] = None) -> Completion:
+    """Fold Anthropic Messages streaming events into a Completion.
+
+    Cancellation is checked between events, so a disconnected client stops the
+    stream (and its billing) at the next token.
+    """
+    completion = Completion()
+    text, tool_json, usage = [], [], {}
+    chars = 0
+    for event in events:
+        kind = event.get("type")
+        if kind == "message_start":
+            usage.update(event["message"].get("usage") or {})
+        elif kind == "content_block_delta":
+            delta = event.get("delta", {})
+            if delta.get("type") == "text_delta":
+                text.append(delta.get("text", ""))
+                chars += len(text[-1])
+            elif delta.get("type") == "input_json_delta":
+                tool_json.append(delta.get("partial_json", ""))
+                chars += len(tool_json[-1])
+        elif kind == "message_delta":
+            completion.stop_reason = event.get("delta", {}).get("stop_reason") or completion.stop_reason
+            usage.update(event.get("usage") or {})
+        elif kind == "error":
+            raise RuntimeError(f"Stream error: {event.get('error')}")
+        check_cancelled(output_tokens=chars // 4)
+
+    completion.text = "".join(text)
+    completion.usage = usage
+    if tool_name and tool_json:
+        try:
+            completion.data = json.loads("".join(tool_json))
+        except json.JSONDecodeError:
+            # Cut off (at max_tokens): the stop reason triggers the retry
+            completion.text = completion.text or "".join(tool_json)
+    return completion
+
+
+def anthropic_completion(result: dict, tool_name: Optional[str] = None) -> Completion:
+    """Convert an Anthropic Messages API response body into a Completion."""
+    blocks = result.get("content", [])
+    completion = Completion(
+        text="".join(b.get("text", "") for b in blocks if b.get("type") == "text"),
+        stop_reason=result.get("stop_reason"),
+        usage=result.get("usage") or {}
+    )
+    if tool_name:
+        for block in blocks:
+            if block.get("type") == "tool_use" and block.get("name") == tool_name:
+                completion.data = block["input"]
+                break
+    return completion
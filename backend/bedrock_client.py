@@ -1,249 +1,228 @@
-import boto3
+import os
 import json
-import re
-from pathlib import Path
-from datetime import datetime
-from typing import Optional, Dict
-
-PROMPTS_DIR = Path(__file__).parent / "prompts"
-
-
-def log(step: str, message: str, data: any = None):
-    """Log a message with timestamp and step info."""
-    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-    print(f"\n{'='*60}")
-    print(f"[{timestamp}] BEDROCK - {step}")
-    print(f"{'='*60}")
-    print(f">> {message}")
-    if data:
-        if isinstance(data, dict) or isinstance(data, list):
-            print(f"\n{json.dumps(data, indent=2)[:2000]}")
-        else:
-            print(f"\n{str(data)[:2000]}")
-    print(f"{'='*60}\n")
-
-
-def load_prompt(filename: str) -> str:
-    """Load a prompt template from the prompts directory."""
-    filepath = PROMPTS_DIR / filename
-    with open(filepath, "r") as f:
-        return f.read()
-
-
-class BedrockClient:
-    def __init__(self, region_name: str = "us-east-1"):
-        log("INIT", f"Initializing Bedrock client in region: {region_name}")
-        self.client = boto3.client("bedrock-runtime", region_name=region_name)
-        self.model_id = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-        log("INIT", f"Using model: {self.model_id}")
-
-    def _invoke(self, messages: list, max_tokens: int = 4096, step_name: str = "INVOKE") -> dict:
-        """Invoke the Bedrock model with messages."""
-        log(step_name, f"Sending request to Bedrock (max_tokens: {max_tokens})")
-
-        response = self.client.invoke_model(
-            modelId=self.model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": max_tokens,
-                "messages": messages
-            })
-        )
-        result = json.loads(response["body"].read())
-
-        log(step_name, "Received response from Bedrock", {
-            "stop_reason": result.get("stop_reason"),
-            "usage": result.get("usage"),
-            "response_length": len(result["content"][0]["text"]) if result.get("content") else 0
+import threading
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from typing import Optional, Dict, List
+
+from base_client import BaseClient, Completion, anthropic_messages, anthropic_completion, anthropic_stream_completion, log
+from cancellation import cancellable, check_cancelled
+from images import json_body, encoded_image
+from schemas import TOOL_NAME, tool_definition
+
+BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20241022-v2:0")
+# Tried first when MODEL_CASCADE is on
+BEDROCK_FAST_MODEL_ID = os.environ.get("BEDROCK_FAST_MODEL_ID", "us.anthropic.claude-3-5-haiku-20241022-v1:0")
+# Regions to spread calls across; the cross-region ("us.") inference profile is valid in each
+BEDROCK_REGIONS = [r.strip() for r in os.environ.get("BEDROCK_REGIONS", "").split(",") if r.strip()]
+# "invoke" (InvokeModel), "converse" (Converse) or "converse_stream" (ConverseStream)
+BEDROCK_API = os.environ.get("BEDROCK_API", "invoke")
+
+BEDROCK_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50")),
+    connect_timeout=float(os.environ.get("BEDROCK_CONNECT_TIMEOUT", "10")),
+    read_timeout=float(os.environ.get("BEDROCK_READ_TIMEOUT", "300")),
+    retries={"mode": "adaptive", "max_attempts": int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "5"))},
+    tcp_keepalive=True,
+)
+
+# bedrock-runtime clients are thread-safe, so every BedrockClient shares one per region
+_runtime_clients: Dict[str, object] = {}
+_runtime_lock = threading.Lock()
+
+
+def get_runtime_client(region_name: str):
+    """Get the shared, tuned bedrock-runtime client for a region."""
+    with _runtime_lock:
+        if region_name not in _runtime_clients:
+            _runtime_clients[region_name] = boto3.client("bedrock-runtime", region_name=region_name, config=BEDROCK_CONFIG)
+        return _runtime_clients[region_name]
+
+
+def converse_messages(prompt: str, image_base64: Optional[str] = None, media_type: str = "image/png") -> list:
+    """Build a Converse API user turn."""
+    content = []
+    if image_base64:
+        content.append({
+            "image": {
+                "format": media_type.split("/")[-1].replace("jpg", "jpeg"),
+                # Decoded once per image and shared by every call that sends it
+                "source": {"bytes": encoded_image(image_base64).raw}
+            }
         })
-
-        return result
-
-    def _fix_json(self, text: str) -> str:
-        """Fix common JSON issues from LLM responses."""
-        text = re.sub(r',(\s*[}\]])', r'\1', text)
-        text = re.sub(r'(?<!\\)\n(?=.*")', '\\n', text)
-        text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-        return text
-
-    def _extract_json(self, text: str, step_name: str = "PARSE") -> dict:
-        """Extract JSON from model response text."""
-        log(step_name, "Extracting JSON from response...")
-
-        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
-        if json_match:
-            log(step_name, "Found JSON in code block")
-            text = json_match.group(1)
-
+    content.append({"text": prompt})
+    return [{"role": "user", "content": content}]
+
+
+def converse_tool_config(step_name: str) -> dict:
+    tool = tool_definition(step_name)
+    return {
+        "tools": [{"toolSpec": {
+            "name": tool["name"],
+            "description": tool["description"],
+            "inputSchema": {"json": tool["input_schema"]}
+        }}],
+        "toolChoice": {"tool": {"name": tool["name"]}}
+    }
+
+
+class BedrockClient(BaseClient):
+    provider = "bedrock"
+    fast_model = BEDROCK_FAST_MODEL_ID
+
+    def __init__(self, region_name: str = "us-east-1", structured_output: Optional[bool] = None,
+                 regions: Optional[List[str]] = None, api: str = BEDROCK_API):
+        self.regions = regions or BEDROCK_REGIONS or [region_name]
+        self.api = api
+        log("INIT", f"Initializing Bedrock client in regions: {', '.join(self.regions)} (api: {self.api})", source="BEDROCK")
+        self.clients = {region: get_runtime_client(region) for region in self.regions}
+        self.client = self.clients[self.regions[0]]
+        self._in_flight = {region: 0 for region in self.regions}
+        self._lock = threading.Lock()
+        super().__init__(BEDROCK_MODEL_ID, structured_output)
+
+    def warm_up(self, ping: bool = False):
+        # ListAsyncInvokes is free; it resolves credentials and leaves a connection in each region's pool
+        for region, client in self.clients.items():
+            try:
+                client.list_async_invokes(maxResults=1)
+            except ClientError as e:
+                # Denied is fine: the connection (and TLS session) is open either way
+                self.log("WARMUP", f"{region}: {e.response['Error']['Code']}")
+        super().warm_up(ping)
+
+    def _acquire_region(self) -> str:
+        """Pick the region with the fewest in-flight calls from this process."""
+        with self._lock:
+            region = min(self.regions, key=lambda r: self._in_flight[r])
+            self._in_flight[region] += 1
+            return region
+
+    def _release_region(self, region: str):
+        with self._lock:
+            self._in_flight[region] -= 1
+
+    def _invoke(
+        self,
+        prompt: str,
+        image_base64: Optional[str] = None,
+        media_type: str = "image/png",
+        max_tokens: int = 4096,
+        step_name: str = "INVOKE",
+        structured: bool = False,
+        model: Optional[str] = None
+    ) -> Completion:
+        """Invoke the Bedrock model with messages."""
+        model = model or self.model
+        region = self._acquire_region()
+        self.log(step_name, f"Sending request to Bedrock (region: {region}, api: {self.api}, model: {model}, max_tokens: {max_tokens})")
         try:
-            parsed = json.loads(text)
-            log(step_name, "Successfully parsed JSON", parsed)
-            return parsed
-        except json.JSONDecodeError:
-            start = text.find("{")
-            end = text.rfind("}") + 1
-            if start != -1 and end > start:
-                json_str = text[start:end]
-                try:
-                    parsed = json.loads(json_str)
-                    log(step_name, "Extracted JSON from text", parsed)
-                    return parsed
-                except json.JSONDecodeError:
-                    fixed = self._fix_json(json_str)
-                    try:
-                        parsed = json.loads(fixed)
-                        log(step_name, "Parsed JSON after fixing", parsed)
-                        return parsed
-                    except json.JSONDecodeError as e:
-                        log(step_name, f"FAILED to parse JSON: {e}")
-            log(step_name, f"FAILED to extract JSON. Raw text: {text[:500]}")
-            raise ValueError(f"Could not extract JSON from response: {text[:500]}")
-
-    def analyze_diagram(self, image_base64: str, media_type: str = "image/png", custom_prompt: Optional[str] = None) -> dict:
-        """Step 1: Analyze the architecture diagram."""
-        log("STEP-1", "STARTING ARCHITECTURE DIAGRAM ANALYSIS")
-
-        prompt = custom_prompt if custom_prompt else load_prompt("step1_analyze.txt")
-
-        messages = [{
-            "role": "user",
-            "content": [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": media_type,
-                        "data": image_base64
-                    }
-                },
-                {"type": "text", "text": prompt}
-            ]
-        }]
-
-        result = self._invoke(messages, max_tokens=8192, step_name="STEP-1")
-        response_text = result["content"][0]["text"]
-
-        log("STEP-1", "Raw response:", response_text[:2000])
-        parsed = self._extract_json(response_text, step_name="STEP-1")
-
-        log("STEP-1", "ARCHITECTURE ANALYSIS COMPLETE", {
-            "entry_points_count": len(parsed.get("entry_points", [])),
-            "data_flows_count": len(parsed.get("data_flows", [])),
+            client = self.clients[region]
+            args = (client, model, prompt, image_base64, media_type, max_tokens, step_name, structured)
+            # A cancellable call streams so it can be dropped mid-generation
+            if self.api == "converse_stream" or (self.api == "converse" and cancellable()):
+                completion = self._converse_stream(*args)
+            elif self.api == "converse":
+                completion = self._converse(*args)
+            else:
+                completion = self._invoke_model(*args)
+        finally:
+            self._release_region(region)
+
+        self.log(step_name, "Received response from Bedrock", {
+            "stop_reason": completion.stop_reason,
+            "usage": completion.usage,
+            "response_length": len(completion.text)
         })
-
-        return parsed
-
-    def extract_components(self, image_base64: str, media_type: str = "image/png", custom_prompts: Optional[Dict[str, str]] = None) -> dict:
-        """Step 2: Extract components directly from image using 3 specialized prompts."""
-        log("STEP-2", "STARTING COMPONENT EXTRACTION")
-
-        results = {}
-        prompts = custom_prompts or {}
-
-        # PROMPT 2A: Application Description
-        log("STEP-2A", "EXTRACTING APPLICATION DESCRIPTION")
-        prompt1 = prompts.get("app_desc") or load_prompt("step2_A_application_description.txt")
-        messages1 = [{
-            "role": "user",
-            "content": [
-                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}},
-                {"type": "text", "text": prompt1}
-            ]
-        }]
-        result1 = self._invoke(messages1, max_tokens=8192, step_name="STEP-2A")
-        parsed1 = self._extract_json(result1["content"][0]["text"], step_name="STEP-2A")
-        results["application_description"] = parsed1.get("application_description", "")
-
-        # PROMPT 2B: Key Features
-        log("STEP-2B", "EXTRACTING KEY FEATURES")
-        prompt2 = prompts.get("features") or load_prompt("step2_B_key_features.txt")
-        messages2 = [{
-            "role": "user",
-            "content": [
-                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}},
-                {"type": "text", "text": prompt2}
-            ]
-        }]
-        result2 = self._invoke(messages2, max_tokens=8192, step_name="STEP-2B")
-        parsed2 = self._extract_json(result2["content"][0]["text"], step_name="STEP-2B")
-        results["key_features"] = parsed2.get("key_features", [])
-
-        # PROMPT 2C: In-Scope Components
-        log("STEP-2C", "EXTRACTING IN-SCOPE COMPONENTS")
-        prompt3 = prompts.get("components") or load_prompt("step2_C_in_scope_components.txt")
-        messages3 = [{
-            "role": "user",
-            "content": [
-                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}},
-                {"type": "text", "text": prompt3}
-            ]
-        }]
-        result3 = self._invoke(messages3, max_tokens=8192, step_name="STEP-2C")
-        parsed3 = self._extract_json(result3["content"][0]["text"], step_name="STEP-2C")
-
-        components = parsed3.get("in_scope_components", [])
-        if components and isinstance(components[0], dict):
-            results["in_scope_components"] = components
-        else:
-            results["in_scope_components"] = [{"name": c, "category": "other"} for c in components]
-
-        log("STEP-2", "COMPONENT EXTRACTION COMPLETE", {
-            "description_length": len(results.get("application_description", "")),
-            "features_count": len(results.get("key_features", [])),
-            "components_count": len(results.get("in_scope_components", []))
-        })
-
-        return results
-
-    def generate_threats(
-        self,
-        application_description: str,
-        in_scope_components: list,
-        key_features: list,
-        template: str = "baseline",
-        custom_prompt: Optional[str] = None
-    ) -> dict:
-        """Step 3: Generate threat scenarios."""
-        log("STEP-3", f"STARTING THREAT GENERATION (template: {template})")
-
-        if custom_prompt:
-            prompt_template = custom_prompt
-        else:
-            template_file = f"step3_{template}.txt"
-            prompt_template = load_prompt(template_file)
-
-        if in_scope_components and isinstance(in_scope_components[0], dict):
-            components_str = json.dumps([c.get("name", str(c)) for c in in_scope_components])
-        else:
-            components_str = json.dumps(in_scope_components)
-
-        prompt = prompt_template.replace(
-            "{application_description}", application_description
-        ).replace(
-            "{in_scope_components}", components_str
-        ).replace(
-            "{key_features}", json.dumps(key_features)
+        return completion
+
+    def _invoke_model(self, client, model, prompt, image_base64, media_type, max_tokens, step_name, structured) -> Completion:
+        """InvokeModel with an Anthropic Messages body."""
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "messages": anthropic_messages(prompt, image_base64, media_type)
+        }
+        if structured:
+            body["tools"] = [tool_definition(step_name)]
+            body["tool_choice"] = {"type": "tool", "name": TOOL_NAME}
+
+        # Signing needs the whole body, so the chunks are joined once rather than re-serializing the image
+        body = b"".join(json_body(body, image_base64))
+        if cancellable():
+            response = client.invoke_model_with_response_stream(modelId=model, body=body)
+            stream = response["body"]
+            try:
+                events = (json.loads(event["chunk"]["bytes"]) for event in stream if "chunk" in event)
+                return anthropic_stream_completion(events, TOOL_NAME if structured else None)
+            finally:
+                stream.close()
+
+        response = client.invoke_model(modelId=model, body=body)
+        # Decode straight from the streaming body instead of buffering it first
+        result = json.load(response["body"])
+        return anthropic_completion(result, TOOL_NAME if structured else None)
+
+    def _converse_request(self, model, prompt, image_base64, media_type, max_tokens, step_name, structured) -> dict:
+        request = {
+            "modelId": model,
+            "messages": converse_messages(prompt, image_base64, media_type),
+            "inferenceConfig": {"maxTokens": max_tokens}
+        }
+        if structured:
+            request["toolConfig"] = converse_tool_config(step_name)
+        return request
+
+    def _converse(self, client, model, prompt, image_base64, media_type, max_tokens, step_name, structured) -> Completion:
+        """Converse API call."""
+        result = client.converse(**self._converse_request(model, prompt, image_base64, media_type, max_tokens, step_name, structured))
+
+        blocks = result.get("output", {}).get("message", {}).get("content", [])
+        usage = result.get("usage", {})
+        completion = Completion(
+            text="".join(b.get("text", "") for b in blocks),
+            stop_reason=result.get("stopReason"),
+            usage={"input_tokens": usage.get("inputTokens"), "output_tokens": usage.get("outputTokens")}
         )
-
-        messages = [{
-            "role": "user",
-            "content": [{"type": "text", "text": prompt}]
-        }]
-
-        result = self._invoke(messages, max_tokens=8192, step_name="STEP-3")
-        response_text = result["content"][0]["text"]
-
-        log("STEP-3", "Raw response:", response_text[:2000])
-        parsed = self._extract_json(response_text, step_name="STEP-3")
-
-        # Normalize threats
-        if "threats" in parsed:
-            for threat in parsed["threats"]:
-                if isinstance(threat.get("mitigations"), list):
-                    threat["mitigations"] = " ".join(threat["mitigations"])
-                if isinstance(threat.get("mitre_technique"), list):
-                    threat["mitre_technique"] = ", ".join(threat["mitre_technique"])
-
-        log("STEP-3", "THREAT GENERATION COMPLETE", {"threats_count": len(parsed.get("threats", []))})
-
-        return parsed
+        if structured:
+            for block in blocks:
+                if block.get("toolUse", {}).get("name") == TOOL_NAME:
+                    completion.data = block["toolUse"]["input"]
+                    break
+        return completion
+
+    def _converse_stream(self, client, model, prompt, image_base64, media_type, max_tokens, step_name, structured) -> Completion:
+        """ConverseStream API call, accumulating text and tool input deltas as they arrive."""
+        response = client.converse_stream(**self._converse_request(model, prompt, image_base64, media_type, max_tokens, step_name, structured))
+
+        text_parts, tool_parts = [], []
+        chars = 0
+        completion = Completion()
+        stream = response["stream"]
+        try:
+            for event in stream:
+                if "contentBlockDelta" in event:
+                    delta = event["contentBlockDelta"]["delta"]
+                    if "text" in delta:
+                        text_parts.append(delta["text"])
+                        chars += len(delta["text"])
+                    elif "toolUse" in delta:
+                        tool_parts.append(delta["toolUse"].get("input", ""))
+                        chars += len(tool_parts[-1])
+                elif "messageStop" in event:
+                    completion.stop_reason = event["messageStop"].get("stopReason")
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage", {})
+                    completion.usage = {"input_tokens": usage.get("inputTokens"), "output_tokens": usage.get("outputTokens")}
+                check_cancelled(output_tokens=chars // 4)
+        finally:
+            stream.close()
+
+        completion.text = "".join(text_parts)
+        if structured and tool_parts:
+            try:
+                completion.data = json.loads("".join(tool_parts))
+            except json.JSONDecodeError:
+                completion.text = completion.text or "".join(tool_parts)
+        return completion
@@ -0,0 +1,148 @@
+"""Bedrock client throughput and connection reuse against a local fake endpoint.
+
+Starts an HTTP/1.1 stand-in for bedrock-runtime (InvokeModel and Converse,
+each answering after --latency seconds) and sends bursts of --concurrency
+calls through BedrockClient._invoke, --pause seconds apart, once per pool
+size. max_pool_connections bounds the idle connections botocore keeps: with
+the default of 10, a burst of 32 opens 22 new connections (TCP and, against
+the real endpoint, TLS handshakes) that are discarded when it ends; with
+BEDROCK_MAX_POOL_CONNECTIONS at or above the burst size, every burst after
+the first reuses open connections.
+
+    python bench_bedrock.py --concurrency 32 --bursts 8 --latency 0.2 --pools 10,50
+"""
+import json
+import time
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import boto3
+from botocore.config import Config
+
+from bedrock_client import BEDROCK_CONFIG, BedrockClient
+
+INVOKE_RESPONSE = {"content": [{"type": "text", "text": '{"key_features": ["HTTPS termination"]}'}],
+                   "stop_reason": "end_turn", "usage": {"input_tokens": 600, "output_tokens": 20}}
+CONVERSE_RESPONSE = {"output": {"message": {"role": "assistant", "content": [{"text": '{"key_features": []}'}]}},
+                     "stopReason": "end_turn", "usage": {"inputTokens": 600, "outputTokens": 20, "totalTokens": 620},
+                     "metrics": {"latencyMs": 0}}
+
+
+class FakeBedrock(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # A burst of new connections must not overflow the listen backlog
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeBedrockHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeBedrockHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a connection serves several calls when the client reuses it
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = json.dumps(CONVERSE_RESPONSE if self.path.endswith("/converse") else INVOKE_RESPONSE).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_pool(server: FakeBedrock, api: str, pool_size: int, concurrency: int, bursts: int, pause: float) -> dict:
+    runtime = boto3.client(
+        "bedrock-runtime", region_name="us-east-1", endpoint_url=server.url,
+        aws_access_key_id="bench", aws_secret_access_key="bench",
+        config=BEDROCK_CONFIG.merge(Config(max_pool_connections=pool_size, retries={"max_attempts": 1})),
+    )
+    client = BedrockClient(regions=["us-east-1"], api=api)
+    client.clients = {"us-east-1": runtime}
+
+    def call(_):
+        start = time.perf_counter()
+        client._invoke("List the key features", max_tokens=256, step_name="BENCH")
+        return time.perf_counter() - start
+
+    connections_before, requests_before = server.connections, server.requests
+    latencies, busy = [], 0.0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for burst in range(bursts):
+            if burst:
+                time.sleep(pause)
+            start = time.perf_counter()
+            latencies.extend(pool.map(call, range(concurrency)))
+            busy += time.perf_counter() - start
+    latencies.sort()
+
+    requests = server.requests - requests_before
+    connections = server.connections - connections_before
+    return {
+        "pool": pool_size,
+        "requests": requests,
+        "req_per_s": round(requests / busy, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        "connections": connections,
+        "calls_per_connection": round(requests / connections, 1) if connections else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="invoke", choices=["invoke", "converse"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bursts", type=int, default=8)
+    parser.add_argument("--pause", type=float, default=0.5, help="Idle seconds between bursts")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the fake endpoint takes per call")
+    parser.add_argument("--pools", default=f"10,{BEDROCK_CONFIG.max_pool_connections}",
+                        help="Comma-separated max_pool_connections values to compare")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    server = FakeBedrock(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # The client logs every call; keep the report readable
+        with redirect_stdout(StringIO()):
+            results = [run_pool(server, args.api, int(size), args.concurrency, args.bursts, args.pause)
+                       for size in args.pools.split(",")]
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps({"api": args.api, "concurrency": args.concurrency, "latency": args.latency,
+                          "results": results}))
+        return
+    print(f"{'pool':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'conns':>6} {'calls/conn':>11}")
+    for r in results:
+        print(f"{r['pool']:>5} {r['req_per_s']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['connections']:>6} {r['calls_per_connection']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Event-loop lag and throughput under concurrent prompt reads.
+
+Compares the async pool (database.get_prompt with the prompt cache disabled)
+against the previous pattern of a blocking connect-and-query inside the event
+loop. A ticker coroutine that sleeps 1 ms measures how late the loop wakes it.
+
+    DATABASE_URL=postgresql://... python bench_db.py --readers 50 --reads 20
+"""
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import psycopg
+
+import database
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append((time.perf_counter() - start - 0.001) * 1000)
+
+
+def blocking_get_prompt(key: str) -> str:
+    with psycopg.connect(database.DATABASE_URL) as conn:
+        row = conn.execute("SELECT content FROM prompts WHERE key = %s", (key,)).fetchone()
+        return row[0] if row else ""
+
+
+async def run_mode(name: str, read, readers: int, reads: int):
+    keys = [p["key"] for p in database.PROMPT_DEFINITIONS]
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+
+    async def reader(i: int):
+        for n in range(reads):
+            await read(keys[(i + n) % len(keys)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(reader(i) for i in range(readers)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+
+    lags.sort()
+    total = readers * reads
+    print(f"{name:<10} {total / elapsed:>9.0f} {statistics.median(lags):>9.2f} "
+          f"{lags[int(len(lags) * 0.99) - 1]:>9.2f} {lags[-1]:>9.2f}")
+
+
+async def run(args):
+    if not await database.init_database():
+        sys.exit("DATABASE_URL must point at a Postgres database")
+    database.PROMPT_CACHE_TTL_SECONDS = 0  # Measure the database, not the cache
+
+    async def blocking(key):
+        return blocking_get_prompt(key)
+
+    print(f"{'mode':<10} {'reads/s':>9} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}  (ms)")
+    try:
+        await run_mode("async", database.get_prompt, args.readers, args.reads)
+        await run_mode("blocking", blocking, args.readers, args.reads)
+    finally:
+        await database.close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=50, help="Concurrent readers")
+    parser.add_argument("--reads", type=int, default=20, help="Reads per reader")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Near-duplicate threat merging time at growing threat counts.
+
+Builds synthetic threat sets with roughly one near-duplicate for every three
+distinct scenarios and reports the clusters found and the best of --repeat
+runs of dedupe_threats for each size.
+
+    python bench_dedup.py --sizes 100,1000,10000
+"""
+import time
+import random
+import argparse
+from typing import List
+
+from dedup import dedupe_threats
+
+
+def synthetic_threats(count: int, seed: int = 0) -> List[dict]:
+    """Threat sets with roughly one near-duplicate for every three distinct scenarios."""
+    rng = random.Random(seed)
+    actors = ["An external attacker", "A malicious insider", "A compromised workload", "An unauthenticated user"]
+    actions = ["exfiltrates", "tampers with", "deletes", "enumerates", "intercepts", "encrypts for ransom"]
+    assets = ["customer records", "session tokens", "IAM credentials", "audit logs", "payment data", "backups"]
+    paths = ["the public API gateway", "a misconfigured S3 bucket", "the ALB listener", "an exposed RDS snapshot",
+             "the CI/CD pipeline", "a vulnerable Lambda dependency", "the VPN endpoint", "a leaked access key"]
+    threats = []
+    while len(threats) < count:
+        scenario = (f"{rng.choice(actors)} {rng.choice(actions)} {rng.choice(assets)} in service "
+                    f"{rng.randrange(count)} via {rng.choice(paths)}.")
+        threats.append({"id": f"T{len(threats) + 1}", "scenario": scenario, "mitigations": "Enforce least privilege."})
+        if rng.random() < 0.33 and len(threats) < count:
+            threats.append({"id": f"T{len(threats) + 1}", "scenario": scenario.replace(" via ", " through "),
+                            "mitigations": "Enable logging and alerting."})
+    return threats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,500,1000,5000,10000", help="Comma-separated threat counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'threats':>8} {'clusters':>9} {'best ms':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        threats = synthetic_threats(size)
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            merged = dedupe_threats(threats)
+            best = min(best, time.perf_counter() - start)
+        print(f"{size:>8} {len(merged):>9} {best * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Orchestration overhead of the full pipeline, replayed from a cassette.
+
+Record a cassette once against a real provider (through the API or bulk mode):
+
+    CASSETTE_MODE=record CASSETTE_FILE=cassettes/aws.jsonl.gz uvicorn main:app
+
+then replay it offline. With the default --latency-scale 0 the timings are
+pure orchestration (prompt building, parsing, normalization, dedup, ATT&CK
+enrichment); compare the --json output between commits.
+
+    CASSETTE_FILE=cassettes/aws.jsonl.gz python bench_pipeline.py diagram.png --provider claude --runs 20
+"""
+import sys
+import json
+import time
+import base64
+import argparse
+import statistics
+from collections import defaultdict
+from typing import Dict, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from cassette import CassetteMiss, cassette
+from main import get_client, PROVIDER_CLIENTS
+
+
+def run(client, image_base64: str, media_type: str, templates: List[str], runs: int) -> Dict[str, List[float]]:
+    """Time each pipeline step over `runs` replays."""
+    timings = defaultdict(list)
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.analyze_diagram(image_base64, media_type)
+        timings["step1"].append(time.perf_counter() - start)
+
+        step_start = time.perf_counter()
+        components = client.extract_components(image_base64, media_type)
+        timings["step2"].append(time.perf_counter() - step_start)
+
+        for template in templates:
+            step_start = time.perf_counter()
+            client.generate_threats(components["application_description"], components["in_scope_components"],
+                                    components["key_features"], template)
+            timings[f"step3:{template}"].append(time.perf_counter() - step_start)
+        timings["pipeline"].append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="Diagram the cassette was recorded with")
+    parser.add_argument("--provider", default="bedrock", choices=list(PROVIDER_CLIENTS))
+    parser.add_argument("--templates", default="baseline", help="Comma-separated step 3 templates")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="Recorded latency multiplier (0 = overhead only)")
+    parser.add_argument("--json", action="store_true", help="Print timings as JSON")
+    args = parser.parse_args()
+
+    cassette.start_replay(args.latency_scale)
+    client = get_client(args.provider)
+    with open(args.image, "rb") as f:
+        image_base64 = base64.b64encode(f.read()).decode()
+    media_type = "image/jpeg" if args.image.lower().endswith((".jpg", ".jpeg")) else "image/png"
+
+    try:
+        timings = run(client, image_base64, media_type, args.templates.split(","), args.runs)
+    except CassetteMiss as e:
+        sys.exit(f"{e}; record it first with CASSETTE_MODE=record")
+
+    summary = {
+        step: {"p50_ms": round(statistics.median(s) * 1000, 2), "max_ms": round(max(s) * 1000, 2)}
+        for step, s in timings.items()
+    }
+    if args.json:
+        print(json.dumps({"runs": args.runs, "latency_scale": args.latency_scale, "steps": summary}))
+        return
+    print(f"{'step':<20} {'p50 ms':>9} {'max ms':>9}")
+    for step, stats in summary.items():
+        print(f"{step:<20} {stats['p50_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
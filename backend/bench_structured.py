@@ -0,0 +1,93 @@
+"""Parse-failure rate and latency with and without schema-constrained output.
+
+Runs every step prompt over the fixture diagrams (see prompt_eval.py) once
+with free-text output and JSON extraction, and once with STRUCTURED_OUTPUT
+(tool use, Converse toolConfig or a Gemini responseSchema). Reports parse
+success, schema conformance, truncation retries and latency per step. The
+fake provider only exercises the parse path; use a real provider (or a
+recorded cassette) for failure rates that mean anything.
+
+    python bench_structured.py --provider claude --repeats 5
+"""
+import json
+import argparse
+import importlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from base_client import load_prompt
+from database import PROMPT_DEFINITIONS
+from main import PROVIDER_CLIENTS
+from prompt_eval import EVAL_FIXTURES_DIR, PROMPT_STEPS, load_fixtures, run_once, summarize
+from token_budget import token_accountant
+
+PROMPT_FILES = {p["key"]: p["file"] for p in PROMPT_DEFINITIONS}
+
+
+def run_mode(provider: str, structured: bool, fixtures, keys, repeats: int, concurrency: int) -> dict:
+    module_name, class_name = PROVIDER_CLIENTS[provider]
+    client = getattr(importlib.import_module(module_name), class_name)(structured_output=structured)
+    retries_before = token_accountant.totals["truncation_retries"]
+
+    report = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        for key in keys:
+            step_name, template = PROMPT_STEPS[key]
+            prompt = load_prompt(PROMPT_FILES[key])
+            runnable = [f for f in fixtures if not template or f.step2]
+            jobs = [pool.submit(run_once, client, prompt, step_name, template, f)
+                    for f in runnable for _ in range(repeats)]
+            summary = summarize([job.result() for job in jobs])
+            report[key] = {k: summary[k] for k in ("runs", "provider_errors", "parse_success_rate",
+                                                  "schema_conformance_rate", "latency_ms")}
+    report["truncation_retries"] = token_accountant.totals["truncation_retries"] - retries_before
+    return report
+
+
+def print_table(results: dict):
+    print(f"{'prompt':<18} {'mode':<11} {'runs':>5} {'parsed':>7} {'schema':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for key in PROMPT_STEPS:
+        for mode, report in results.items():
+            row = report.get(key)
+            if not row:
+                continue
+            latency = row["latency_ms"] or {"p50": 0, "p95": 0}
+            print(f"{key:<18} {mode:<11} {row['runs']:>5} {row['parse_success_rate']:>7.1%} "
+                  f"{row['schema_conformance_rate']:>7.1%} {latency['p50']:>9.1f} {latency['p95']:>9.1f}")
+    for mode, report in results.items():
+        print(f"{mode}: {report['truncation_retries']} truncation retries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", default="fake", choices=list(PROVIDER_CLIENTS))
+    parser.add_argument("--fixtures", type=Path, default=EVAL_FIXTURES_DIR)
+    parser.add_argument("--prompts", help="Comma-separated prompt keys (default: all)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No fixture diagrams in {args.fixtures}")
+    keys = args.prompts.split(",") if args.prompts else list(PROMPT_STEPS)
+    unknown = set(keys) - set(PROMPT_STEPS)
+    if unknown:
+        parser.error(f"Unknown prompt keys: {', '.join(sorted(unknown))}")
+
+    results = {
+        mode: run_mode(args.provider, structured, fixtures, keys, args.repeats, args.concurrency)
+        for mode, structured in (("free-text", False), ("structured", True))
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
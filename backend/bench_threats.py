@@ -0,0 +1,142 @@
+"""Query-plan checks and latency for GET /api/threats at scale.
+
+Seeds synthetic threats (session ids prefixed with "bench-") into the threats
+table and the threat_counts rollup, checks that every query shape is served by
+an index rather than a sequential scan, and reports p50/p95 latency. Benchmark
+rows are deleted afterwards unless --keep is given.
+
+    DATABASE_URL=postgresql://... python bench_threats.py --rows 1000000
+"""
+import io
+import sys
+import asyncio
+import json
+import time
+import random
+import argparse
+import statistics
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from database import get_pool, init_database, close_database, query_threats, count_threats, _threat_filters
+
+STRIDE = ["Spoofing", "Tampering", "Repudiation", "Information Disclosure", "Denial of Service", "Elevation of Privilege"]
+CIA = ["Confidentiality", "Integrity", "Availability"]
+TACTICS = ["TA0001", "TA0002", "TA0003", "TA0004", "TA0005", "TA0006", "TA0007", "TA0008", "TA0009", "TA0010", "TA0040"]
+COMPONENTS = [f"component {i}" for i in range(200)]
+WORDS = ("attacker exploits misconfigured bucket credentials token gateway lambda injection replay session "
+         "database snapshot exfiltration ransomware phishing privilege escalation logging rotation").split()
+
+QUERIES = {
+    "first page": {},
+    "session": {"session_id": "bench-42"},
+    "stride": {"stride": "Repudiation"},
+    "cia + stride": {"cia_triad": "Availability", "stride": "Denial of Service"},
+    "tactic": {"tactic": "TA0008"},
+    "component": {"component": "component 17"},
+    "full-text": {"search": "ransomware snapshot"},
+}
+
+
+async def seed(rows: int, batch: int = 50_000):
+    rng = random.Random(0)
+    async with get_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            for start in range(0, rows, batch):
+                buffer = io.StringIO()
+                for i in range(start, min(rows, start + batch)):
+                    threat = {
+                        "id": f"TS{i % 30:02d}",
+                        "scenario": " ".join(rng.choices(WORDS, k=14)),
+                        "cia_triad": rng.choice(CIA),
+                        "stride": rng.choice(STRIDE),
+                        "mitre_tactic": rng.choice(TACTICS),
+                        "mitre_technique": "",
+                        "mitigations": " ".join(rng.choices(WORDS, k=10)),
+                    }
+                    tactics = "{" + ",".join(sorted(set(rng.choices(TACTICS, k=2)))) + "}"
+                    components = "{" + ",".join(f'"{c}"' for c in rng.sample(COMPONENTS, 3)) + "}"
+                    buffer.write("\t".join([
+                        f"bench-{i // 30}", "baseline", "fake", threat["stride"], threat["cia_triad"],
+                        tactics, components, json.dumps(threat).replace("\\", "\\\\")
+                    ]) + "\n")
+                async with cur.copy(
+                    "COPY threats (session_id, template, provider, stride, cia_triad, tactics, components, threat) FROM STDIN"
+                ) as copy:
+                    await copy.write(buffer.getvalue())
+                await conn.commit()
+                print(f"seeded {min(rows, start + batch)}/{rows}", end="\r", flush=True)
+            await cur.execute("""
+                INSERT INTO threat_counts (session_id, stride, cia_triad, count)
+                SELECT session_id, coalesce(stride, ''), coalesce(cia_triad, ''), COUNT(*) FROM threats
+                WHERE session_id LIKE 'bench-%' GROUP BY 1, 2, 3
+                ON CONFLICT (session_id, stride, cia_triad) DO UPDATE SET count = EXCLUDED.count
+            """)
+            await cur.execute("ANALYZE threats")
+            await cur.execute("ANALYZE threat_counts")
+    print()
+
+
+async def plan(filters: dict) -> dict:
+    clauses, params = _threat_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    async with get_pool().connection() as conn:
+        cur = await conn.execute(f"EXPLAIN (FORMAT JSON) SELECT id FROM threats {where} ORDER BY id DESC LIMIT 51", params)
+        return (await cur.fetchone())["QUERY PLAN"][0]["Plan"]
+
+
+def scan_types(node: dict) -> list:
+    return [node["Node Type"]] + [t for child in node.get("Plans", []) for t in scan_types(child)]
+
+
+async def timed(fn, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(args) -> bool:
+    if not await init_database():
+        sys.exit("DATABASE_URL must point at a Postgres database")
+    if not args.no_seed:
+        start = time.perf_counter()
+        await seed(args.rows)
+        print(f"seeded {args.rows} threats in {time.perf_counter() - start:.1f}s")
+
+    failed = False
+    print(f"{'query':<14} {'plan':<34} {'page p50':>9} {'page p95':>9} {'counts p50':>11}")
+    try:
+        for name, filters in QUERIES.items():
+            nodes = scan_types(await plan(filters))
+            uses_index = "Seq Scan" not in nodes
+            failed |= not uses_index
+            page = sorted(await timed(lambda: query_threats(limit=50, **filters), args.runs))
+            counts = sorted(await timed(lambda: count_threats(**filters), max(3, args.runs // 10)))
+            print(f"{name:<14} {('' if uses_index else 'SEQ SCAN ') + '/'.join(nodes[-2:]):<34} "
+                  f"{statistics.median(page):>7.1f}ms {page[int(len(page) * 0.95) - 1]:>7.1f}ms "
+                  f"{statistics.median(counts):>9.1f}ms")
+    finally:
+        if not args.keep:
+            async with get_pool().connection() as conn:
+                await conn.execute("DELETE FROM threats WHERE session_id LIKE 'bench-%'")
+                await conn.execute("DELETE FROM threat_counts WHERE session_id LIKE 'bench-%'")
+        await close_database()
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark rows")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse rows from a previous --keep run")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Component recall of tiled vs untiled Step 2 on a dense, large diagram.
+
+Draws a synthetic architecture diagram (a grid of labelled boxes with small
+text that a model cannot read once the image is downscaled to ~1568px), or
+loads --image with its expected component names from --labels (a JSON list).
+Runs Step 2 once with tiling and once on the whole image, and reports the
+share of labelled components each run found, along with calls, tokens and
+latency. The fake provider returns canned components, so only a real
+provider gives meaningful recall.
+
+    python bench_tiling.py --provider claude --size 6000x4000 --boxes 120
+"""
+import io
+import re
+import json
+import time
+import base64
+import random
+import argparse
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import tiling
+from main import PROVIDER_CLIENTS, get_client
+from token_budget import request_usage, start_request_budget
+
+SERVICES = ["API Gateway", "Lambda", "DynamoDB", "S3 Bucket", "SQS Queue", "SNS Topic", "RDS Postgres",
+            "ElastiCache", "ECS Service", "EKS Cluster", "CloudFront", "Cognito", "Kinesis Stream",
+            "Step Functions", "Secrets Manager", "KMS Key", "NAT Gateway", "Load Balancer", "OpenSearch",
+            "EventBridge", "Glue Job", "Redshift", "WAF", "Transit Gateway"]
+
+
+def synthetic_diagram(width: int, height: int, boxes: int, font_size: int, seed: int):
+    """A PNG with `boxes` labelled components; returns (base64, labels)."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(font_size)
+    cols = max(1, round((boxes * width / height) ** 0.5))
+    rows = -(-boxes // cols)
+    cell_w, cell_h = width // cols, height // rows
+    labels = []
+    for n in range(boxes):
+        label = f"{rng.choice(SERVICES)} {n + 1}"
+        labels.append(label)
+        x, y = (n % cols) * cell_w, (n // cols) * cell_h
+        box = (x + cell_w // 6, y + cell_h // 3, x + cell_w * 5 // 6, y + cell_h * 2 // 3)
+        draw.rectangle(box, outline="black", width=2)
+        draw.text((box[0] + 6, box[1] + 6), label, fill="black", font=font)
+        if n % cols:
+            draw.line((x - cell_w // 6, (box[1] + box[3]) // 2, box[0], (box[1] + box[3]) // 2), fill="gray", width=2)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode(), labels
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def recall(labels: List[str], components: List[dict]) -> float:
+    """Share of labels matched (exactly or nearly) by a returned component name."""
+    names = [_norm(c.get("name", "")) for c in components]
+    found = sum(
+        any(_norm(label) in name or SequenceMatcher(None, _norm(label), name).ratio() >= 0.85 for name in names)
+        for label in labels
+    )
+    return found / len(labels) if labels else 0.0
+
+
+def run_mode(client, image: str, labels: List[str], tiled: bool) -> dict:
+    threshold = tiling.TILE_THRESHOLD_PX
+    tiling.TILE_THRESHOLD_PX = threshold if tiled else 0
+    start_request_budget()
+    calls_before = client_calls(client)
+    start = time.perf_counter()
+    try:
+        result = tiling.extract_components(client, image, "image/png")
+    finally:
+        tiling.TILE_THRESHOLD_PX = threshold
+    usage = request_usage.get()
+    return {
+        "recall": round(recall(labels, result["in_scope_components"]), 3),
+        "components": len(result["in_scope_components"]),
+        "calls": client_calls(client) - calls_before,
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def client_calls(client) -> int:
+    return getattr(client, "_bench_calls", 0)
+
+
+def count_calls(client):
+    invoke = client._invoke
+
+    def counted(*args, **kwargs):
+        client._bench_calls = client_calls(client) + 1
+        return invoke(*args, **kwargs)
+    client._invoke = counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", default="fake", choices=list(PROVIDER_CLIENTS))
+    parser.add_argument("--size", default="6000x4000", help="Synthetic diagram WIDTHxHEIGHT")
+    parser.add_argument("--boxes", type=int, default=120, help="Labelled components in the synthetic diagram")
+    parser.add_argument("--font-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--image", type=Path, help="Use this diagram instead of a synthetic one")
+    parser.add_argument("--labels", type=Path, help="JSON list of the component names in --image")
+    parser.add_argument("--save", type=Path, help="Write the synthetic diagram here")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.image:
+        if not args.labels:
+            parser.error("--image needs --labels")
+        image, labels = base64.b64encode(args.image.read_bytes()).decode(), json.loads(args.labels.read_text())
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        image, labels = synthetic_diagram(width, height, args.boxes, args.font_size, args.seed)
+        if args.save:
+            args.save.write_bytes(base64.b64decode(image))
+    if not tiling.should_tile(image):
+        parser.error(f"The diagram's long edge must exceed TILE_THRESHOLD_PX ({tiling.TILE_THRESHOLD_PX})")
+
+    client = get_client(args.provider)
+    count_calls(client)
+    results = {mode: run_mode(client, image, labels, tiled) for mode, tiled in (("untiled", False), ("tiled", True))}
+
+    if args.json:
+        print(json.dumps({"provider": args.provider, "labels": len(labels), **results}))
+        return
+    print(f"{'mode':<8} {'recall':>7} {'found':>6} {'calls':>6} {'in tok':>8} {'out tok':>8} {'seconds':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<8} {r['recall']:>7.1%} {r['components']:>6} {r['calls']:>6} "
+              f"{r['input_tokens']:>8} {r['output_tokens']:>8} {r['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Peak server memory for concurrent large diagram uploads.
+
+Starts the API in a subprocess with the Claude client pointed at an
+in-process stand-in (which consumes request bodies without buffering them),
+posts concurrent /api/extract-components requests with distinct synthetic
+diagrams, and reports the server's baseline and peak RSS (VmRSS / VmHWM).
+
+    python bench_uploads.py --size-mb 10 --concurrency 8
+"""
+import os
+import sys
+import time
+import json
+import base64
+import struct
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+SSE_TEXT = json.dumps({"application_description": "Synthetic diagram", "key_features": [], "in_scope_components": []})
+SSE_BODY = "".join(f"data: {json.dumps(e)}\n\n" for e in [
+    {"type": "message_start", "message": {"usage": {"input_tokens": 1000}}},
+    {"type": "content_block_delta", "delta": {"type": "text_delta", "text": SSE_TEXT}},
+    {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 20}},
+]).encode()
+
+
+class StandIn(httpx.BaseTransport):
+    """Anthropic Messages stand-in that reads the body chunk by chunk, like a socket write.
+
+    (httpx.MockTransport would join the body into one bytes object first.)
+    """
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        for _ in request.stream:
+            pass
+        return httpx.Response(200, content=SSE_BODY, headers={"Content-Type": "text/event-stream"})
+
+
+def serve(port: int):
+    os.environ.update({"DATABASE_URL": "", "WARMUP_PROVIDERS": "", "TILE_THRESHOLD_PX": "0"})
+    import uvicorn
+    import main
+
+    main.get_client("claude").http = httpx.Client(transport=StandIn())
+    uvicorn.run(main.app, port=port, log_level="warning")
+
+
+def synthetic_png(size: int) -> str:
+    """Random payload behind a 1600x1200 PNG header (enough for token estimates, never decoded)."""
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 1600, 1200)
+    return base64.b64encode(header + os.urandom(size - len(header))).decode()
+
+
+def memory_kb(pid: int) -> dict:
+    with open(f"/proc/{pid}/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {k: int(fields[k].split()[0]) for k in ("VmRSS", "VmHWM")}
+
+
+async def upload(client: httpx.AsyncClient, url: str, body: bytes):
+    response = await client.post(url, content=body, headers={"Content-Type": "application/json"})
+    response.raise_for_status()
+
+
+async def run(args, port: int, pid: int):
+    url = f"http://127.0.0.1:{port}/api/extract-components"
+    size = int(args.size_mb * 1024 * 1024)
+    bodies = [json.dumps({"image": synthetic_png(size), "provider": "claude"}).encode() for i in range(args.concurrency)]
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        # One small request first so lazily imported modules are part of the baseline
+        await upload(client, url, json.dumps({"image": synthetic_png(1024), "provider": "claude"}).encode())
+        baseline = memory_kb(pid)["VmRSS"]
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            await asyncio.gather(*(upload(client, url, body) for body in bodies))
+        elapsed = time.perf_counter() - start
+
+        oversized = await client.post(url, content=b" " * (size * 3), headers={"Content-Type": "application/json"})
+
+    peak = memory_kb(pid)["VmHWM"]
+    requests = args.concurrency * args.rounds
+    print(f"{requests} uploads of {args.size_mb} MB ({args.concurrency} concurrent): "
+          f"baseline {baseline / 1024:.0f} MB, peak {peak / 1024:.0f} MB, "
+          f"peak over baseline {(peak - baseline) / 1024:.0f} MB, {elapsed / args.rounds:.2f}s per round")
+    print(f"{args.size_mb * 3:.0f} MB body: HTTP {oversized.status_code}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.port)
+
+    server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(args.port)],
+                              stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{args.port}/api/metrics")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+        asyncio.run(run(args, args.port, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Throughput scaling from 1 to N worker processes.
+
+Starts `python main.py` with WEB_CONCURRENCY=1..N against the fake provider,
+drives /api/extract-components (three sub-steps per request) from
+--concurrency clients for --seconds, and reports requests/s, latency and the
+speedup over one worker. Each request carries a distinct synthetic diagram,
+so nothing is coalesced.
+
+With the default --latency 0 the run is CPU bound (request decoding,
+hashing, prompt building, parsing), which is what extra workers scale; set
+--latency to add simulated provider time. The load generator runs on the
+same machine, so leave it a core.
+
+    python bench_workers.py --max-workers 4 --concurrency 32 --seconds 15
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+from bench_uploads import synthetic_png
+
+
+def start_server(workers: int, port: int, latency: float) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": "", "WARMUP_PROVIDERS": "", "WEB_CONCURRENCY": str(workers),
+           "PORT": str(port), "FAKE_LATENCY_SECONDS": str(latency), "TILE_THRESHOLD_PX": "0"}
+    server = subprocess.Popen([sys.executable, "main.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    for _ in range(150):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"Server with {workers} workers did not start")
+
+
+async def drive(port: int, bodies: list, concurrency: int, seconds: float) -> list:
+    url = f"http://127.0.0.1:{port}/api/extract-components"
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    # A new connection per request lets the kernel spread requests over the workers
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker(n: int):
+            i = n
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post(url, content=bodies[i % len(bodies)], headers={"Content-Type": "application/json"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--size-kb", type=int, default=512, help="Synthetic diagram size")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated provider latency per call (seconds)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    bodies = [json.dumps({"image": synthetic_png(args.size_kb * 1024), "provider": "fake"}).encode()
+              for _ in range(args.concurrency * 4)]
+    results = []
+    for workers in range(1, args.max_workers + 1):
+        server = start_server(workers, args.port, args.latency)
+        try:
+            asyncio.run(drive(args.port, bodies, args.concurrency, 2))  # warm-up
+            latencies = sorted(asyncio.run(drive(args.port, bodies, args.concurrency, args.seconds)))
+        finally:
+            server.terminate()
+            server.wait()
+        results.append({
+            "workers": workers,
+            "requests_per_second": round(len(latencies) / args.seconds, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        })
+        results[-1]["speedup"] = round(results[-1]["requests_per_second"] / results[0]["requests_per_second"], 2)
+
+    if args.json:
+        print(json.dumps({"cores": os.cpu_count(), "concurrency": args.concurrency, "latency": args.latency,
+                          "size_kb": args.size_kb, "results": results}))
+        return
+    print(f"{os.cpu_count()} cores, {args.concurrency} concurrent clients, {args.size_kb} KB diagrams, "
+          f"{args.latency}s provider latency")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>8}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['requests_per_second']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['speedup']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
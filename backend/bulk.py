@@ -0,0 +1,346 @@
+"""Bulk offline threat modeling through provider batch APIs.
+
+Packages Step 1/2 calls for many diagrams into one provider batch, then the
+Step 3 calls (which depend on Step 2 output) into a second batch. Results are
+parsed and normalized by the same BaseClient logic as interactive requests and
+persisted per session; each session's templates are also merged into one
+de-duplicated `merged_threats` list.
+
+    python bulk.py diagrams/ --backend anthropic --templates baseline,aws --output results.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import asyncio
+import argparse
+import mimetypes
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional, Dict, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import httpx
+
+from base_client import BaseClient, Completion, anthropic_messages, anthropic_completion, log
+from dedup import dedupe_threats
+from database import THREAT_TEMPLATES, init_database, close_database, get_prompt, save_session_result, save_threats
+from schemas import TOOL_NAME, tool_definition
+from token_budget import MAX_OUTPUT_TOKENS
+
+BULK_POLL_SECONDS = int(os.environ.get("BULK_POLL_SECONDS", "30"))
+BULK_TIMEOUT_SECONDS = int(os.environ.get("BULK_TIMEOUT_SECONDS", str(24 * 3600)))
+BEDROCK_BATCH_BUCKET = os.environ.get("BEDROCK_BATCH_BUCKET", "")
+BEDROCK_BATCH_ROLE_ARN = os.environ.get("BEDROCK_BATCH_ROLE_ARN", "")
+
+STEP2_PROMPT_KEYS = {"STEP-2A": "step2_app_desc", "STEP-2B": "step2_features", "STEP-2C": "step2_components"}
+
+
+@dataclass
+class BatchItem:
+    """One model call inside a batch."""
+    custom_id: str
+    prompt: str
+    step_name: str
+    image_base64: Optional[str] = None
+    media_type: str = "image/png"
+    max_tokens: int = MAX_OUTPUT_TOKENS
+
+
+def anthropic_params(item: BatchItem, model: str, structured: bool) -> dict:
+    """Messages API parameters for a batch item."""
+    params = {
+        "model": model,
+        "max_tokens": item.max_tokens,
+        "messages": anthropic_messages(item.prompt, item.image_base64, item.media_type)
+    }
+    if structured:
+        params["tools"] = [tool_definition(item.step_name)]
+        params["tool_choice"] = {"type": "tool", "name": TOOL_NAME}
+    return params
+
+
+class AnthropicBatchBackend:
+    """Anthropic Message Batches API. Point CLAUDE_API_BASE at a local stand-in (fake_batch_server.py) for testing."""
+
+    def __init__(self, client: BaseClient, api_key: str = None, base_url: str = None):
+        from claude_client import CLAUDE_API_BASE
+        self.client = client
+        self.base_url = base_url or CLAUDE_API_BASE
+        self.headers = {
+            "Content-Type": "application/json",
+            "x-api-key": api_key or os.environ.get("CLAUDE_API_KEY", ""),
+            "anthropic-version": "2023-06-01"
+        }
+        self.http = httpx.Client(timeout=300.0)
+
+    def submit(self, items: List[BatchItem], structured: bool) -> str:
+        payload = {"requests": [
+            {"custom_id": item.custom_id, "params": anthropic_params(item, self.client.model, structured)}
+            for item in items
+        ]}
+        response = self.http.post(f"{self.base_url}/v1/messages/batches", headers=self.headers, json=payload)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def is_done(self, batch_id: str) -> bool:
+        return self._get_batch(batch_id)["processing_status"] == "ended"
+
+    def _get_batch(self, batch_id: str) -> dict:
+        response = self.http.get(f"{self.base_url}/v1/messages/batches/{batch_id}", headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def results(self, batch_id: str, structured: bool) -> Dict[str, Completion]:
+        results_url = self._get_batch(batch_id).get("results_url") or f"{self.base_url}/v1/messages/batches/{batch_id}/results"
+        completions = {}
+        with self.http.stream("GET", results_url, headers=self.headers) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                result = record["result"]
+                if result["type"] == "succeeded":
+                    completions[record["custom_id"]] = anthropic_completion(result["message"], TOOL_NAME if structured else None)
+                else:
+                    log("BULK", f"Batch item {record['custom_id']} {result['type']}: {result.get('error')}")
+        return completions
+
+
+class BedrockBatchBackend:
+    """Bedrock batch inference jobs with JSONL input/output in S3.
+
+    Bedrock requires a minimum number of records per job (100 at the time of
+    writing); smaller portfolios should use the Anthropic backend.
+    """
+
+    def __init__(self, client: BaseClient, bucket: str = None, role_arn: str = None, region_name: str = "us-east-1"):
+        import boto3
+        self.client = client
+        self.bucket = bucket or BEDROCK_BATCH_BUCKET
+        self.role_arn = role_arn or BEDROCK_BATCH_ROLE_ARN
+        if not self.bucket or not self.role_arn:
+            raise ValueError("BEDROCK_BATCH_BUCKET and BEDROCK_BATCH_ROLE_ARN are required for Bedrock batch mode")
+        self.s3 = boto3.client("s3", region_name=region_name)
+        self.bedrock = boto3.client("bedrock", region_name=region_name)
+
+    def submit(self, items: List[BatchItem], structured: bool) -> str:
+        job_name = f"auspex-bulk-{uuid.uuid4().hex[:12]}"
+        lines = []
+        for item in items:
+            params = anthropic_params(item, self.client.model, structured)
+            del params["model"]
+            lines.append(json.dumps({
+                "recordId": item.custom_id,
+                "modelInput": {"anthropic_version": "bedrock-2023-05-31", **params}
+            }))
+        input_key = f"{job_name}/input.jsonl"
+        self.s3.put_object(Bucket=self.bucket, Key=input_key, Body="\n".join(lines).encode())
+
+        response = self.bedrock.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=self.client.model,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{self.bucket}/{input_key}", "s3InputFormat": "JSONL"}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"s3://{self.bucket}/{job_name}/output/"}}
+        )
+        return response["jobArn"]
+
+    def is_done(self, job_arn: str) -> bool:
+        status = self.bedrock.get_model_invocation_job(jobIdentifier=job_arn)["status"]
+        if status in ("Failed", "Stopped", "Expired"):
+            raise RuntimeError(f"Bedrock batch job {job_arn} ended with status {status}")
+        return status in ("Completed", "PartiallyCompleted")
+
+    def results(self, job_arn: str, structured: bool) -> Dict[str, Completion]:
+        job = self.bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+        output_uri = job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"]
+        prefix = output_uri.split(f"s3://{self.bucket}/", 1)[1]
+
+        completions = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith(".jsonl.out"):
+                    continue
+                body = self.s3.get_object(Bucket=self.bucket, Key=obj["Key"])["Body"]
+                for line in body.iter_lines():
+                    record = json.loads(line)
+                    if "modelOutput" in record:
+                        completions[record["recordId"]] = anthropic_completion(record["modelOutput"], TOOL_NAME if structured else None)
+                    else:
+                        log("BULK", f"Batch record {record.get('recordId')} failed: {record.get('error')}")
+        return completions
+
+
+class BulkPipeline:
+    """Run the three-step pipeline for many diagrams through a batch backend."""
+
+    def __init__(self, backend, client: BaseClient, templates: List[str] = None, poll_interval: int = BULK_POLL_SECONDS):
+        self.backend = backend
+        self.client = client
+        self.templates = templates or ["baseline"]
+        unknown = [t for t in self.templates if t not in THREAT_TEMPLATES]
+        if unknown:
+            # Checked up front: a bad template would otherwise fail after the first batch is paid for
+            raise ValueError(f"Unknown templates: {', '.join(unknown)} (available: {', '.join(THREAT_TEMPLATES)})")
+        self.poll_interval = poll_interval
+
+    async def _run_batch(self, items: List[BatchItem]) -> Dict[str, Completion]:
+        structured = self.client.structured_output
+        batch_id = await asyncio.to_thread(self.backend.submit, items, structured)
+        log("BULK", f"Submitted batch {batch_id} with {len(items)} requests")
+
+        deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+        while not await asyncio.to_thread(self.backend.is_done, batch_id):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch {batch_id} did not finish within {BULK_TIMEOUT_SECONDS}s")
+            await asyncio.sleep(self.poll_interval)
+
+        completions = await asyncio.to_thread(self.backend.results, batch_id, structured)
+        log("BULK", f"Batch {batch_id} finished: {len(completions)}/{len(items)} succeeded")
+        return completions
+
+    def _parse(self, completions: Dict[str, Completion], custom_id: str, step_name: str) -> Optional[dict]:
+        completion = completions.get(custom_id)
+        if completion is None:
+            return None
+        try:
+            return self.client._parse_completion(completion, step_name)
+        except ValueError as e:
+            log("BULK", f"Could not parse {custom_id}: {e}")
+            return None
+
+    async def run(self, diagrams: List[dict]) -> Dict[str, dict]:
+        """Process diagrams ({session_id, image, media_type}) and persist each session's results."""
+        sessions = {d["session_id"]: {} for d in diagrams}
+
+        # Round 1: Step 1 and Step 2A/2B/2C for every diagram
+        step1_prompt = await get_prompt("step1_analyze")
+        step2_prompts = {step: await get_prompt(key) for step, key in STEP2_PROMPT_KEYS.items()}
+        items = []
+        for i, d in enumerate(diagrams):
+            media_type = d.get("media_type", "image/png")
+            items.append(BatchItem(f"d{i}-STEP-1", step1_prompt, "STEP-1", d["image"], media_type))
+            for step, prompt in step2_prompts.items():
+                items.append(BatchItem(f"d{i}-{step}", prompt, step, d["image"], media_type))
+        completions = await self._run_batch(items)
+
+        for i, d in enumerate(diagrams):
+            session = sessions[d["session_id"]]
+            analysis = self._parse(completions, f"d{i}-STEP-1", "STEP-1")
+            if analysis is not None:
+                session["analysis"] = analysis
+                await save_session_result(d["session_id"], "step1", analysis, provider=self.client.provider)
+
+            parsed = {step: self._parse(completions, f"d{i}-{step}", step) for step in STEP2_PROMPT_KEYS}
+            if all(v is not None for v in parsed.values()):
+                session["components"] = {
+                    "application_description": parsed["STEP-2A"].get("application_description", ""),
+                    "key_features": parsed["STEP-2B"].get("key_features", []),
+                    "in_scope_components": self.client._normalize_components(parsed["STEP-2C"]),
+                }
+                await save_session_result(d["session_id"], "step2", session["components"], provider=self.client.provider)
+
+        # Round 2: Step 3 for each template, for diagrams whose Step 2 succeeded
+        items = []
+        for i, d in enumerate(diagrams):
+            components = sessions[d["session_id"]].get("components")
+            if not components:
+                continue
+            for template in self.templates:
+                prompt = self.client._threats_prompt(
+                    components["application_description"],
+                    components["in_scope_components"],
+                    components["key_features"],
+                    template,
+                    await get_prompt(f"step3_{template}")
+                )
+                items.append(BatchItem(f"d{i}-STEP-3-{template}", prompt, "STEP-3"))
+        completions = await self._run_batch(items) if items else {}
+
+        for i, d in enumerate(diagrams):
+            session = sessions[d["session_id"]]
+            for template in self.templates:
+                parsed = self._parse(completions, f"d{i}-STEP-3-{template}", "STEP-3")
+                if parsed is not None:
+                    threats = self.client._normalize_threats(parsed, session["components"]["in_scope_components"])
+                    session.setdefault("threats", {})[template] = threats.get("threats", [])
+                    await save_session_result(d["session_id"], "step3", threats, provider=self.client.provider, template=template)
+                    await save_threats(d["session_id"], threats.get("threats", []), session["components"]["in_scope_components"],
+                                       provider=self.client.provider, template=template)
+            if session.get("threats"):
+                # One list across templates, with the near-duplicates they share merged
+                session["merged_threats"] = dedupe_threats(
+                    [t for threats in session["threats"].values() for t in threats],
+                    components=session["components"]["in_scope_components"])
+
+        return sessions
+
+
+def load_diagrams(directory: Path) -> List[dict]:
+    """Load every image in a directory as a bulk diagram."""
+    stamp = time.strftime("%Y%m%d")
+    diagrams = []
+    for path in sorted(directory.iterdir()):
+        media_type = mimetypes.guess_type(path.name)[0]
+        if not media_type or not media_type.startswith("image/"):
+            continue
+        diagrams.append({
+            "session_id": f"bulk_{stamp}_{path.stem}",
+            "image": base64.b64encode(path.read_bytes()).decode(),
+            "media_type": media_type,
+        })
+    return diagrams
+
+
+async def run_pipeline(pipeline: BulkPipeline, diagrams: List[dict]) -> Dict[str, dict]:
+    await init_database()
+    try:
+        return await pipeline.run(diagrams)
+    finally:
+        await close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run threat modeling for a directory of diagrams via batch APIs")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--backend", choices=["anthropic", "bedrock"], default="anthropic")
+    parser.add_argument("--templates", default="baseline", help="Comma-separated Step 3 templates")
+    parser.add_argument("--output", type=Path, help="Also write all session results to this JSON file")
+    parser.add_argument("--structured", action="store_true", help="Use structured output (tool use)")
+    args = parser.parse_args()
+
+    templates = [t.strip() for t in args.templates.split(",") if t.strip()]
+    unknown = [t for t in templates if t not in THREAT_TEMPLATES]
+    if unknown:
+        parser.error(f"unknown templates: {', '.join(unknown)} (choose from {', '.join(THREAT_TEMPLATES)})")
+
+    diagrams = load_diagrams(args.directory)
+    if not diagrams:
+        print(f"No images found in {args.directory}")
+        sys.exit(1)
+
+    if args.backend == "bedrock":
+        from bedrock_client import BedrockClient
+        client = BedrockClient(structured_output=args.structured)
+        backend = BedrockBatchBackend(client)
+    else:
+        from claude_client import ClaudeClient
+        client = ClaudeClient(structured_output=args.structured)
+        backend = AnthropicBatchBackend(client)
+
+    sessions = asyncio.run(run_pipeline(BulkPipeline(backend, client, templates), diagrams))
+
+    if args.output:
+        args.output.write_text(json.dumps(sessions, indent=2))
+    log("BULK", f"Processed {len(sessions)} diagrams")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import threading
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from profiling import run_profiled
+
+CANCEL_ON_DISCONNECT = os.environ.get("CANCEL_ON_DISCONNECT", "true").lower() in ("1", "true", "yes")
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "0.5"))
+
+# Set when every HTTP request waiting on the current provider call has gone away
+cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("cancel_event", default=None)
+# True in requests whose client is watched for disconnects (cancel_on_disconnect, the WebSocket channel)
+disconnect_watched: ContextVar[bool] = ContextVar("disconnect_watched", default=False)
+
+
+class RequestCancelled(Exception):
+    """Raised inside a provider call whose requesting client has disconnected.
+
+    `output_tokens` is how much output an aborted stream had already produced.
+    """
+
+    def __init__(self, message: str = "Request cancelled by client disconnect", output_tokens: int = 0):
+        super().__init__(message)
+        self.output_tokens = output_tokens
+
+
+def cancellable() -> bool:
+    """Whether the current call can be cancelled (adapters then stream so they can abort).
+
+    Every SingleFlight call has a cancellation event, but it is only ever set
+    once a watched client disconnects; unwatched calls keep the cheaper
+    non-streaming APIs.
+    """
+    return CANCEL_ON_DISCONNECT and disconnect_watched.get() and cancel_event.get() is not None
+
+
+def is_cancelled() -> bool:
+    event = cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled(output_tokens: int = 0):
+    if is_cancelled():
+        raise RequestCancelled(output_tokens=output_tokens)
+
+
+def wait_cancelled(seconds: float) -> bool:
+    """Sleep for up to `seconds`, returning True early if the call is cancelled."""
+    event = cancel_event.get()
+    if event is None:
+        threading.Event().wait(seconds)
+        return False
+    return event.wait(seconds)
+
+
+def run_cancellable(event: threading.Event, fn: Callable, *args, **kwargs):
+    """Run fn (in a worker thread) with `event` as its cancellation signal."""
+    cancel_event.set(event)
+    return run_profiled(fn, *args, **kwargs)
+
+
+class CancellationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"disconnects": 0, "aborted_calls": 0, "skipped_calls": 0,
+                      "saved_input_tokens": 0, "saved_output_tokens": 0}
+
+    def disconnected(self):
+        with self._lock:
+            self.stats["disconnects"] += 1
+
+    def skipped(self, input_tokens: int, output_tokens: int):
+        """A call that was never sent: its whole estimated cost is saved."""
+        with self._lock:
+            self.stats["skipped_calls"] += 1
+            self.stats["saved_input_tokens"] += input_tokens
+            self.stats["saved_output_tokens"] += output_tokens
+
+    def aborted(self, output_tokens: int):
+        """A call stopped mid-stream: input is already billed, the remaining output is saved."""
+        with self._lock:
+            self.stats["aborted_calls"] += 1
+            self.stats["saved_output_tokens"] += output_tokens
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+cancellation_stats = CancellationStats()
+
@@ -0,0 +1,112 @@
+"""Record and replay provider calls.
+
+CASSETTE_MODE=record saves every provider call (request hash, step, model,
+latency and the completion) to a gzipped JSON-lines cassette; replay serves
+them back without network, sleeping for the recorded latency times
+CASSETTE_LATENCY_SCALE (0 replays instantly). bench_pipeline.py replays a
+cassette to measure orchestration overhead.
+"""
+import os
+import gzip
+import time
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import orjson
+
+from cancellation import RequestCancelled, wait_cancelled
+
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off").lower()  # off, record or replay
+CASSETTE_FILE = os.environ.get("CASSETTE_FILE", "cassettes/default.jsonl.gz")
+CASSETTE_LATENCY_SCALE = float(os.environ.get("CASSETTE_LATENCY_SCALE", "1.0"))
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a request the cassette has no recording of."""
+
+
+def request_hash(provider: str, model: str, step_name: str, structured: bool, prompt: str,
+                 image_base64: Optional[str], media_type: str) -> str:
+    """Key for a provider call. max_tokens is left out since it adapts from run to run."""
+    digest = hashlib.sha256()
+    for part in (provider, model, step_name, str(structured), media_type, prompt, image_base64 or ""):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+class Cassette:
+    """Recorded completions keyed by request hash.
+
+    A key recorded several times is replayed in recording order, wrapping
+    around once every recording has been served.
+    """
+
+    def __init__(self, path: str = CASSETTE_FILE, mode: str = CASSETTE_MODE, latency_scale: float = CASSETTE_LATENCY_SCALE):
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[dict]] = defaultdict(list)
+        self._next: Dict[str, int] = defaultdict(int)
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "replay":
+            self.load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def start_replay(self, latency_scale: Optional[float] = None):
+        self.mode = "replay"
+        if latency_scale is not None:
+            self.latency_scale = latency_scale
+        self.load()
+
+    def load(self):
+        self._entries.clear()
+        with gzip.open(self.path, "rb") as f:
+            for line in f:
+                entry = orjson.loads(line)
+                self._entries[entry["key"]].append(entry)
+
+    def call(self, key: str, invoke: Callable[[], dict], **info) -> dict:
+        """Run (or replay) one provider call; `invoke` returns the completion as a dict."""
+        if self.mode == "replay":
+            return self.replay(key)
+        start = time.perf_counter()
+        completion = invoke()
+        if self.mode == "record":
+            self.record(key, completion, time.perf_counter() - start, **info)
+        return completion
+
+    def record(self, key: str, completion: dict, seconds: float, **info):
+        line = orjson.dumps({"key": key, **info, "seconds": round(seconds, 4), "completion": completion}) + b"\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Each append is its own gzip member; gzip.open reads them back as one stream
+            with gzip.open(self.path, "ab") as f:
+                f.write(line)
+            self.stats["recorded"] += 1
+
+    def replay(self, key: str) -> dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                raise CassetteMiss(f"No recording for request {key} in {self.path}")
+            entry = entries[self._next[key] % len(entries)]
+            self._next[key] += 1
+            self.stats["replayed"] += 1
+        if self.latency_scale and wait_cancelled(entry["seconds"] * self.latency_scale):
+            raise RequestCancelled()
+        return entry["completion"]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "file": self.path, "requests": len(self._entries), **self.stats}
+
+
+cassette = Cassette()
@@ -0,0 +1,98 @@
+import os
+import json
+import asyncio
+import hashlib
+import functools
+import threading
+from typing import Callable, Dict
+
+from admission import admission_controller
+from base_client import log
+from database import run_with_advisory_lock
+from cancellation import run_cancellable
+
+# Opt-in: workers share results (including speculated ones) through Postgres advisory locks
+COALESCE_ACROSS_WORKERS = os.environ.get("COALESCE_ACROSS_WORKERS", "").lower() in ("1", "true", "yes")
+HASH_CHUNK_CHARS = 1024 * 1024
+
+
+def request_key(*parts) -> str:
+    """Build a stable coalescing key from request parts (strings, bytes or JSON-able values)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = ""
+        elif not isinstance(part, (str, bytes)):
+            part = json.dumps(part, sort_keys=True)
+        part_digest = hashlib.sha256()
+        if isinstance(part, str):
+            # Encode in slices so a multi-MB base64 image is not copied whole
+            for start in range(0, len(part), HASH_CHUNK_CHARS):
+                part_digest.update(part[start:start + HASH_CHUNK_CHARS].encode())
+        else:
+            part_digest.update(part)
+        # Hash each part separately so ("ab", "c") and ("a", "bc") differ
+        digest.update(part_digest.digest())
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task, cancel: threading.Event):
+        self.task = task
+        self.cancel = cancel
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Share one in-flight provider call between concurrent identical requests.
+
+    The first caller for a key runs the (blocking) client call in a provider thread;
+    callers arriving while it is still running await the same task. With
+    `across_workers`, the call is additionally serialized through a Postgres
+    advisory lock so other worker processes reuse the stored result.
+
+    When every caller waiting on a call has been cancelled (their clients
+    disconnected), the call's cancellation event is set so the client aborts
+    it and skips its remaining sub-steps.
+    """
+
+    def __init__(self, across_workers: bool = COALESCE_ACROSS_WORKERS):
+        self.across_workers = across_workers
+        self._inflight: Dict[str, _Flight] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "cancelled": 0}
+
+    async def run(self, key: str, fn: Callable, *args, **kwargs):
+        self.stats["calls"] += 1
+        flight = self._inflight.get(key)
+        if flight is None:
+            cancel = threading.Event()
+            call = functools.partial(admission_controller.run_in_thread, run_cancellable, cancel, fn, *args, **kwargs)
+            if self.across_workers:
+                call = functools.partial(run_with_advisory_lock, key, call)
+            flight = _Flight(asyncio.ensure_future(call()), cancel)
+            self._inflight[key] = flight
+            flight.task.add_done_callback(functools.partial(self._done, key, flight))
+        else:
+            self.stats["coalesced"] += 1
+            log("COALESCE", f"Joining in-flight call {key[:12]} ({self.stats['coalesced']} coalesced so far)")
+
+        # Shield so one caller disconnecting does not cancel the shared call
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.cancel.set()
+                self.stats["cancelled"] += 1
+                # Later identical requests start a fresh call instead of joining the cancelled one
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                log("COALESCE", f"Cancelling call {key[:12]}: no callers left")
+            raise
+
+    def _done(self, key: str, flight: _Flight, task: asyncio.Task):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
@@ -1,12 +1,38 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+import re
+import time
+import hashlib
+import asyncio
 from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from dedup import affected_components, component_names
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
 PROMPTS_DIR = Path(__file__).parent / "prompts"
 
+# Prompts are cached in-process; edits invalidate every worker's cache through
+# NOTIFY on PROMPT_CHANNEL, with the TTL as a fallback while a listener reconnects
+PROMPT_CACHE_TTL_SECONDS = int(os.environ.get("PROMPT_CACHE_TTL_SECONDS", "30"))
+PROMPT_CHANNEL = "prompt_changed"
+_prompt_cache = {}  # key -> (content, loaded_at)
+_prompt_listener: Optional[asyncio.Task] = None
+
+# How long a coalesced result stays visible to workers that were waiting on it
+COALESCE_RESULT_TTL_SECONDS = int(os.environ.get("COALESCE_RESULT_TTL_SECONDS", "30"))
+# Workers waiting on another worker's call are woken through NOTIFY on COALESCE_CHANNEL,
+# and retry the lock at this interval in case a notification is missed
+COALESCE_POLL_SECONDS = float(os.environ.get("COALESCE_POLL_SECONDS", "0.25"))
+COALESCE_CHANNEL = "coalesced_result"
+_result_waiters: Dict[str, Set[asyncio.Event]] = {}
+
 # Prompt definitions with display names
 PROMPT_DEFINITIONS = [
     {"key": "step1_analyze", "name": "Step 1: Diagram Analysis", "file": "step1_analyze.txt"},
@@ -17,26 +43,47 @@ PROMPT_DEFINITIONS = [
     {"key": "step3_network", "name": "Step 3: Network Security", "file": "step3_network.txt"},
     {"key": "step3_aws", "name": "Step 3: AWS Cloud Security", "file": "step3_aws.txt"},
 ]
+# Step 3 templates, one per step3_<template> prompt
+THREAT_TEMPLATES = tuple(p["key"][len("step3_"):] for p in PROMPT_DEFINITIONS if p["key"].startswith("step3_"))
 
 
-def get_connection():
-    """Get database connection."""
-    if not DATABASE_URL:
-        return None
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+# Shared async connection pool, opened by init_database(); None means file-based fallback
+_pool: Optional[AsyncConnectionPool] = None
+
 
+def get_pool() -> Optional[AsyncConnectionPool]:
+    """Get the shared connection pool, or None when no database is in use."""
+    return _pool
 
-def init_database():
-    """Initialize database schema and seed default prompts."""
-    conn = get_connection()
-    if not conn:
+
+async def init_database():
+    """Open the connection pool, initialize the schema and seed default prompts."""
+    global _pool
+    if not DATABASE_URL:
         print("[DB] No DATABASE_URL configured, using file-based prompts")
         return False
 
+    pool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        kwargs={"row_factory": dict_row},
+        open=False
+    )
+    try:
+        await pool.open(wait=True, timeout=30)
+    except Exception as e:
+        print(f"[DB] Error connecting to database: {e}")
+        await pool.close()
+        return False
+
     try:
-        with conn.cursor() as cur:
+        async with pool.connection() as conn, conn.cursor() as cur:
+            # Workers start together; the first creates the schema and seeds prompts while the others wait
+            await cur.execute("SELECT pg_advisory_xact_lock(hashtext('auspex_schema'))")
+
             # Create prompts table
-            cur.execute("""
+            await cur.execute("""
                 CREATE TABLE IF NOT EXISTS prompts (
                     id SERIAL PRIMARY KEY,
                     key VARCHAR(50) UNIQUE NOT NULL,
@@ -48,9 +95,76 @@ def init_database():
                 )
             """)
 
+            # Results shared between workers by run_with_advisory_lock
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS coalesced_results (
+                    key VARCHAR(64) PRIMARY KEY,
+                    result JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Step results for persisted sessions (bulk mode)
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS session_results (
+                    id SERIAL PRIMARY KEY,
+                    session_id VARCHAR(100) NOT NULL,
+                    step VARCHAR(20) NOT NULL,
+                    template VARCHAR(20),
+                    provider VARCHAR(20),
+                    result JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_session_results_session ON session_results (session_id)")
+
+            # One row per generated threat, queried by GET /api/threats
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS threats (
+                    id BIGSERIAL PRIMARY KEY,
+                    session_id VARCHAR(100) NOT NULL,
+                    template VARCHAR(20),
+                    provider VARCHAR(20),
+                    stride VARCHAR(100),
+                    cia_triad VARCHAR(50),
+                    tactics TEXT[] NOT NULL DEFAULT '{}',
+                    components TEXT[] NOT NULL DEFAULT '{}',
+                    threat_hash VARCHAR(64),
+                    threat JSONB NOT NULL,
+                    search TSVECTOR GENERATED ALWAYS AS (
+                        to_tsvector('english', coalesce(threat->>'scenario', '') || ' ' || coalesce(threat->>'mitigations', ''))
+                    ) STORED,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await cur.execute("ALTER TABLE threats ADD COLUMN IF NOT EXISTS threat_hash VARCHAR(64)")
+            # A threat is stored once per session and template, however often its result is saved
+            await cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_threats_unique
+                ON threats (session_id, COALESCE(template, ''), threat_hash)
+            """)
+            # (column, id) indexes serve filtered keyset pages newest-first without a sort
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_session ON threats (session_id, id)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_stride ON threats (stride, id)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_cia ON threats (cia_triad, id)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_tactics ON threats USING GIN (tactics)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_components ON threats USING GIN (components)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS idx_threats_search ON threats USING GIN (search)")
+
+            # Per-session STRIDE x CIA counts, kept in step with threats by save_threats
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS threat_counts (
+                    session_id VARCHAR(100) NOT NULL,
+                    stride VARCHAR(100) NOT NULL DEFAULT '',
+                    cia_triad VARCHAR(50) NOT NULL DEFAULT '',
+                    count BIGINT NOT NULL,
+                    PRIMARY KEY (session_id, stride, cia_triad)
+                )
+            """)
+
             # Seed default prompts if table is empty
-            cur.execute("SELECT COUNT(*) as count FROM prompts")
-            count = cur.fetchone()["count"]
+            await cur.execute("SELECT COUNT(*) as count FROM prompts")
+            count = (await cur.fetchone())["count"]
 
             if count == 0:
                 print("[DB] Seeding default prompts...")
@@ -58,44 +172,85 @@ def init_database():
                     file_path = PROMPTS_DIR / prompt_def["file"]
                     if file_path.exists():
                         content = file_path.read_text()
-                        cur.execute(
+                        await cur.execute(
                             """INSERT INTO prompts (key, name, content, is_default)
                                VALUES (%s, %s, %s, TRUE)""",
                             (prompt_def["key"], prompt_def["name"], content)
                         )
                 print(f"[DB] Seeded {len(PROMPT_DEFINITIONS)} prompts")
 
-            conn.commit()
-            print("[DB] Database initialized successfully")
-            return True
+        _pool = pool
+        _start_prompt_listener()
+        print(f"[DB] Database initialized successfully (pool size {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE})")
+        return True
     except Exception as e:
         print(f"[DB] Error initializing database: {e}")
-        conn.rollback()
+        await pool.close()
         return False
-    finally:
-        conn.close()
 
 
-def get_all_prompts():
-    """Get all prompts from database or files."""
-    conn = get_connection()
+async def close_database():
+    """Close the connection pool."""
+    global _pool, _prompt_listener
+    if _prompt_listener is not None:
+        _prompt_listener.cancel()
+        await asyncio.gather(_prompt_listener, return_exceptions=True)
+        _prompt_listener = None
+    await advisory_locks.close()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _start_prompt_listener():
+    global _prompt_listener
+    _prompt_listener = asyncio.ensure_future(_listen_for_prompt_changes())
 
-    if conn:
+
+async def _listen_for_prompt_changes():
+    """Drop prompts edited by any worker from this worker's cache, and wake
+    callers waiting on a result coalesced by another worker."""
+    while True:
+        try:
+            # A dedicated connection: LISTEN holds it for the worker's lifetime
+            async with await AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {PROMPT_CHANNEL}")
+                await conn.execute(f"LISTEN {COALESCE_CHANNEL}")
+                # Edits made while disconnected are not notified
+                _prompt_cache.clear()
+                async for notify in conn.notifies():
+                    if notify.channel == COALESCE_CHANNEL:
+                        for event in _result_waiters.get(notify.payload, ()):
+                            event.set()
+                    else:
+                        _prompt_cache.pop(notify.payload, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[DB] Prompt change listener disconnected: {e}")
+            await asyncio.sleep(5)
+
+
+async def get_all_prompts():
+    """Get all prompts from database or files."""
+    if _pool is not None:
         try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT key, name, content, is_default, updated_at FROM prompts ORDER BY id")
-                prompts = cur.fetchall()
-                return [dict(p) for p in prompts]
+            async with _pool.connection() as conn:
+                cur = await conn.execute("SELECT key, name, content, is_default, updated_at FROM prompts ORDER BY id")
+                prompts = await cur.fetchall()
+                now = time.monotonic()
+                for p in prompts:
+                    _prompt_cache[p["key"]] = (p["content"], now)
+                return prompts
         except Exception as e:
             print(f"[DB] Error fetching prompts: {e}")
-        finally:
-            conn.close()
 
     # Fallback to file-based prompts
     prompts = []
     for prompt_def in PROMPT_DEFINITIONS:
         file_path = PROMPTS_DIR / prompt_def["file"]
         content = file_path.read_text() if file_path.exists() else ""
+        _prompt_cache[prompt_def["key"]] = (content, time.monotonic())
         prompts.append({
             "key": prompt_def["key"],
             "name": prompt_def["name"],
@@ -106,59 +261,59 @@ def get_all_prompts():
     return prompts
 
 
-def get_prompt(key: str) -> str:
+async def get_prompt(key: str) -> str:
     """Get a single prompt by key."""
-    conn = get_connection()
+    cached = _prompt_cache.get(key)
+    if cached and time.monotonic() - cached[1] < PROMPT_CACHE_TTL_SECONDS:
+        return cached[0]
 
-    if conn:
+    if _pool is not None:
         try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT content FROM prompts WHERE key = %s", (key,))
-                result = cur.fetchone()
+            async with _pool.connection() as conn:
+                # Hot path: prepared once per pooled connection
+                cur = await conn.execute("SELECT content FROM prompts WHERE key = %s", (key,), prepare=True)
+                result = await cur.fetchone()
                 if result:
+                    _prompt_cache[key] = (result["content"], time.monotonic())
                     return result["content"]
         except Exception as e:
             print(f"[DB] Error fetching prompt {key}: {e}")
-        finally:
-            conn.close()
 
     # Fallback to file
     for prompt_def in PROMPT_DEFINITIONS:
         if prompt_def["key"] == key:
             file_path = PROMPTS_DIR / prompt_def["file"]
             if file_path.exists():
-                return file_path.read_text()
+                content = file_path.read_text()
+                _prompt_cache[key] = (content, time.monotonic())
+                return content
     return ""
 
 
-def update_prompt(key: str, content: str) -> bool:
+async def update_prompt(key: str, content: str) -> bool:
     """Update a prompt in the database."""
-    conn = get_connection()
-    if not conn:
+    if _pool is None:
         return False
 
     try:
-        with conn.cursor() as cur:
-            cur.execute(
+        async with _pool.connection() as conn:
+            cur = await conn.execute(
                 """UPDATE prompts
                    SET content = %s, is_default = FALSE, updated_at = CURRENT_TIMESTAMP
                    WHERE key = %s""",
                 (content, key)
             )
-            conn.commit()
-            return cur.rowcount > 0
+            await conn.execute("SELECT pg_notify(%s, %s)", (PROMPT_CHANNEL, key))
+        _prompt_cache.pop(key, None)
+        return cur.rowcount > 0
     except Exception as e:
         print(f"[DB] Error updating prompt {key}: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
-def reset_prompt(key: str) -> bool:
+async def reset_prompt(key: str) -> bool:
     """Reset a prompt to its default value."""
-    conn = get_connection()
-    if not conn:
+    if _pool is None:
         return False
 
     # Find the default content from file
@@ -174,18 +329,302 @@ def reset_prompt(key: str) -> bool:
         return False
 
     try:
-        with conn.cursor() as cur:
-            cur.execute(
+        async with _pool.connection() as conn:
+            cur = await conn.execute(
                 """UPDATE prompts
                    SET content = %s, is_default = TRUE, updated_at = CURRENT_TIMESTAMP
                    WHERE key = %s""",
                 (default_content, key)
             )
-            conn.commit()
-            return cur.rowcount > 0
+            await conn.execute("SELECT pg_notify(%s, %s)", (PROMPT_CHANNEL, key))
+        _prompt_cache.pop(key, None)
+        return cur.rowcount > 0
     except Exception as e:
         print(f"[DB] Error resetting prompt {key}: {e}")
-        conn.rollback()
         return False
+
+
+async def save_session_result(session_id: str, step: str, result: dict, provider: str = None, template: str = None) -> bool:
+    """Persist one step result for a session."""
+    if _pool is None:
+        return False
+
+    try:
+        async with _pool.connection() as conn:
+            await conn.execute(
+                """INSERT INTO session_results (session_id, step, template, provider, result)
+                   VALUES (%s, %s, %s, %s, %s)""",
+                (session_id, step, template, provider, Jsonb(result))
+            )
+        return True
+    except Exception as e:
+        print(f"[DB] Error saving {step} result for session {session_id}: {e}")
+        return False
+
+
+def threat_hash(threat: dict) -> str:
+    """Identity of a threat for de-duplicating saves: its classification and whitespace/case-normalized scenario."""
+    scenario = " ".join(str(threat.get("scenario", "")).lower().split())
+    key = "\x1f".join([str(threat.get("stride") or ""), str(threat.get("cia_triad") or ""), scenario])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+async def save_threats(session_id: str, threats: list, components: list = None, provider: str = None, template: str = None) -> bool:
+    """Store generated threats individually so they can be filtered and paged.
+
+    Each threat is tagged with its MITRE tactic IDs and with the in-scope
+    components its scenario (or a duplicate merged into it) mentions. Saving
+    is idempotent: a threat already stored for the session and template (a
+    shared coalesced or speculated result, or a re-run) is skipped and not
+    counted again.
+    """
+    if not threats or _pool is None:
+        return False
+
+    names = component_names(components)
+    rows = [(
+        session_id, template, provider,
+        threat.get("stride"), threat.get("cia_triad"),
+        sorted(set(re.findall(r"\bTA\d{4}\b", str(threat.get("mitre_tactic", ""))))),
+        affected_components(threat, names),
+        threat_hash(threat),
+        Jsonb(threat)
+    ) for threat in threats]
+
+    try:
+        async with _pool.connection() as conn, conn.cursor() as cur:
+            await cur.executemany(
+                """INSERT INTO threats (session_id, template, provider, stride, cia_triad, tactics, components, threat_hash, threat)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                   ON CONFLICT (session_id, COALESCE(template, ''), threat_hash) DO NOTHING
+                   RETURNING stride, cia_triad""",
+                rows,
+                returning=True
+            )
+            cells = {}
+            while True:
+                for row in await cur.fetchall():
+                    cell = (session_id, row["stride"] or "", row["cia_triad"] or "")
+                    cells[cell] = cells.get(cell, 0) + 1
+                if not cur.nextset():
+                    break
+            if cells:
+                await cur.executemany(
+                    """INSERT INTO threat_counts (session_id, stride, cia_triad, count) VALUES (%s, %s, %s, %s)
+                       ON CONFLICT (session_id, stride, cia_triad) DO UPDATE SET count = threat_counts.count + EXCLUDED.count""",
+                    [cell + (count,) for cell, count in cells.items()]
+                )
+        return True
+    except Exception as e:
+        print(f"[DB] Error saving threats for session {session_id}: {e}")
+        return False
+
+
+def _threat_filters(session_id=None, stride=None, cia_triad=None, tactic=None, component=None, search=None):
+    clauses, params = [], []
+    if session_id:
+        clauses.append("session_id = %s")
+        params.append(session_id)
+    if stride:
+        clauses.append("stride = %s")
+        params.append(stride)
+    if cia_triad:
+        clauses.append("cia_triad = %s")
+        params.append(cia_triad)
+    if tactic:
+        clauses.append("tactics @> ARRAY[%s]::text[]")
+        params.append(tactic.upper())
+    if component:
+        clauses.append("components @> ARRAY[%s]::text[]")
+        params.append(component.strip().lower())
+    if search:
+        clauses.append("search @@ websearch_to_tsquery('english', %s)")
+        params.append(search)
+    return clauses, params
+
+
+async def query_threats(limit: int = 50, cursor: int = None, **filters):
+    """Get one page of stored threats, newest first, plus the cursor for the next page.
+
+    Returns None when no database is configured.
+    """
+    if _pool is None:
+        return None
+
+    clauses, params = _threat_filters(**filters)
+    if cursor:
+        clauses.append("id < %s")
+        params.append(cursor)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    async with _pool.connection() as conn:
+        cur = await conn.execute(
+            f"""SELECT id, session_id, template, provider, threat, created_at FROM threats
+                {where} ORDER BY id DESC LIMIT %s""",
+            params + [limit + 1]
+        )
+        rows = await cur.fetchall()
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def count_threats(**filters) -> dict:
+    """Threat counts per STRIDE category and CIA triad value for the matrix view."""
+    if _pool is None:
+        return {}
+
+    clauses, params = _threat_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # Session/STRIDE/CIA filters are answered from the rollup; others need the threats themselves
+    rollup = not any(filters.get(f) for f in ("tactic", "component", "search"))
+    async with _pool.connection() as conn:
+        if rollup:
+            cur = await conn.execute(
+                f"""SELECT NULLIF(stride, '') AS stride, NULLIF(cia_triad, '') AS cia_triad, SUM(count)::bigint AS count
+                    FROM threat_counts {where} GROUP BY 1, 2""",
+                params
+            )
+        else:
+            cur = await conn.execute(
+                f"""SELECT stride, cia_triad, COUNT(*) AS count FROM threats
+                    {where} GROUP BY stride, cia_triad""",
+                params
+            )
+        cells = await cur.fetchall()
+
+    counts = {"total": 0, "stride": {}, "cia_triad": {}, "matrix": cells}
+    for cell in cells:
+        counts["total"] += cell["count"]
+        counts["stride"][cell["stride"]] = counts["stride"].get(cell["stride"], 0) + cell["count"]
+        counts["cia_triad"][cell["cia_triad"]] = counts["cia_triad"].get(cell["cia_triad"], 0) + cell["count"]
+    return counts
+
+
+class AdvisoryLocks:
+    """Session-level advisory locks held on one dedicated connection per worker.
+
+    Only the lock and unlock statements use the connection, so a lock held for
+    the length of a provider call ties up no pooled connection. Advisory locks
+    are re-entrant within a session, so keys held here are also tracked
+    in-process to keep a second local caller from "taking" the same lock.
+    """
+
+    def __init__(self):
+        self._conn: Optional[AsyncConnection] = None
+        self._lock = asyncio.Lock()
+        self._held: Set[int] = set()
+
+    async def _connection(self) -> AsyncConnection:
+        if self._conn is None or self._conn.closed:
+            self._conn = await AsyncConnection.connect(DATABASE_URL, autocommit=True)
+        return self._conn
+
+    async def try_lock(self, lock_id: int) -> bool:
+        async with self._lock:
+            if lock_id in self._held:
+                return False
+            conn = await self._connection()
+            cur = await conn.execute("SELECT pg_try_advisory_lock(%s)", (lock_id,))
+            if not (await cur.fetchone())[0]:
+                return False
+            self._held.add(lock_id)
+            return True
+
+    async def unlock(self, lock_id: int):
+        async with self._lock:
+            self._held.discard(lock_id)
+            if self._conn is not None and not self._conn.closed:
+                await self._conn.execute("SELECT pg_advisory_unlock(%s)", (lock_id,))
+
+    async def close(self):
+        async with self._lock:
+            if self._conn is not None:
+                await self._conn.close()
+            self._conn = None
+            self._held.clear()
+
+
+advisory_locks = AdvisoryLocks()
+
+
+async def _coalesced_result(key: str):
+    async with _pool.connection() as conn:
+        cur = await conn.execute(
+            """SELECT result FROM coalesced_results
+               WHERE key = %s AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)""",
+            (key, COALESCE_RESULT_TTL_SECONDS)
+        )
+        row = await cur.fetchone()
+    return row["result"] if row else None
+
+
+async def _store_coalesced_result(key: str, result):
+    async with _pool.connection() as conn:
+        await conn.execute(
+            """INSERT INTO coalesced_results (key, result) VALUES (%s, %s)
+               ON CONFLICT (key) DO UPDATE SET result = EXCLUDED.result, created_at = CURRENT_TIMESTAMP""",
+            (key, Jsonb(result))
+        )
+        await conn.execute(
+            "DELETE FROM coalesced_results WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+            (COALESCE_RESULT_TTL_SECONDS,)
+        )
+
+
+async def run_with_advisory_lock(key: str, fn: Callable[[], Awaitable], locks: Optional[AdvisoryLocks] = None):
+    """Run fn at most once across workers for the same request key.
+
+    The first worker to take the Postgres advisory lock derived from the key
+    awaits fn, stores its result and notifies COALESCE_CHANNEL; the others wait
+    for the notification (or the next poll), then read the stored result. If
+    the leader fails without a result, the next waiter takes the lock and runs
+    fn itself. Falls back to awaiting fn directly when no database is
+    configured or the lock connection fails.
+    """
+    if _pool is None:
+        return await fn()
+    locks = locks or advisory_locks
+    lock_id = int.from_bytes(bytes.fromhex(key[:16]), "big", signed=True)
+    event = asyncio.Event()
+    _result_waiters.setdefault(key, set()).add(event)
+    try:
+        while True:
+            event.clear()
+            try:
+                result = await _coalesced_result(key)
+                if result is not None:
+                    return result
+                locked = await locks.try_lock(lock_id)
+            except Exception as e:
+                print(f"[DB] Error taking advisory lock for {key[:12]}: {e}")
+                return await fn()
+            if locked:
+                break
+            try:
+                await asyncio.wait_for(event.wait(), COALESCE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        waiters = _result_waiters.get(key, set())
+        waiters.discard(event)
+        if not waiters:
+            _result_waiters.pop(key, None)
+
+    try:
+        # The previous holder may have stored a result between our read and the lock
+        result = await _coalesced_result(key)
+        if result is not None:
+            return result
+        result = await fn()
+        try:
+            await _store_coalesced_result(key, result)
+        except Exception as e:
+            print(f"[DB] Error storing coalesced result {key[:12]}: {e}")
+        return result
     finally:
-        conn.close()
+        try:
+            await locks.unlock(lock_id)
+            async with _pool.connection() as conn:
+                await conn.execute("SELECT pg_notify(%s, %s)", (COALESCE_CHANNEL, key))
+        except Exception as e:
+            print(f"[DB] Error releasing advisory lock for {key[:12]}: {e}")
@@ -0,0 +1,153 @@
+"""Near-duplicate threat detection and merging.
+
+Threat scenarios are embedded as hashed TF-IDF vectors (word unigrams and
+bigrams), compared with blocked matrix products in NumPy and grouped into
+clusters with union-find. Only threats with the same STRIDE category and CIA
+property are merged; each cluster keeps its most detailed scenario and the
+union of its members' mitigations and affected components.
+
+Merging a single response is opt-in (THREAT_DEDUP); the threats of several
+templates are always merged where they are combined (the WebSocket pipeline's
+"merged" event and bulk runs). bench_dedup.py times merging at scale.
+"""
+import os
+import re
+import zlib
+from typing import List
+
+import numpy as np
+
+THREAT_DEDUP = os.environ.get("THREAT_DEDUP", "false").lower() in ("1", "true", "yes")
+# Cosine similarity above which two scenarios are treated as the same threat
+THREAT_DEDUP_THRESHOLD = float(os.environ.get("THREAT_DEDUP_THRESHOLD", "0.8"))
+DEDUP_DIMENSIONS = 1024
+BLOCK_SIZE = 1024
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE = re.compile(r"(?<=[.;])\s+")
+
+
+def _features(text: str) -> List[str]:
+    words = _WORD.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def embed(texts: List[str], dimensions: int = DEDUP_DIMENSIONS) -> np.ndarray:
+    """Hashed TF-IDF vectors, L2-normalized, one row per text."""
+    buckets = {}
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            col = buckets.get(feature)
+            if col is None:
+                col = buckets[feature] = zlib.crc32(feature.encode()) % dimensions
+            rows.append(row)
+            cols.append(col)
+
+    n = len(texts)
+    flat = np.asarray(rows, dtype=np.int64) * dimensions + np.asarray(cols, dtype=np.int64)
+    tf = np.bincount(flat, minlength=n * dimensions).reshape(n, dimensions).astype(np.float32)
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + n) / (1 + df)).astype(np.float32) + 1
+    vectors = np.log1p(tf) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def similar_pairs(vectors: np.ndarray, threshold: float) -> np.ndarray:
+    """(i, j) index pairs with i < j and cosine similarity >= threshold, computed in row blocks."""
+    pairs = []
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        # Rows start..start+BLOCK_SIZE against every later row; columns are offset by start too
+        block = vectors[start:start + BLOCK_SIZE] @ vectors[start:].T
+        i, j = np.nonzero(block >= threshold)
+        upper = j > i
+        pairs.append(np.stack([i[upper] + start, j[upper] + start], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+
+def cluster(texts: List[str], threshold: float = THREAT_DEDUP_THRESHOLD) -> List[List[int]]:
+    """Group indices of near-duplicate texts, preserving first-seen order."""
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(texts) > 1:
+        for i, j in similar_pairs(embed(texts), threshold).tolist():
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _merge_mitigations(values: List[str]) -> str:
+    seen, merged = set(), []
+    for value in values:
+        for sentence in _SENTENCE.split(value.strip()):
+            key = " ".join(_WORD.findall(sentence.lower()))
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(sentence)
+    return " ".join(merged)
+
+
+def component_names(components) -> List[str]:
+    """Lower-cased names of in-scope components (dicts or strings)."""
+    names = [c.get("name", "") if isinstance(c, dict) else str(c) for c in components or []]
+    return [n.strip().lower() for n in names if n and n.strip()]
+
+
+def affected_components(threat: dict, names: List[str]) -> List[str]:
+    """Component names the threat's scenario mentions, plus those of threats merged into it."""
+    scenario = str(threat.get("scenario", "")).lower()
+    found = [n for n in names if n in scenario]
+    return found + [n for n in threat.get("components") or [] if n not in found]
+
+
+def _category(threat: dict) -> tuple:
+    return tuple(str(threat.get(field) or "").strip().lower() for field in ("stride", "cia_triad"))
+
+
+def dedupe_threats(threats: List[dict], threshold: float = THREAT_DEDUP_THRESHOLD, components: list = None) -> List[dict]:
+    """Merge near-duplicate threats (e.g. from several templates or re-runs).
+
+    Only threats with the same stride and cia_triad are compared. The member
+    with the longest scenario represents each cluster and keeps its id and
+    classification; mitigations and affected `components` (names from
+    `components` its members mention) are combined.
+    """
+    if len(threats) < 2:
+        return threats
+
+    categories = {}
+    for i, threat in enumerate(threats):
+        categories.setdefault(_category(threat), []).append(i)
+    groups = []
+    for indices in categories.values():
+        texts = [str(threats[i].get("scenario", "")) for i in indices]
+        groups.extend([indices[j] for j in group] for group in cluster(texts, threshold))
+    groups.sort(key=lambda group: group[0])
+
+    names = component_names(components)
+    merged = []
+    for group in groups:
+        members = [threats[i] for i in group]
+        threat = dict(max(members, key=lambda t: len(str(t.get("scenario", "")))))
+        if len(members) > 1:
+            threat["mitigations"] = _merge_mitigations([str(t.get("mitigations", "")) for t in members])
+            affected = []
+            for member in members:
+                affected += [n for n in affected_components(member, names) if n not in affected]
+            threat["components"] = affected
+        merged.append(threat)
+    return merged
+
@@ -0,0 +1,94 @@
+"""Local stand-in for the Anthropic Message Batches API.
+
+Answers every batch request with the fake provider's canned response for its
+step (read from the custom_id, as BulkPipeline builds it), as a submit_result
+tool_use block when the request has tools. A batch reports "ended" after
+FAKE_BATCH_POLLS status checks.
+
+    uvicorn fake_batch_server:app --port 8100
+    CLAUDE_API_BASE=http://localhost:8100 python bulk.py diagrams/ --templates baseline,aws
+"""
+import os
+import re
+import json
+import uuid
+from typing import Dict, List
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from fake_client import FAKE_RESPONSES
+from schemas import TOOL_NAME
+
+FAKE_BATCH_POLLS = int(os.environ.get("FAKE_BATCH_POLLS", "1"))
+STEP_PATTERN = re.compile(r"(STEP-(?:1|2[ABC]|3))(?:-|$)")
+
+app = FastAPI(title="Fake Message Batches API")
+batches: Dict[str, dict] = {}
+
+
+def fake_message(custom_id: str, params: dict) -> dict:
+    """A batch result line for one request."""
+    match = STEP_PATTERN.search(custom_id)
+    if not match:
+        return {"custom_id": custom_id, "result": {
+            "type": "errored", "error": {"type": "invalid_request_error", "message": "Unknown step"}}}
+    data = FAKE_RESPONSES[match.group(1)]
+    if params.get("tools"):
+        content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}", "name": TOOL_NAME, "input": data}]
+        stop_reason = "tool_use"
+    else:
+        content = [{"type": "text", "text": json.dumps(data)}]
+        stop_reason = "end_turn"
+    prompt_chars = len(json.dumps(params["messages"]))
+    return {"custom_id": custom_id, "result": {"type": "succeeded", "message": {
+        "id": f"msg_{uuid.uuid4().hex[:12]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params["model"],
+        "content": content,
+        "stop_reason": stop_reason,
+        "usage": {"input_tokens": prompt_chars // 4, "output_tokens": len(json.dumps(data)) // 4},
+    }}}
+
+
+def batch_status(batch: dict, request: Request) -> dict:
+    ended = batch["polls"] >= FAKE_BATCH_POLLS
+    return {
+        "id": batch["id"],
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {"processing": 0 if ended else len(batch["requests"]),
+                           "succeeded": len(batch["requests"]) if ended else 0,
+                           "errored": 0, "canceled": 0, "expired": 0},
+        "results_url": str(request.url_for("batch_results", batch_id=batch["id"])) if ended else None,
+    }
+
+
+@app.post("/v1/messages/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    requests: List[dict] = body.get("requests") or []
+    if not requests:
+        raise HTTPException(status_code=400, detail="requests must not be empty")
+    batch = {"id": f"msgbatch_{uuid.uuid4().hex[:16]}", "requests": requests, "polls": 0}
+    batches[batch["id"]] = batch
+    return batch_status(batch, request)
+
+
+@app.get("/v1/messages/batches/{batch_id}")
+async def get_batch(batch_id: str, request: Request):
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    batch["polls"] += 1
+    return batch_status(batch, request)
+
+
+@app.get("/v1/messages/batches/{batch_id}/results", name="batch_results")
+async def batch_results(batch_id: str):
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    lines = (json.dumps(fake_message(r["custom_id"], r["params"])) + "\n" for r in batch["requests"])
+    return StreamingResponse(lines, media_type="application/x-jsonl")
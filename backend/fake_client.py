@@ -0,0 +1,85 @@
+import os
+import json
+from typing import Optional, Dict
+
+from base_client import BaseClient, Completion
+from cancellation import RequestCancelled, wait_cancelled
+
+# Simulated provider response time, e.g. to exercise admission control or cancellation locally
+FAKE_LATENCY_SECONDS = float(os.environ.get("FAKE_LATENCY_SECONDS", "0"))
+
+# Canned responses per step, shaped like the real prompt output formats
+FAKE_RESPONSES = {
+    "STEP-1": {
+        "entry_points": ["Application Load Balancer - Routes HTTPS traffic to backend services"],
+        "data_flows": ["User requests flow through ALB → ECS service → RDS database"],
+        "security_boundaries": ["VPC boundary isolates compute and database resources"],
+        "public_resources": ["Application Load Balancer - Internet-facing"],
+        "private_resources": ["RDS database - Isolated in private subnet"]
+    },
+    "STEP-2A": {
+        "application_description": "A containerized web application behind a public load balancer with a private relational database."
+    },
+    "STEP-2B": {
+        "key_features": ["HTTPS termination at Application Load Balancer", "Network isolation using private subnets within VPC"]
+    },
+    "STEP-2C": {
+        "in_scope_components": [
+            {"name": "Application Load Balancer", "category": "network"},
+            {"name": "Amazon ECS", "category": "compute"},
+            {"name": "Amazon RDS", "category": "database"}
+        ]
+    },
+    "STEP-3": {
+        "threats": [
+            {
+                "id": "TS01",
+                "scenario": "An attacker exploits an unauthenticated endpoint on the load balancer to reach internal services.",
+                "cia_triad": "Confidentiality",
+                "stride": "Information Disclosure",
+                "mitre_tactic": "TA0001 - Initial Access",
+                "mitre_technique": "T1190 - Exploit Public-Facing Application",
+                "mitigations": "Enforce authentication at the ALB and restrict security group ingress."
+            }
+        ]
+    }
+}
+
+
+class FakeClient(BaseClient):
+    """Local provider that serves canned responses without network access.
+
+    Useful for developing the frontend and for exercising the shared pipeline
+    offline. `latency` simulates provider response time in seconds.
+    """
+
+    provider = "fake"
+    fast_model = "fake-model-fast"
+
+    def __init__(self, responses: Optional[Dict[str, dict]] = None, latency: float = FAKE_LATENCY_SECONDS, structured_output: Optional[bool] = None):
+        self.responses = responses or FAKE_RESPONSES
+        self.latency = latency
+        super().__init__("fake-model", structured_output)
+
+    def _invoke(
+        self,
+        prompt: str,
+        image_base64: Optional[str] = None,
+        media_type: str = "image/png",
+        max_tokens: int = 4096,
+        step_name: str = "INVOKE",
+        structured: bool = False,
+        model: Optional[str] = None
+    ) -> Completion:
+        """Return the canned response for a step."""
+        if self.latency and wait_cancelled(self.latency):
+            raise RequestCancelled()
+
+        data = self.responses.get(step_name, {})
+        text = json.dumps(data)
+        return Completion(
+            text=text,
+            data=data if structured else None,
+            stop_reason="end_turn",
+            usage={"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+        )
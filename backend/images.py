@@ -0,0 +1,233 @@
+import os
+import base64
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import BinaryIO, Iterator, List, Optional
+
+import orjson
+
+MB = 1024 * 1024
+# Largest decoded diagram accepted, and the largest request body (the image as base64 plus the rest)
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(20 * MB)))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(MAX_IMAGE_BYTES * 4 // 3 + MB)))
+# Larger images are rejected before decoding (a few KB of PNG can expand to gigabytes)
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(100_000_000)))
+# Encoded forms of recent images kept for reuse across the calls of a session, least recently used evicted first
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", str(128 * MB)))
+IMAGE_CACHE_IMAGES = int(os.environ.get("IMAGE_CACHE_IMAGES", "16"))
+# Decoded images larger than this are kept in a temporary file rather than in memory
+IMAGE_SPOOL_BYTES = int(os.environ.get("IMAGE_SPOOL_BYTES", str(4 * MB)))
+# Base64 is decoded this many characters (a multiple of 4) at a time
+DECODE_CHUNK_CHARS = 4 * MB
+
+_PLACEHOLDER = "\x00image\x00"
+_MARKER = orjson.dumps(_PLACEHOLDER)
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+
+class ImageRejected(Exception):
+    """Raised for an image that is too large to decode (413) or cannot be decoded (422)."""
+
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def decoded_size(image_base64: str) -> int:
+    """Size of the decoded image, computed from the base64 length without decoding."""
+    return len(image_base64) * 3 // 4 - image_base64[-2:].count("=")
+
+
+class EncodedImage:
+    """One uploaded image, encoded once and shared by every provider call that sends it.
+
+    `json` is the image as a quoted JSON string (in chunks), spliced into
+    request bodies as-is; `file()` is the decoded image, streamed from the
+    base64 into a SpooledTemporaryFile, for APIs and code that need bytes.
+    """
+
+    def __init__(self, image_base64: str, raw: Optional[bytes] = None):
+        self.base64 = image_base64
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._json: Optional[List[bytes]] = None
+        self._decoded: Optional[BinaryIO] = None
+        self._decoded_size = 0
+        if raw is not None:
+            self._spool([raw])
+
+    @property
+    def json(self) -> List[bytes]:
+        with self._lock:
+            if self._json is None:
+                self._json = _json_string(self.base64)
+                _cache.grow(self, sum(map(len, self._json)))
+            return self._json
+
+    @contextmanager
+    def file(self) -> Iterator[BinaryIO]:
+        """The decoded image as a seekable file, for one reader at a time."""
+        with self._file_lock:
+            if self._decoded is None:
+                self._spool(_decode_chunks(self.base64))
+                _cache.grow(self, self.decoded_in_memory)
+            self._decoded.seek(0)
+            yield self._decoded
+
+    @property
+    def raw(self) -> bytes:
+        with self.file() as decoded:
+            return decoded.read()
+
+    def _spool(self, chunks):
+        spool = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_BYTES)
+        for chunk in chunks:
+            spool.write(chunk)
+        self._decoded_size = spool.tell()
+        self._decoded = spool
+
+    @property
+    def spooled(self) -> bool:
+        """Whether the decoded image is on disk (it rolls over once larger than IMAGE_SPOOL_BYTES)."""
+        return self._decoded_size > IMAGE_SPOOL_BYTES
+
+    @property
+    def decoded_in_memory(self) -> int:
+        return 0 if self.spooled else self._decoded_size
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.base64) + sum(map(len, self._json or [])) + self.decoded_in_memory
+
+
+def _decode_chunks(image_base64: str) -> Iterator[bytes]:
+    """Decode base64 a chunk at a time, so the whole image is never held as one bytes object."""
+    if not _is_base64(image_base64):
+        # Whitespace or stray characters would misalign the chunks
+        yield base64.b64decode(image_base64)
+        return
+    for start in range(0, len(image_base64), DECODE_CHUNK_CHARS):
+        yield base64.b64decode(image_base64[start:start + DECODE_CHUNK_CHARS])
+
+
+def _is_base64(value: str) -> bool:
+    return value.isascii() and not value.encode("ascii").rstrip(_BASE64_ALPHABET)
+
+
+def _json_string(value: str) -> List[bytes]:
+    """A base64 string as JSON, in chunks.
+
+    Base64 needs no escaping, so the encoded string is used between quote
+    chunks as-is: orjson reserves several times the length of a multi-MB
+    string while encoding it, and concatenating the quotes would copy it.
+    """
+    if not _is_base64(value):
+        # Whitespace or other characters that may need escaping
+        return [orjson.dumps(value)]
+    return [b'"', value.encode("ascii"), b'"']
+
+
+class _ImageCache:
+    """Recently used images, bounded by total size and count, least recently used evicted first.
+
+    Keyed by the base64 string itself, i.e. by content: an equal image sent by
+    the session's next request finds the entry, and the calls of one request,
+    which share its string, look it up without rehashing (a str caches its
+    hash). An image alone over the size limit is still cached until the next
+    one arrives.
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_BYTES, max_images: int = IMAGE_CACHE_IMAGES):
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, EncodedImage]" = OrderedDict()
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, image_base64: str, raw: Optional[bytes] = None) -> EncodedImage:
+        with self._lock:
+            entry = self._entries.get(image_base64)
+            if entry is not None:
+                self._entries.move_to_end(image_base64)
+                self.stats["hits"] += 1
+                return entry
+        # Spooling an upload may write to disk, so it happens outside the lock
+        new = EncodedImage(image_base64, raw)
+        with self._lock:
+            entry = self._entries.get(image_base64)
+            if entry is not None:
+                self.stats["hits"] += 1
+                return entry
+            self._entries[image_base64] = new
+            self.stats["misses"] += 1
+            self.nbytes += new.nbytes
+            self._evict()
+            return new
+
+    def grow(self, entry: EncodedImage, nbytes: int):
+        with self._lock:
+            if self._entries.get(entry.base64) is entry:
+                self.nbytes += nbytes
+                self._evict()
+
+    def _evict(self):
+        while (self.nbytes > self.max_bytes or len(self._entries) > self.max_images) and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
+            self.stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"images": len(self._entries), "cached_mb": round(self.nbytes / MB, 1),
+                    "spooled": sum(entry.spooled for entry in self._entries.values()), **self.stats}
+
+
+_cache = _ImageCache()
+
+
+def encoded_image(image_base64: str) -> EncodedImage:
+    return _cache.get(image_base64)
+
+
+def uploaded_image(data: bytes) -> str:
+    """Base64 for an image uploaded as bytes; the bytes are spooled into its cache entry rather than decoded again."""
+    image_base64 = base64.b64encode(data).decode()
+    _cache.get(image_base64, data)
+    return image_base64
+
+
+def image_cache_metrics() -> dict:
+    return _cache.metrics()
+
+
+def _swap(node, image_base64: str):
+    if node is image_base64:
+        return _PLACEHOLDER
+    if isinstance(node, dict):
+        return {k: _swap(v, image_base64) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_swap(v, image_base64) for v in node]
+    return node
+
+
+def json_body(payload: dict, image_base64: Optional[str] = None) -> List[bytes]:
+    """Serialize a request body as chunks around the image's shared JSON encoding.
+
+    The image is not copied: the chunks can be sent one after another (httpx
+    `content=` with a Content-Length header) without joining them.
+    """
+    if not image_base64:
+        return [orjson.dumps(payload)]
+    body = orjson.dumps(_swap(payload, image_base64))
+    if _MARKER not in body:
+        return [body]
+    before, after = body.split(_MARKER, 1)
+    return [before, *encoded_image(image_base64).json, after]
+
+
+def content_headers(parts: List[bytes]) -> dict:
+    """Headers for sending json_body chunks unchunked."""
+    return {"Content-Type": "application/json", "Content-Length": str(sum(map(len, parts)))}
@@ -0,0 +1,85 @@
+"""Multi-worker serving and graceful draining.
+
+`python main.py` runs WEB_CONCURRENCY uvicorn worker processes (default 1).
+Workers share prompt edits (NOTIFY) and, with COALESCE_ACROSS_WORKERS,
+in-flight provider calls and their results for COALESCE_RESULT_TTL_SECONDS
+through Postgres. Everything else is per worker: speculated results (only a
+request that lands on the same worker claims one), the provider, tenant
+queue and tenant token limits (each worker enforces its 1/WEB_CONCURRENCY
+share of the configured value) and the DB pool (DB_POOL_MAX_SIZE plus the
+LISTEN and lock connections, per worker).
+
+On SIGTERM (a deploy) a worker drains: /health reports 503 so the load
+balancer stops routing to it, no new speculative work starts, uvicorn stops
+accepting connections and lets in-flight requests finish, and the lifespan
+then waits for provider calls still running in the background, all within
+DRAIN_TIMEOUT_SECONDS. WebSocket pipelines are closed with 1012 (service
+restart) for the client to start over on another worker.
+"""
+import os
+import time
+import signal
+import threading
+import asyncio
+import functools
+from typing import Callable, Optional
+
+# Worker processes in this deployment (`python main.py` starts this many)
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY") or "1"))
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get("DRAIN_TIMEOUT_SECONDS", "120"))
+# How often open WebSockets check whether their worker has started draining
+DRAIN_POLL_SECONDS = 0.5
+
+
+class Drain:
+    """Tracks whether this worker is shutting down and waits for its work to finish."""
+
+    def __init__(self):
+        self.draining = False
+        self._started: Optional[float] = None
+
+    def install(self):
+        """Start draining on the server's shutdown signals (called once the server has installed its handlers)."""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if callable(previous):
+                signal.signal(sig, functools.partial(self._on_signal, previous))
+
+    def _on_signal(self, previous: Callable, sig, frame):
+        self.begin()
+        previous(sig, frame)
+
+    def begin(self):
+        if not self.draining:
+            self.draining = True
+            self._started = time.monotonic()
+
+    def remaining(self) -> float:
+        if self._started is None:
+            return DRAIN_TIMEOUT_SECONDS
+        return max(0.0, DRAIN_TIMEOUT_SECONDS - (time.monotonic() - self._started))
+
+    async def started(self):
+        """Return once this worker starts draining (begin() runs in a signal handler, so this polls)."""
+        while not self.draining:
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+
+    async def wait(self, in_flight: Callable[[], int]) -> int:
+        """Wait (for what is left of the drain timeout) until in_flight() is 0; returns what is still running."""
+        deadline = time.monotonic() + self.remaining()
+        while in_flight() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return in_flight()
+
+    def metrics(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "workers": WEB_CONCURRENCY,
+            "draining": self.draining,
+            "drain_seconds_left": round(self.remaining(), 1) if self.draining else None,
+        }
+
+
+drain = Drain()
@@ -1,20 +1,50 @@
 from dotenv import load_dotenv
 load_dotenv()  # Load .env file before other imports
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import PlainTextResponse
+from starlette.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, List, Literal
 from datetime import datetime
 from contextlib import asynccontextmanager
 import traceback
+import functools
+import hashlib
+import hmac
+import importlib
+import uuid
+import asyncio
+import time
 import uvicorn
+import orjson
 import os
 
-from bedrock_client import BedrockClient, log
-from gemini_client import GeminiClient
-from claude_client import ClaudeClient
-from database import init_database, get_all_prompts, get_prompt, update_prompt, reset_prompt, PROMPT_DEFINITIONS
+from base_client import log
+import tiling
+from database import (
+    init_database, close_database, get_all_prompts, get_prompt, update_prompt, reset_prompt, PROMPT_DEFINITIONS,
+    THREAT_TEMPLATES, save_threats, query_threats, count_threats
+)
+from schemas import ComponentItem, ThreatItem
+from coalesce import SingleFlight, request_key
+from admission import AdmissionRejected, TRAFFIC_CLASSES, admission_controller, request_context
+from token_budget import TokenBudgetExceeded, image_dimensions, start_request_budget, token_accountant
+from speculation import Speculator
+from attack import attack_index
+from routing import model_router
+from dedup import dedupe_threats
+from cassette import cassette
+from images import MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS, MAX_REQUEST_BYTES, ImageRejected, decoded_size, image_cache_metrics, uploaded_image
+from cancellation import CANCEL_ON_DISCONNECT, DISCONNECT_POLL_SECONDS, cancellation_stats, disconnect_watched
+from serialization import ORJSONResponse, ORJSONRoute, model_response
+from progress import progress_listener, queue_listener
+from prompt_eval import EVAL_FIXTURES_DIR, evaluate_prompt, load_fixtures
+import profiling
+from profiling import PROFILE_TOKEN, ProfilingMiddleware, profiler, slow_requests
+from lifecycle import DRAIN_TIMEOUT_SECONDS, WEB_CONCURRENCY, drain
 
 # Valid prompt keys (whitelist)
 VALID_PROMPT_KEYS = {p["key"] for p in PROMPT_DEFINITIONS}
@@ -22,12 +52,33 @@ VALID_PROMPT_KEYS = {p["key"] for p in PROMPT_DEFINITIONS}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup."""
-    init_database()
+    """Initialize database and warm up configured providers on startup."""
+    await init_database()
+    if attack_index.error:
+        log("ATTACK", f"{attack_index.error}; MITRE fields are not validated")
+    else:
+        log("ATTACK", f"Loaded {attack_index.version} index in {attack_index.load_ms:.1f} ms", attack_index.metrics())
+    # Prime the prompt cache
+    await get_all_prompts()
+    await asyncio.to_thread(warm_up)
+    drain.install()
     yield
+    # uvicorn has finished the in-flight requests; wait for provider calls still running in the background
+    drain.begin()
+    if not _single_flight.across_workers:
+        # Only this worker could have claimed their results
+        _speculator.cancel_all()
+    left = await drain.wait(admission_controller.in_flight)
+    if left:
+        log("DRAIN", f"{left} provider call(s) still running after {DRAIN_TIMEOUT_SECONDS:.0f}s, exiting anyway")
+    await close_database()
+
 
+app = FastAPI(title="Auspex - Threat Modeling API", lifespan=lifespan, default_response_class=ORJSONResponse)
+app.router.route_class = ORJSONRoute
 
-app = FastAPI(title="Auspex - Threat Modeling API", lifespan=lifespan)
+# Compress large responses (threat lists, /api/prompts)
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MINIMUM_SIZE", "1000")))
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -36,37 +87,153 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
-# Initialize clients lazily
-_bedrock_client = None
-_gemini_client = None
-_claude_client = None
+# Outermost, so request timings and profiles include the other middleware
+app.add_middleware(ProfilingMiddleware)
+
+# Provider name -> (module, class). Modules are imported on first use so SDKs
+# for unused providers (e.g. boto3) are never loaded.
+PROVIDER_CLIENTS = {
+    "bedrock": ("bedrock_client", "BedrockClient"),
+    "gemini": ("gemini_client", "GeminiClient"),
+    "claude": ("claude_client", "ClaudeClient"),
+    "fake": ("fake_client", "FakeClient"),
+}
+
+WARMUP_PING = os.environ.get("WARMUP_PING", "").lower() in ("1", "true", "yes")
+
+_clients = {}
+
+# Identical concurrent analyses share one provider call
+_single_flight = SingleFlight()
+
+# Opt-in background execution of the next pipeline step
+_speculator = Speculator()
 
 
 def get_client(provider: str):
     """Get the appropriate client based on provider."""
-    global _bedrock_client, _gemini_client, _claude_client
-
-    if provider == "bedrock":
-        if _bedrock_client is None:
-            _bedrock_client = BedrockClient()
-        return _bedrock_client
-    elif provider == "gemini":
-        if _gemini_client is None:
-            _gemini_client = GeminiClient()
-        return _gemini_client
-    elif provider == "claude":
-        if _claude_client is None:
-            _claude_client = ClaudeClient()
-        return _claude_client
-    else:
+    if provider not in PROVIDER_CLIENTS:
         raise HTTPException(status_code=400, detail=f"Invalid provider: {provider}")
 
+    if provider not in _clients:
+        module_name, class_name = PROVIDER_CLIENTS[provider]
+        module = importlib.import_module(module_name)
+        _clients[provider] = getattr(module, class_name)()
+    return _clients[provider]
+
+
+def configured_providers() -> List[str]:
+    """Providers to warm up: WARMUP_PROVIDERS if set, otherwise those with credentials in the environment."""
+    explicit = os.environ.get("WARMUP_PROVIDERS")
+    if explicit is not None:
+        return [p.strip() for p in explicit.split(",") if p.strip() in PROVIDER_CLIENTS]
+
+    providers = []
+    if os.environ.get("AWS_ACCESS_KEY_ID") or os.environ.get("AWS_PROFILE"):
+        providers.append("bedrock")
+    if os.environ.get("GEMINI_API_KEY"):
+        providers.append("gemini")
+    if os.environ.get("CLAUDE_API_KEY"):
+        providers.append("claude")
+    return providers
+
+
+def warm_up():
+    """Construct configured clients with open connections."""
+    if cassette.replaying:
+        log("WARMUP", f"Replaying provider calls from {cassette.path}, skipping warm-up")
+        return
+    start = time.perf_counter()
+
+    for provider in configured_providers():
+        provider_start = time.perf_counter()
+        try:
+            get_client(provider).warm_up(ping=WARMUP_PING)
+            log("WARMUP", f"{provider} ready in {(time.perf_counter() - provider_start) * 1000:.0f} ms")
+        except Exception as e:
+            # A provider that fails to warm up is retried lazily on first request
+            log("WARMUP", f"{provider} warm-up failed: {e}")
+
+    log("WARMUP", f"Warm-up complete in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def set_request_context(http_request: HTTPConnection):
+    """Identify the tenant and traffic class used for admission control."""
+    api_key = http_request.headers.get("x-api-key")
+    tenant = http_request.headers.get("x-tenant-id")
+    if not tenant and api_key:
+        tenant = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    if not tenant:
+        tenant = http_request.client.host if http_request.client else "anonymous"
+
+    traffic_class = http_request.headers.get("x-traffic-class", "interactive").lower()
+    if traffic_class not in TRAFFIC_CLASSES:
+        traffic_class = "interactive"
+
+    request_context.set((tenant, traffic_class))
+    start_request_budget()
+
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def check_image_size(image: str):
+    """Reject diagrams over MAX_IMAGE_BYTES or MAX_IMAGE_PIXELS before any provider call."""
+    if decoded_size(image) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+    dims = image_dimensions(image)
+    if dims and dims[0] * dims[1] > MAX_IMAGE_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_PIXELS} pixels")
+
+
+def image_error(e: ImageRejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def budget_error(e: TokenBudgetExceeded) -> HTTPException:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+
+def cancel_on_disconnect(endpoint):
+    """Cancel an endpoint when its client disconnects.
+
+    Cancelling the endpoint stops SingleFlight from waiting; once no request is
+    waiting on a provider call, the call is aborted and its remaining sub-steps
+    are skipped. The endpoint must take the Starlette request as `http_request`.
+    """
+    if not CANCEL_ON_DISCONNECT:
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        http_request: Request = kwargs["http_request"]
+        disconnect_watched.set(True)
+        task = asyncio.ensure_future(endpoint(*args, **kwargs))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                break
+
+        cancellation_stats.disconnected()
+        log("CANCEL", f"Client disconnected from {http_request.url.path}, cancelling")
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Nobody is listening; 499 (client closed request) only shows up in access logs
+        return Response(status_code=499)
+
+    return wrapper
+
 
 def generate_session_id() -> str:
-    """Generate a simple session ID."""
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+    """Generate a session ID: a readable timestamp plus a random suffix, so sessions started in the same second differ."""
+    return f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
 
 
 # Request/Response Models
@@ -74,7 +241,7 @@ class AnalyzeDiagramRequest(BaseModel):
     image: str
     media_type: Optional[str] = "image/png"
     session_id: Optional[str] = None
-    provider: Literal["bedrock", "gemini", "claude"] = "bedrock"
+    provider: Literal["bedrock", "gemini", "claude", "fake"] = "bedrock"
 
 
 class AnalyzeDiagramResponse(BaseModel):
@@ -90,12 +257,7 @@ class ExtractComponentsRequest(BaseModel):
     image: str
     media_type: Optional[str] = "image/png"
     session_id: Optional[str] = None
-    provider: Literal["bedrock", "gemini", "claude"] = "bedrock"
-
-
-class ComponentItem(BaseModel):
-    name: str
-    category: str
+    provider: Literal["bedrock", "gemini", "claude", "fake"] = "bedrock"
 
 
 class ExtractComponentsResponse(BaseModel):
@@ -111,17 +273,7 @@ class GenerateThreatsRequest(BaseModel):
     key_features: list
     template: Optional[str] = "baseline"
     session_id: Optional[str] = None
-    provider: Literal["bedrock", "gemini", "claude"] = "bedrock"
-
-
-class ThreatItem(BaseModel):
-    id: str
-    scenario: str
-    cia_triad: str
-    stride: str
-    mitre_tactic: str
-    mitre_technique: str
-    mitigations: str
+    provider: Literal["bedrock", "gemini", "claude", "fake"] = "bedrock"
 
 
 class GenerateThreatsResponse(BaseModel):
@@ -129,6 +281,21 @@ class GenerateThreatsResponse(BaseModel):
     threats: List[ThreatItem]
 
 
+class PipelineStart(BaseModel):
+    image: Optional[str] = None  # None: the image follows as a binary frame
+    media_type: Optional[str] = "image/png"
+    session_id: Optional[str] = None
+    provider: Literal["bedrock", "gemini", "claude", "fake"] = "bedrock"
+    templates: List[str] = ["baseline"]
+    review: bool = True
+
+
+class PipelineEdit(BaseModel):
+    application_description: Optional[str] = None
+    key_features: Optional[List[str]] = None
+    in_scope_components: Optional[List[ComponentItem]] = None
+
+
 class PromptItem(BaseModel):
     key: str
     name: str
@@ -141,6 +308,25 @@ class UpdatePromptRequest(BaseModel):
     content: str
 
 
+class EvaluatePromptRequest(BaseModel):
+    content: str
+    provider: Literal["bedrock", "gemini", "claude", "fake"] = "bedrock"
+    fixtures: Optional[List[str]] = None  # fixture names; all when omitted
+    repeats: int = Field(1, ge=1, le=10)
+
+
+class StoredThreatItem(ThreatItem):
+    session_id: str
+    template: Optional[str] = None
+    provider: Optional[str] = None
+
+
+class ThreatPage(BaseModel):
+    threats: List[StoredThreatItem]
+    next_cursor: Optional[int] = None
+    counts: Optional[dict] = None
+
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -152,29 +338,118 @@ async def health():
     gemini_configured = bool(os.environ.get("GEMINI_API_KEY"))
     claude_configured = bool(os.environ.get("CLAUDE_API_KEY"))
     db_configured = bool(os.environ.get("DATABASE_URL"))
-    return {
-        "status": "healthy",
+    # 503 while draining so the load balancer routes new requests to other workers
+    return ORJSONResponse({
+        "status": "draining" if drain.draining else "healthy",
         "gemini_available": gemini_configured,
         "claude_available": claude_configured,
         "database_available": db_configured
+    }, status_code=503 if drain.draining else 200)
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """Queueing, coalescing, token usage and model routing metrics for provider calls."""
+    return {
+        "admission": admission_controller.metrics(),
+        "provider_threads": admission_controller.thread_metrics(),
+        "coalescing": _single_flight.stats,
+        "tokens": token_accountant.metrics(),
+        "speculation": _speculator.metrics(),
+        "attack_index": attack_index.metrics(),
+        "cancellation": cancellation_stats.metrics(),
+        "routing": model_router.metrics(),
+        "cassette": cassette.metrics(),
+        "image_cache": image_cache_metrics(),
+        "tile_splits": tiling.split_cache_metrics(),
+        "slow_requests": slow_requests.slowest(),
+        # Every metric above is for this worker process
+        "worker": drain.metrics(),
     }
 
 
+def check_profile_token(http_request: Request):
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (PROFILE_TOKEN is not set)")
+    if not hmac.compare_digest(http_request.headers.get("x-profile-token", "").encode(), PROFILE_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+class ProfilingToggle(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+    minutes: float = Field(10, gt=0, le=24 * 60)
+
+
+@app.get("/api/profiling")
+async def profiling_status(http_request: Request):
+    """Profiling state and recent profiles."""
+    check_profile_token(http_request)
+    return profiler.metrics()
+
+
+@app.post("/api/profiling")
+async def toggle_profiling(toggle: ProfilingToggle, http_request: Request):
+    """Profile a random fraction of requests for the next `minutes` (0 turns sampling off)."""
+    check_profile_token(http_request)
+    profiler.enable_sampling(toggle.sample_rate, toggle.minutes)
+    return profiler.metrics()
+
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, http_request: Request, format: Literal["speedscope", "collapsed"] = "speedscope"):
+    """A recent profile, for https://www.speedscope.app or flamegraph.pl."""
+    check_profile_token(http_request)
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    return profile.speedscope()
+
+
+@app.get("/api/threats", response_model=ThreatPage)
+async def list_threats(
+    session_id: Optional[str] = None,
+    stride: Optional[str] = None,
+    cia_triad: Optional[str] = None,
+    tactic: Optional[str] = Query(None, description="MITRE tactic ID, e.g. TA0001"),
+    component: Optional[str] = None,
+    q: Optional[str] = Query(None, description="Full-text search over scenario and mitigations"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    counts: bool = Query(False, description="Include per-STRIDE/CIA counts for the matrix view")
+):
+    """Stored threats across sessions, filtered and keyset-paginated (newest first)."""
+    filters = {"session_id": session_id, "stride": stride, "cia_triad": cia_triad,
+               "tactic": tactic, "component": component, "search": q}
+    page = await query_threats(limit=limit, cursor=cursor, **filters)
+    if page is None:
+        raise HTTPException(status_code=503, detail="Threat storage requires DATABASE_URL")
+
+    rows, next_cursor = page
+    threats = [
+        StoredThreatItem(**row["threat"], session_id=row["session_id"], template=row["template"], provider=row["provider"])
+        for row in rows
+    ]
+    matrix = await count_threats(**filters) if counts else None
+    return model_response(ThreatPage(threats=threats, next_cursor=next_cursor, counts=matrix))
+
+
 # Prompt Management Endpoints
 @app.get("/api/prompts", response_model=List[PromptItem])
 async def list_prompts():
     """Get all prompts."""
-    prompts = get_all_prompts()
-    return [
+    prompts = await get_all_prompts()
+    return ORJSONResponse([
         PromptItem(
             key=p["key"],
             name=p["name"],
             content=p["content"],
             is_default=p["is_default"],
             updated_at=str(p["updated_at"]) if p["updated_at"] else None
-        )
+        ).model_dump()
         for p in prompts
-    ]
+    ])
 
 
 @app.get("/api/prompts/{key}")
@@ -182,7 +457,7 @@ async def get_single_prompt(key: str):
     """Get a single prompt by key."""
     if key not in VALID_PROMPT_KEYS:
         raise HTTPException(status_code=404, detail="Invalid prompt key")
-    content = get_prompt(key)
+    content = await get_prompt(key)
     if not content:
         raise HTTPException(status_code=404, detail="Prompt not found")
     return {"key": key, "content": content}
@@ -193,102 +468,410 @@ async def update_single_prompt(key: str, request: UpdatePromptRequest):
     """Update a prompt."""
     if key not in VALID_PROMPT_KEYS:
         raise HTTPException(status_code=404, detail="Invalid prompt key")
-    success = update_prompt(key, request.content)
+    success = await update_prompt(key, request.content)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to update prompt")
     return {"message": "Prompt updated successfully"}
 
 
+@app.post("/api/prompts/{key}/evaluate")
+@cancel_on_disconnect
+async def evaluate_single_prompt(key: str, request: EvaluatePromptRequest, http_request: Request):
+    """Compare a candidate prompt with the current one on the fixture diagrams, without saving it."""
+    if key not in VALID_PROMPT_KEYS:
+        raise HTTPException(status_code=404, detail="Invalid prompt key")
+    fixtures = await asyncio.to_thread(load_fixtures, EVAL_FIXTURES_DIR, request.fixtures)
+    if not fixtures:
+        raise HTTPException(status_code=400, detail=f"No fixture diagrams in {EVAL_FIXTURES_DIR}")
+    try:
+        return await evaluate_prompt(get_client(request.provider), key, request.content, fixtures, request.repeats)
+    except HTTPException:
+        raise
+    except TokenBudgetExceeded as e:
+        raise budget_error(e)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/prompts/{key}/reset")
 async def reset_single_prompt(key: str):
     """Reset a prompt to default."""
     if key not in VALID_PROMPT_KEYS:
         raise HTTPException(status_code=404, detail="Invalid prompt key")
-    success = reset_prompt(key)
+    success = await reset_prompt(key)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to reset prompt")
     return {"message": "Prompt reset to default"}
 
 
+# Pipeline helpers
+async def get_step2_prompts() -> dict:
+    """Get the three Step 2 prompts from the database."""
+    return {
+        "app_desc": await get_prompt("step2_app_desc"),
+        "features": await get_prompt("step2_features"),
+        "components": await get_prompt("step2_components"),
+    }
+
+
+def extraction_key(provider: str, image: str, media_type: str, prompts: dict) -> str:
+    return request_key("step2", provider, image, media_type, prompts)
+
+
+def threats_key(provider: str, template: str, custom_prompt: str, application_description: str,
+                in_scope_components: list, key_features: list) -> str:
+    return request_key("step3", provider, template, custom_prompt, application_description, in_scope_components, key_features)
+
+
+async def run_analysis(provider: str, image: str, media_type: str) -> dict:
+    """Step 1 for a diagram."""
+    client = get_client(provider)
+    custom_prompt = await get_prompt("step1_analyze")
+    key = request_key("step1", provider, image, media_type, custom_prompt)
+    return await _single_flight.run(key, tiling.analyze_diagram, client, image, media_type, custom_prompt)
+
+
+async def run_extraction(session_id: str, provider: str, image: str, media_type: str) -> dict:
+    """Step 2 for a diagram, reusing the session's speculative result if it matches."""
+    client = get_client(provider)
+    prompts = await get_step2_prompts()
+    key = extraction_key(provider, image, media_type, prompts)
+    result = await _speculator.claim(session_id, "step2", key)
+    if result is None:
+        result = await _single_flight.run(key, tiling.extract_components, client, image, media_type, prompts)
+    return result
+
+
+async def run_threats(session_id: str, provider: str, template: str, application_description: str,
+                      in_scope_components: list, key_features: list) -> dict:
+    """Step 3 for one template, saving the threats to the session."""
+    if template not in THREAT_TEMPLATES:
+        raise HTTPException(status_code=400, detail="Invalid template")
+    client = get_client(provider)
+    custom_prompt = await get_prompt(f"step3_{template}")
+    key = threats_key(provider, template, custom_prompt, application_description, in_scope_components, key_features)
+    result = await _speculator.claim(session_id, "step3", key)
+    if result is None:
+        result = await _single_flight.run(
+            key,
+            client.generate_threats,
+            application_description=application_description,
+            in_scope_components=in_scope_components,
+            key_features=key_features,
+            template=template,
+            custom_prompt=custom_prompt
+        )
+
+    await save_threats(session_id, result.get("threats", []), in_scope_components, provider, template)
+    return result
+
+
+async def speculate_extraction(session_id: str, provider: str, image: str, media_type: str):
+    """Start Step 2 for a freshly analyzed diagram while the user reviews Step 1."""
+    if not _speculator.enabled:
+        return
+    client = get_client(provider)
+    prompts = await get_step2_prompts()
+    key = extraction_key(provider, image, media_type, prompts)
+
+    async def run():
+        result = await _single_flight.run(key, tiling.extract_components, client, image, media_type, prompts)
+        await speculate_threats(session_id, provider, ExtractComponentsResponse(session_id=session_id, **result))
+        return result
+
+    _speculator.launch(session_id, "step2", key, run)
+
+
+async def speculate_threats(session_id: str, provider: str, extraction: ExtractComponentsResponse):
+    """Start baseline Step 3 on the unedited Step 2 output while the user validates it."""
+    if not _speculator.enabled:
+        return
+    client = get_client(provider)
+    custom_prompt = await get_prompt("step3_baseline")
+    components = [c.model_dump() for c in extraction.in_scope_components]
+    key = threats_key(provider, "baseline", custom_prompt, extraction.application_description,
+                      components, extraction.key_features)
+
+    _speculator.launch(session_id, "step3", key, lambda: _single_flight.run(
+        key,
+        client.generate_threats,
+        application_description=extraction.application_description,
+        in_scope_components=components,
+        key_features=extraction.key_features,
+        template="baseline",
+        custom_prompt=custom_prompt
+    ))
+
+
 # Analysis Endpoints
 @app.post("/api/analyze-diagram", response_model=AnalyzeDiagramResponse)
-async def analyze_diagram(request: AnalyzeDiagramRequest):
+@cancel_on_disconnect
+async def analyze_diagram(request: AnalyzeDiagramRequest, http_request: Request):
     """Step 1: Analyze architecture diagram."""
     log("API", f"ENDPOINT: /api/analyze-diagram (provider: {request.provider})")
 
+    set_request_context(http_request)
+    check_image_size(request.image)
     try:
-        client = get_client(request.provider)
         session_id = request.session_id or generate_session_id()
+        profiling.tag(session_id)
+        result = await run_analysis(request.provider, request.image, request.media_type)
 
-        # Get prompt from database
-        custom_prompt = get_prompt("step1_analyze")
-        result = client.analyze_diagram(request.image, request.media_type, custom_prompt)
-
-        return AnalyzeDiagramResponse(session_id=session_id, **result)
+        response = AnalyzeDiagramResponse(session_id=session_id, **result)
+        await speculate_extraction(session_id, request.provider, request.image, request.media_type)
+        return model_response(response)
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except TokenBudgetExceeded as e:
+        raise budget_error(e)
+    except ImageRejected as e:
+        raise image_error(e)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/extract-components", response_model=ExtractComponentsResponse)
-async def extract_components(request: ExtractComponentsRequest):
+@cancel_on_disconnect
+async def extract_components(request: ExtractComponentsRequest, http_request: Request):
     """Step 2: Extract application components."""
     log("API", f"ENDPOINT: /api/extract-components (provider: {request.provider})")
 
+    set_request_context(http_request)
+    check_image_size(request.image)
     try:
-        client = get_client(request.provider)
         session_id = request.session_id or generate_session_id()
+        profiling.tag(session_id)
+        result = await run_extraction(session_id, request.provider, request.image, request.media_type)
 
-        # Get prompts from database
-        prompts = {
-            "app_desc": get_prompt("step2_app_desc"),
-            "features": get_prompt("step2_features"),
-            "components": get_prompt("step2_components"),
-        }
-        result = client.extract_components(request.image, request.media_type, prompts)
-
-        return ExtractComponentsResponse(session_id=session_id, **result)
+        response = ExtractComponentsResponse(session_id=session_id, **result)
+        await speculate_threats(session_id, request.provider, response)
+        return model_response(response)
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except TokenBudgetExceeded as e:
+        raise budget_error(e)
+    except ImageRejected as e:
+        raise image_error(e)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/generate-threats", response_model=GenerateThreatsResponse)
-async def generate_threats(request: GenerateThreatsRequest):
+@cancel_on_disconnect
+async def generate_threats(request: GenerateThreatsRequest, http_request: Request):
     """Step 3: Generate threat scenarios."""
     log("API", f"ENDPOINT: /api/generate-threats (provider: {request.provider}, template: {request.template})")
 
+    set_request_context(http_request)
     try:
-        if request.template not in ["baseline", "network", "aws"]:
-            raise HTTPException(status_code=400, detail="Invalid template")
-
-        client = get_client(request.provider)
         session_id = request.session_id or generate_session_id()
-
-        # Get prompt from database
-        prompt_key = f"step3_{request.template}"
-        custom_prompt = get_prompt(prompt_key)
-
-        result = client.generate_threats(
-            application_description=request.application_description,
-            in_scope_components=request.in_scope_components,
-            key_features=request.key_features,
-            template=request.template,
-            custom_prompt=custom_prompt
+        profiling.tag(session_id)
+        result = await run_threats(
+            session_id, request.provider, request.template,
+            request.application_description, request.in_scope_components, request.key_features
         )
-
-        return GenerateThreatsResponse(session_id=session_id, **result)
+        return model_response(GenerateThreatsResponse(session_id=session_id, **result))
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except TokenBudgetExceeded as e:
+        raise budget_error(e)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def channel_error(e: Exception) -> dict:
+    """An error event with the status code the equivalent HTTP endpoint would return."""
+    if isinstance(e, AdmissionRejected):
+        e = admission_error(e)
+    elif isinstance(e, TokenBudgetExceeded):
+        e = budget_error(e)
+    elif isinstance(e, ImageRejected):
+        e = image_error(e)
+    elif isinstance(e, ValidationError):
+        e = HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    elif not isinstance(e, HTTPException):
+        traceback.print_exc()
+        e = HTTPException(status_code=500, detail=str(e))
+    return {"type": "error", "status": e.status_code, "detail": e.detail}
+
+
+@app.websocket("/api/ws/pipeline")
+async def pipeline_channel(websocket: WebSocket):
+    """Run a whole session over one connection, pushing progress as it happens.
+
+    Client messages (JSON text frames):
+      {"type": "start", ...PipelineStart}  first; if "image" is omitted the next frame is the raw image (binary)
+      {"type": "edit", ...PipelineEdit}    overrides Step 2 output; a Step 3 in progress restarts with it
+      {"type": "continue"}                 starts Step 3 once the Step 2 review is done ("review": true)
+      {"type": "generate", "template": t}  another Step 3 template with the current (edited) components
+
+    Server events: session, step_started, substep_started, substep_finished
+    (model, cumulative token usage and the sub-step's result), step_finished,
+    merged (the threats of every template so far, near-duplicates merged),
+    review, edited, step_restarted, done and error. Steps 1 and 2 run
+    concurrently. Disconnecting cancels provider calls nobody else waits on.
+    When the worker drains, the connection is closed with 1012 (service
+    restart) and the client starts the session over.
+    """
+    await websocket.accept()
+    set_request_context(websocket)
+    # receive() notices the disconnect, and the pipeline is cancelled
+    disconnect_watched.set(True)
+    events = asyncio.Queue()
+    progress_listener.set(queue_listener(events))
+
+    def send(event: str, **data):
+        events.put_nowait({"type": event, **data})
+
+    inbox = asyncio.Queue()
+    edits = {}
+    edited = asyncio.Event()
+    resume = asyncio.Event()
+    generate = asyncio.Queue()
+    generated = {}
+
+    async def receive():
+        """Handle control messages until the client leaves; the start message and image go to the inbox."""
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                inbox.put_nowait(message["bytes"])
+                continue
+            try:
+                data = orjson.loads(message["text"])
+                if not isinstance(data, dict):
+                    raise HTTPException(status_code=400, detail="Messages must be JSON objects")
+                kind = data.pop("type", None)
+                if kind == "edit":
+                    edits.update(PipelineEdit.model_validate(data).model_dump(exclude_none=True))
+                    edited.set()
+                    send("edited", fields=sorted(edits))
+                elif kind == "continue":
+                    resume.set()
+                elif kind == "generate":
+                    template = data.get("template", "baseline")
+                    if template not in THREAT_TEMPLATES:
+                        raise HTTPException(status_code=400, detail="Invalid template")
+                    generate.put_nowait(template)
+                else:
+                    inbox.put_nowait(data)
+            except (HTTPException, ValidationError) as e:
+                # A bad control message is reported without ending the session
+                events.put_nowait(channel_error(e))
+            except orjson.JSONDecodeError as e:
+                events.put_nowait(channel_error(HTTPException(status_code=400, detail=f"Invalid JSON: {e}")))
+
+    async def step(name: str, coro, **info):
+        send("step_started", step=name, **info)
+        start = time.perf_counter()
+        result = await coro
+        send("step_finished", step=name, **info, seconds=round(time.perf_counter() - start, 3), result=result)
+        return result
+
+    async def threats(start: PipelineStart, session_id: str, extraction: dict, template: str):
+        """Step 3, restarted whenever an edit arrives before it finishes."""
+        while True:
+            edited.clear()
+            inputs = {**extraction, **edits}
+            task = asyncio.ensure_future(step("threats", run_threats(
+                session_id, start.provider, template, inputs["application_description"],
+                inputs["in_scope_components"], inputs["key_features"]
+            ), template=template))
+            waiter = asyncio.ensure_future(edited.wait())
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if task.done():
+                result = task.result()
+                generated[template] = result.get("threats", [])
+                send("merged", templates=list(generated), threats=dedupe_threats(
+                    [t for threats in generated.values() for t in threats], components=inputs["in_scope_components"]))
+                return result
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            send("step_restarted", step="threats", template=template, fields=sorted(edits))
+
+    async def pipeline():
+        start = PipelineStart.model_validate(await inbox.get())
+        image = start.image
+        if image is None:
+            image = uploaded_image(await inbox.get())
+        check_image_size(image)
+        session_id = start.session_id or generate_session_id()
+        profiling.tag(session_id)
+        log("API", f"WEBSOCKET: /api/ws/pipeline (provider: {start.provider}, session: {session_id})")
+        send("session", session_id=session_id)
+
+        analysis = asyncio.ensure_future(step("analysis", run_analysis(start.provider, image, start.media_type)))
+        try:
+            extraction = await step("extraction", run_extraction(session_id, start.provider, image, start.media_type))
+        except BaseException:
+            analysis.cancel()
+            raise
+        if start.review:
+            send("review", step="extraction")
+            await resume.wait()
+        for template in start.templates:
+            await threats(start, session_id, extraction, template)
+        await analysis
+        send("done", session_id=session_id)
+
+        while True:
+            await threats(start, session_id, extraction, await generate.get())
+
+    async def forward():
+        while (event := await events.get()) is not None:
+            await websocket.send_text(orjson.dumps(event).decode())
+        await websocket.close(code=1011)
+
+    sender = asyncio.ensure_future(forward())
+    task = asyncio.ensure_future(pipeline())
+    receiver = asyncio.ensure_future(receive())
+    drained = asyncio.ensure_future(drain.started())
+    await asyncio.wait({task, receiver, drained}, return_when=asyncio.FIRST_COMPLETED)
+    drained.cancel()
+    if not task.done():
+        # The pipeline only ends on failure; otherwise the client has left or the worker is draining
+        if receiver.done():
+            cancellation_stats.disconnected()
+            log("CANCEL", "Client disconnected from /api/ws/pipeline, cancelling")
+        else:
+            log("API", "Draining: closing /api/ws/pipeline with 1012 (service restart)")
+        task.cancel()
+        # wait(), not gather(): a gather() cancelled along with this handler escapes the server's cancel scope
+        await asyncio.wait({task})
+        sender.cancel()
+        if not receiver.done():
+            receiver.cancel()
+            await websocket.close(code=1012)
+        return
+
+    receiver.cancel()
+    events.put_nowait(channel_error(task.exception()))
+    events.put_nowait(None)
+    await sender
+
+
 if __name__ == "__main__":
-    log("API", "Starting Auspex API server on port 8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers read WEB_CONCURRENCY from the same environment to size their share of the limits
+    workers = WEB_CONCURRENCY
+    port = int(os.environ.get("PORT", "8000"))
+    log("API", f"Starting Auspex API server on port {port} with {workers} worker(s)")
+    uvicorn.run(
+        "main:app", host="0.0.0.0", port=port, workers=workers,
+        # In-flight requests get the drain timeout to finish on SIGTERM
+        timeout_graceful_shutdown=int(DRAIN_TIMEOUT_SECONDS),
+        # Images sent over /api/ws/pipeline arrive as single messages
+        ws_max_size=MAX_REQUEST_BYTES,
+    )
@@ -0,0 +1,292 @@
+"""On-demand request profiling and a rolling sample of the slowest requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or at
+random while the sampling toggle (POST /api/profiling) is on. A background
+thread then samples stacks every PROFILE_INTERVAL_MS for as long as a
+profile is running: the event loop thread whenever it is running one of the
+request's tasks, and the worker threads making its provider calls (those
+enter through run_profiled). Finished profiles are kept in memory, written
+to PROFILE_DIR when set, and served in speedscope or collapsed-stack
+(flamegraph.pl) format, tagged with the session ID.
+
+When nothing is profiled, a request costs one ContextVar set and (for HTTP)
+a deque append for the slow request sample.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import heapq
+import random
+import asyncio
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# Required in X-Profile (and X-Profile-Token for the admin endpoints); profiling is off while unset
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "20"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+# Requests in the rolling window the slowest are picked from
+SLOW_REQUEST_WINDOW = int(os.environ.get("SLOW_REQUEST_WINDOW", "1000"))
+
+
+class RequestTrace:
+    """What is known about the current request: its path, session and profile (if any)."""
+
+    __slots__ = ("method", "path", "start", "session_id", "profile")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.session_id: Optional[str] = None
+        self.profile: Optional["Profile"] = None
+
+
+current_request: ContextVar[Optional[RequestTrace]] = ContextVar("current_request", default=None)
+
+
+def tag(session_id: str):
+    """Attach the session ID to the current request's trace and profile."""
+    trace = current_request.get()
+    if trace is not None:
+        trace.session_id = session_id
+
+
+class Profile:
+    """Stack samples for one request, per thread."""
+
+    def __init__(self, trace: RequestTrace):
+        self.id = uuid.uuid4().hex[:12]
+        self.trace = trace
+        self.started_at = time.time()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.threads = set()
+        self.samples: Dict[str, Counter] = {}
+        self.duration_ms = 0.0
+
+    def add(self, thread: str, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        self.samples.setdefault(thread, Counter())[tuple(reversed(stack))] += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.trace.method,
+            "path": self.trace.path,
+            "session_id": self.trace.session_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 1),
+            "samples": sum(sum(c.values()) for c in self.samples.values()),
+        }
+
+    def speedscope(self) -> dict:
+        """The profile in speedscope's file format, one sampled profile per thread."""
+        frames, index = [], {}
+        profiles = []
+        for thread, stacks in self.samples.items():
+            samples, weights = [], []
+            for stack, count in stacks.items():
+                for frame in stack:
+                    if frame not in index:
+                        index[frame] = len(frames)
+                        frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                samples.append([index[f] for f in stack])
+                weights.append(count * PROFILE_INTERVAL_MS)
+            profiles.append({
+                "type": "sampled", "name": thread, "unit": "milliseconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+            })
+        name = f"{self.trace.method} {self.trace.path} ({self.trace.session_id or 'no session'})"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "auspex",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def collapsed(self) -> str:
+        """Folded stacks (`thread;frame;frame count`) for flamegraph.pl and similar tools."""
+        lines = []
+        for thread, stacks in self.samples.items():
+            for stack, count in stacks.items():
+                names = [thread] + [f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack]
+                lines.append(f"{';'.join(names)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def run_profiled(fn: Callable, *args, **kwargs):
+    """Run fn in a worker thread, sampling the thread if the calling request is being profiled."""
+    trace = current_request.get()
+    profile = trace.profile if trace is not None else None
+    if profile is None:
+        return fn(*args, **kwargs)
+    ident = threading.get_ident()
+    profile.threads.add(ident)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.threads.discard(ident)
+
+
+def _task_profile(loop) -> Optional[Profile]:
+    task = asyncio.current_task(loop)
+    if task is None:
+        return None
+    trace = task.get_context().get(current_request)
+    return trace.profile if trace is not None else None
+
+
+class Profiler:
+    """Runs the sampling thread while any profile is active and keeps finished profiles."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, keep: int = PROFILE_KEEP, directory: str = PROFILE_DIR):
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._active: List[Profile] = []
+        self._thread: Optional[threading.Thread] = None
+        self._finished: "deque[Profile]" = deque(maxlen=keep)
+        self.sample_rate = 0.0
+        self.sample_until = 0.0
+
+    def should_profile(self, scope: dict) -> bool:
+        if not PROFILE_TOKEN:
+            return False
+        token = PROFILE_TOKEN.encode()
+        if any(name == b"x-profile" and hmac.compare_digest(value, token) for name, value in scope["headers"]):
+            return True
+        return self.sample_rate > 0 and time.time() < self.sample_until and random.random() < self.sample_rate
+
+    def enable_sampling(self, rate: float, minutes: float):
+        """Profile a fraction of all requests for a while."""
+        self.sample_rate = rate
+        self.sample_until = time.time() + minutes * 60
+
+    def start(self, trace: RequestTrace) -> Profile:
+        profile = trace.profile = Profile(trace)
+        with self._lock:
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    async def stop(self, profile: Profile):
+        profile.duration_ms = (time.perf_counter() - profile.trace.start) * 1000
+        with self._lock:
+            self._active.remove(profile)
+            self._finished.append(profile)
+        if self.directory:
+            # Off the event loop: a long profile takes a while to convert and write
+            await asyncio.to_thread(self._write, profile)
+
+    def _write(self, profile: Profile):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile.trace.session_id or 'request'}_{profile.id}.speedscope.json")
+        with open(path, "w") as f:
+            json.dump(profile.speedscope(), f)
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            # Under the lock so a profile is never added to once stop() has returned
+            with self._lock:
+                for profile in self._active:
+                    loop_frame = frames.get(profile.loop_thread)
+                    if loop_frame is not None and _task_profile(profile.loop) is profile:
+                        profile.add("event loop", loop_frame)
+                    for ident in list(profile.threads):
+                        if ident in frames:
+                            profile.add(f"worker {ident}", frames[ident])
+            del frames
+            time.sleep(self.interval)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return next((p for p in self._finished if p.id == profile_id), None)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": bool(PROFILE_TOKEN),
+                "sample_rate": self.sample_rate if time.time() < self.sample_until else 0.0,
+                "active": len(self._active),
+                "profiles": [p.summary() for p in reversed(self._finished)],
+            }
+
+
+class SlowRequests:
+    """The slowest of the last SLOW_REQUEST_WINDOW HTTP requests."""
+
+    def __init__(self, window: int = SLOW_REQUEST_WINDOW):
+        self._recent = deque(maxlen=window)
+
+    def record(self, trace: RequestTrace, status: int):
+        self._recent.append((time.perf_counter() - trace.start, time.time(), trace, status))
+
+    def slowest(self, n: int = 10) -> List[dict]:
+        return [
+            {
+                "duration_ms": round(seconds * 1000, 1),
+                "at": at,
+                "method": trace.method,
+                "path": trace.path,
+                "status": status,
+                "session_id": trace.session_id,
+                "profile_id": trace.profile.id if trace.profile else None,
+            }
+            for seconds, at, trace, status in heapq.nlargest(n, list(self._recent), key=lambda r: r[0])
+        ]
+
+
+profiler = Profiler()
+slow_requests = SlowRequests()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that times every request and profiles the ones asked for."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        trace = RequestTrace(scope.get("method", "WS"), scope["path"])
+        current_request.set(trace)
+        profile = profiler.start(trace) if profiler.should_profile(scope) else None
+        status = 0
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profile is not None:
+                await profiler.stop(profile)
+            # A WebSocket lasts as long as the client stays connected, which says nothing about latency
+            if scope["type"] == "http":
+                slow_requests.record(trace, status)
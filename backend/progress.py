@@ -0,0 +1,24 @@
+"""Live progress events for the WebSocket pipeline channel.
+
+A pipeline run sets `progress_listener` for its steps; BaseClient reports
+each sub-step (STEP-1, STEP-2A..C, STEP-3, once per tile when tiling) to it
+from whichever worker thread makes the provider call. HTTP endpoints leave
+it unset and nothing is emitted.
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+progress_listener: ContextVar[Optional[Callable[[dict], None]]] = ContextVar("progress_listener", default=None)
+
+
+def emit(event: str, **data):
+    listener = progress_listener.get()
+    if listener is not None:
+        listener({"type": event, **data})
+
+
+def queue_listener(queue: asyncio.Queue) -> Callable[[dict], None]:
+    """A listener that hands events from any thread to `queue` on the running loop."""
+    loop = asyncio.get_running_loop()
+    return lambda event: loop.call_soon_threadsafe(queue.put_nowait, event)
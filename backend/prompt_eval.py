@@ -0,0 +1,261 @@
+"""Evaluate a candidate prompt against fixture diagrams before it is saved.
+
+Runs the candidate and the current prompt for one prompt key over the
+diagrams in EVAL_FIXTURES_DIR (PNG/JPEG; Step 3 prompts are filled with a
+JSON sidecar of the diagram's Step 2 output, or with Step 2 run on the
+current prompts), at most EVAL_CONCURRENCY calls at a time. Reports parse
+success, schema conformance, quality checks, token counts and latency for
+both, and where the candidate regresses. Calls take the normal client path,
+so the fake provider or a replayed cassette makes runs reproducible, but are
+isolated: they count as token spend without teaching max_tokens sizing,
+routing stats or a recording cassette anything.
+
+    python prompt_eval.py step3_baseline candidate.txt --provider fake --repeats 3
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import mimetypes
+import threading
+import statistics
+from pathlib import Path
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from pydantic import ValidationError
+
+import tiling
+from admission import admission_controller, request_context
+from base_client import BaseClient
+from cancellation import RequestCancelled, run_cancellable
+from database import get_prompt
+from routing import output_problem
+from schemas import STEP_SCHEMAS
+from token_budget import isolated_calls, request_usage, start_request_budget
+
+EVAL_FIXTURES_DIR = Path(os.environ.get("EVAL_FIXTURES_DIR", str(Path(__file__).parent / "fixtures" / "diagrams")))
+EVAL_CONCURRENCY = int(os.environ.get("EVAL_CONCURRENCY", "4"))
+# Flag a candidate whose median latency or output tokens exceed the current prompt's by this factor
+EVAL_REGRESSION_RATIO = float(os.environ.get("EVAL_REGRESSION_RATIO", "1.25"))
+EVAL_MIN_LATENCY_DELTA_MS = float(os.environ.get("EVAL_MIN_LATENCY_DELTA_MS", "250"))
+
+# Prompt key -> (step name, Step 3 template)
+PROMPT_STEPS = {
+    "step1_analyze": ("STEP-1", None),
+    "step2_app_desc": ("STEP-2A", None),
+    "step2_features": ("STEP-2B", None),
+    "step2_components": ("STEP-2C", None),
+    "step3_baseline": ("STEP-3", "baseline"),
+    "step3_network": ("STEP-3", "network"),
+    "step3_aws": ("STEP-3", "aws"),
+}
+
+
+@dataclass
+class Fixture:
+    name: str
+    image_base64: str
+    media_type: str
+    step2: Optional[dict] = None
+
+
+def load_fixtures(directory: Path = EVAL_FIXTURES_DIR, names: Optional[List[str]] = None) -> List[Fixture]:
+    """Fixture diagrams (optionally only `names`) with their Step 2 sidecars."""
+    fixtures = []
+    for path in sorted(Path(directory).glob("*")):
+        media_type = mimetypes.guess_type(path.name)[0]
+        if media_type not in ("image/png", "image/jpeg") or (names and path.stem not in names):
+            continue
+        sidecar = path.with_suffix(".json")
+        step2 = json.loads(sidecar.read_text()) if sidecar.exists() else None
+        fixtures.append(Fixture(path.stem, base64.b64encode(path.read_bytes()).decode(), media_type, step2))
+    return fixtures
+
+
+def run_once(client: BaseClient, prompt: str, step_name: str, template: Optional[str], fixture: Fixture) -> dict:
+    """One isolated call with `prompt` on a fixture (in a provider thread)."""
+    token = isolated_calls.set(True)
+    try:
+        return _run_once(client, prompt, step_name, template, fixture)
+    finally:
+        isolated_calls.reset(token)
+
+
+def _run_once(client: BaseClient, prompt: str, step_name: str, template: Optional[str], fixture: Fixture) -> dict:
+    start_request_budget()
+    start = time.perf_counter()
+    outcome = {"fixture": fixture.name, "parsed": False, "schema_ok": False, "quality_ok": False}
+    try:
+        if template:
+            s2 = fixture.step2
+            filled = client._threats_prompt(s2["application_description"], s2["in_scope_components"],
+                                            s2["key_features"], template, prompt)
+            parsed = client._invoke_json(filled, step_name=step_name, template=template)
+        else:
+            parsed = client._invoke_json(prompt, fixture.image_base64, fixture.media_type, step_name=step_name)
+    except RequestCancelled:
+        raise
+    except ValueError as e:
+        outcome["error"] = f"unparseable output: {e}"
+        parsed = None
+    except Exception as e:
+        # Provider or budget errors are not the prompt's fault; they are reported but not scored
+        outcome.update(error=str(e), failed=True)
+        return outcome
+
+    outcome["seconds"] = time.perf_counter() - start
+    outcome.update(request_usage.get())
+    if parsed is None:
+        return outcome
+    outcome["parsed"] = True
+    try:
+        STEP_SCHEMAS[step_name].model_validate(parsed)
+        outcome["schema_ok"] = True
+    except ValidationError as e:
+        outcome["error"] = f"schema validation failed ({e.error_count()} errors)"
+    problem = output_problem(step_name, parsed)
+    outcome["quality_ok"] = problem is None
+    if problem and "error" not in outcome:
+        outcome["error"] = problem
+    return outcome
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(outcomes: List[dict]) -> dict:
+    scored = [o for o in outcomes if not o.get("failed")]
+    runs = len(scored) or 1
+    latency = sorted(o["seconds"] * 1000 for o in scored)
+    output_tokens = sorted(o["output_tokens"] for o in scored if o["parsed"])
+    return {
+        "runs": len(outcomes),
+        "provider_errors": len(outcomes) - len(scored),
+        "parse_success_rate": round(sum(o["parsed"] for o in scored) / runs, 3),
+        "schema_conformance_rate": round(sum(o["schema_ok"] for o in scored) / runs, 3),
+        "quality_pass_rate": round(sum(o["quality_ok"] for o in scored) / runs, 3),
+        "input_tokens_mean": round(statistics.mean(o["input_tokens"] for o in scored)) if scored else None,
+        "output_tokens": {
+            "mean": round(statistics.mean(output_tokens)),
+            "p50": statistics.median(output_tokens),
+            "max": output_tokens[-1],
+        } if output_tokens else None,
+        "latency_ms": {
+            "p50": round(statistics.median(latency), 1),
+            "p95": round(_percentile(latency, 0.95), 1),
+            "max": round(latency[-1], 1),
+        } if latency else None,
+        "failures": [{"fixture": o["fixture"], "error": o["error"]} for o in outcomes if "error" in o][:20],
+    }
+
+
+def regressions(candidate: dict, current: dict, ratio: float = EVAL_REGRESSION_RATIO) -> List[str]:
+    """Where the candidate does worse than the current prompt."""
+    found = []
+    for rate in ("parse_success_rate", "schema_conformance_rate", "quality_pass_rate"):
+        if candidate[rate] < current[rate]:
+            found.append(f"{rate} dropped from {current[rate]} to {candidate[rate]}")
+    # Latency also has to rise by EVAL_MIN_LATENCY_DELTA_MS, so replayed or fake runs do not flag jitter
+    for metric, label, unit, min_delta in (("latency_ms", "latency", "ms", EVAL_MIN_LATENCY_DELTA_MS),
+                                           ("output_tokens", "output tokens", "tokens", 0)):
+        new, old = candidate[metric], current[metric]
+        if new and old and new["p50"] > old["p50"] * ratio and new["p50"] - old["p50"] > min_delta:
+            found.append(f"median {label} rose from {old['p50']} to {new['p50']} {unit}")
+    return found
+
+
+async def evaluate_prompt(client: BaseClient, key: str, candidate: str, fixtures: List[Fixture],
+                          repeats: int = 1, concurrency: int = EVAL_CONCURRENCY) -> dict:
+    """Run the candidate and current prompt for `key` side by side and compare them."""
+    step_name, template = PROMPT_STEPS[key]
+    prompts = {"candidate": candidate, "current": await get_prompt(key)}
+    # Evaluation yields to user traffic in admission control
+    request_context.set(("prompt-eval", "batch"))
+    isolated_calls.set(True)
+    semaphore = asyncio.Semaphore(concurrency)
+    cancel = threading.Event()
+
+    async def call(fn, *args):
+        async with semaphore:
+            return await admission_controller.run_in_thread(run_cancellable, cancel, fn, *args)
+
+    try:
+        if template:
+            missing = [f for f in fixtures if f.step2 is None]
+            if missing:
+                step2_prompts = {"app_desc": await get_prompt("step2_app_desc"),
+                                 "features": await get_prompt("step2_features"),
+                                 "components": await get_prompt("step2_components")}
+                results = await asyncio.gather(*(
+                    call(tiling.extract_components, client, f.image_base64, f.media_type, step2_prompts) for f in missing
+                ))
+                for fixture, step2 in zip(missing, results):
+                    fixture.step2 = step2
+
+        # Interleaved so both prompts run under the same provider conditions
+        jobs = [(variant, fixture) for _ in range(repeats) for fixture in fixtures for variant in prompts]
+        outcomes = await asyncio.gather(*(
+            call(run_once, client, prompts[variant], step_name, template, fixture) for variant, fixture in jobs
+        ))
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+
+    summaries = {
+        variant: summarize([o for (v, _), o in zip(jobs, outcomes) if v == variant]) for variant in prompts
+    }
+    return {
+        "key": key,
+        "step": step_name,
+        "template": template,
+        "provider": client.provider,
+        "model": client.model,
+        "fixtures": [f.name for f in fixtures],
+        "repeats": repeats,
+        "unchanged": candidate == prompts["current"],
+        **summaries,
+        "regressions": regressions(summaries["candidate"], summaries["current"]),
+    }
+
+
+async def _run(args) -> dict:
+    from main import get_client
+    from database import init_database, close_database
+
+    await init_database()
+    try:
+        fixtures = load_fixtures(args.fixtures, args.only.split(",") if args.only else None)
+        if not fixtures:
+            sys.exit(f"No fixture diagrams in {args.fixtures}")
+        return await evaluate_prompt(get_client(args.provider), args.key, args.candidate.read_text(),
+                                     fixtures, args.repeats, args.concurrency)
+    finally:
+        await close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("key", choices=list(PROMPT_STEPS))
+    parser.add_argument("candidate", type=Path, help="File with the candidate prompt")
+    parser.add_argument("--provider", default="fake", choices=["bedrock", "gemini", "claude", "fake"])
+    parser.add_argument("--fixtures", type=Path, default=EVAL_FIXTURES_DIR)
+    parser.add_argument("--only", help="Comma-separated fixture names")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
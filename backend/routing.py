@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import deque, defaultdict
+from typing import List, Optional
+
+from pydantic import ValidationError
+
+from admission import _parse_mapping
+from schemas import STEP_SCHEMAS
+
+PROVIDERS = ("bedrock", "gemini", "claude", "fake")
+
+
+def _parse_models(value: str) -> List[str]:
+    """"fast>strong" lists the models to try in order; a single model means no cascade."""
+    return [m.strip() for m in value.split(">") if m.strip()]
+
+
+# Per-provider routing tables, e.g.
+#   MODEL_ROUTES_CLAUDE="STEP-2A=claude-3-5-haiku-20241022,STEP-3:stride=claude-3-5-haiku-20241022>default"
+# Keys are a step, a step:template pair or "*"; "default" stands for the client's own model.
+MODEL_ROUTES = {p: _parse_mapping(os.environ.get(f"MODEL_ROUTES_{p.upper()}", ""), _parse_models) for p in PROVIDERS}
+# Cascade every step without an explicit route from the provider's fast model to its default model
+MODEL_CASCADE = os.environ.get("MODEL_CASCADE", "").lower() in ("1", "true", "yes")
+
+# Quality bar a fast model's output must clear before it is accepted
+CASCADE_MIN_DESCRIPTION_WORDS = int(os.environ.get("CASCADE_MIN_DESCRIPTION_WORDS", "10"))
+CASCADE_MIN_FEATURES = int(os.environ.get("CASCADE_MIN_FEATURES", "2"))
+CASCADE_MIN_THREATS = int(os.environ.get("CASCADE_MIN_THREATS", "3"))
+
+STRIDE_CATEGORIES = {"spoofing", "tampering", "repudiation", "information disclosure",
+                     "denial of service", "elevation of privilege"}
+
+
+def output_problem(step_name: str, parsed: dict) -> Optional[str]:
+    """Why a step's output should be escalated to a stronger model, or None if it is acceptable."""
+    schema = STEP_SCHEMAS.get(step_name)
+    if schema is None:
+        return None
+    try:
+        result = schema.model_validate(parsed)
+    except ValidationError as e:
+        return f"schema validation failed ({e.error_count()} errors)"
+
+    if step_name == "STEP-1" and not (result.entry_points and result.data_flows):
+        return "no entry points or data flows"
+    if step_name == "STEP-2A" and len(result.application_description.split()) < CASCADE_MIN_DESCRIPTION_WORDS:
+        return "application description too short"
+    if step_name == "STEP-2B" and len(result.key_features) < CASCADE_MIN_FEATURES:
+        return f"fewer than {CASCADE_MIN_FEATURES} key features"
+    if step_name == "STEP-2C" and not any(c.name.strip() for c in result.in_scope_components):
+        return "no in-scope components"
+    if step_name == "STEP-3":
+        if len(result.threats) < CASCADE_MIN_THREATS:
+            return f"fewer than {CASCADE_MIN_THREATS} threats"
+        if any(t.stride.strip().lower() not in STRIDE_CATEGORIES for t in result.threats):
+            return "threat with an unknown STRIDE category"
+        if any(not t.scenario.strip() or not t.mitigations.strip() for t in result.threats):
+            return "threat without a scenario or mitigations"
+    return None
+
+
+class ModelRouter:
+    """Chooses the model(s) for each pipeline step and tracks how the cascade performs."""
+
+    def __init__(self, routes: dict = MODEL_ROUTES, cascade: bool = MODEL_CASCADE):
+        self.routes = routes
+        self.cascade = cascade
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: deque(maxlen=200))
+        self._stats = defaultdict(lambda: {"calls": 0, "escalated": 0, "served_by": defaultdict(int)})
+
+    def models_for(self, provider: str, step_key: str, default_model: str, fast_model: Optional[str] = None) -> List[str]:
+        """Models to try in order for a step; every model but the last must pass output_problem."""
+        table = self.routes.get(provider, {})
+        step_name = step_key.split(":", 1)[0]
+        route = table.get(step_key) or table.get(step_name) or table.get("*")
+        if route is None:
+            route = [fast_model, default_model] if self.cascade and fast_model else [default_model]
+        models = [default_model if m == "default" else m for m in route]
+        # Drop repeats so a route ending in the default model does not call it twice
+        return [m for n, m in enumerate(models) if m not in models[:n]]
+
+    def record(self, provider: str, step_key: str, model: str, escalations: int, seconds: float):
+        key = f"{provider}/{step_key}"
+        with self._lock:
+            stats = self._stats[key]
+            stats["calls"] += 1
+            stats["escalated"] += escalations > 0
+            stats["served_by"][model] += 1
+            self._latency[key].append(seconds)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            steps = {}
+            for key, stats in self._stats.items():
+                latency = sorted(self._latency[key])
+                steps[key] = {
+                    "calls": stats["calls"],
+                    "escalated": stats["escalated"],
+                    "escalation_rate": stats["escalated"] / stats["calls"],
+                    "served_by": dict(stats["served_by"]),
+                    "latency_p50_ms": round(latency[len(latency) // 2] * 1000, 1),
+                    "latency_p95_ms": round(latency[min(len(latency) - 1, int(len(latency) * 0.95))] * 1000, 1),
+                }
+        return {
+            "cascade": self.cascade,
+            "routes": {p: {k: ">".join(v) for k, v in table.items()} for p, table in self.routes.items() if table},
+            "steps": steps,
+        }
+
+
+model_router = ModelRouter()
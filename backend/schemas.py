@@ -0,0 +1,106 @@
+from typing import List, Dict, Type
+from pydantic import BaseModel
+from pydantic.json_schema import SkipJsonSchema
+
+
+# Item models shared by the API responses and the structured-output schemas
+class ComponentItem(BaseModel):
+    name: str
+    category: str
+
+
+class ThreatItem(BaseModel):
+    id: str
+    scenario: str
+    cia_triad: str
+    stride: str
+    mitre_tactic: str
+    mitre_technique: str
+    mitigations: str
+    # Filled in by the ATT&CK index, never requested from the model
+    invalid_mitre_ids: SkipJsonSchema[List[str]] = []
+    # Affected components of threats merged into this one (dedup)
+    components: SkipJsonSchema[List[str]] = []
+
+
+# Per-step model outputs
+class DiagramAnalysis(BaseModel):
+    entry_points: List[str]
+    data_flows: List[str]
+    security_boundaries: List[str]
+    public_resources: List[str]
+    private_resources: List[str]
+
+
+class ApplicationDescription(BaseModel):
+    application_description: str
+
+
+class KeyFeatures(BaseModel):
+    key_features: List[str]
+
+
+class InScopeComponents(BaseModel):
+    in_scope_components: List[ComponentItem]
+
+
+class ThreatList(BaseModel):
+    threats: List[ThreatItem]
+
+
+STEP_SCHEMAS: Dict[str, Type[BaseModel]] = {
+    "STEP-1": DiagramAnalysis,
+    "STEP-2A": ApplicationDescription,
+    "STEP-2B": KeyFeatures,
+    "STEP-2C": InScopeComponents,
+    "STEP-3": ThreatList,
+}
+
+# Name of the tool the model is forced to call in structured-output mode
+TOOL_NAME = "submit_result"
+
+
+def _inline_refs(node, defs: dict):
+    """Resolve $ref pointers and drop keys the provider schema dialects reject."""
+    if isinstance(node, dict):
+        if "$ref" in node:
+            return _inline_refs(defs[node["$ref"].split("/")[-1]], defs)
+        return {
+            k: _inline_refs(v, defs)
+            for k, v in node.items()
+            if k not in ("$defs", "title", "default")
+        }
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+def json_schema(step_name: str) -> dict:
+    """Get a self-contained JSON schema for a pipeline step's output."""
+    schema = STEP_SCHEMAS[step_name].model_json_schema()
+    return _inline_refs(schema, schema.get("$defs", {}))
+
+
+def tool_definition(step_name: str) -> dict:
+    """Get the Anthropic tool definition used to force structured output."""
+    return {
+        "name": TOOL_NAME,
+        "description": "Submit the analysis result as structured data.",
+        "input_schema": json_schema(step_name),
+    }
+
+
+def gemini_response_schema(step_name: str) -> dict:
+    """Get the Gemini responseSchema (OpenAPI subset) for a pipeline step."""
+    def convert(node):
+        if isinstance(node, dict):
+            return {
+                k: convert(v.upper() if k == "type" and isinstance(v, str) else v)
+                for k, v in node.items()
+                if k != "additionalProperties"
+            }
+        if isinstance(node, list):
+            return [convert(v) for v in node]
+        return node
+
+    return convert(json_schema(step_name))
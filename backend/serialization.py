@@ -0,0 +1,128 @@
+import os
+import re
+import orjson
+from typing import Any, Callable
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from images import MAX_REQUEST_BYTES
+
+# Bodies this large are scanned for base64 strings (images) before orjson parses them
+LARGE_BODY_BYTES = 1024 * 1024
+# orjson's working memory while decoding a string grows with its length (from one
+# extra copy to ~13x depending on the build), so strings of at least this many
+# base64 characters are cut out of the body and decoded straight from its buffer
+LONG_STRING_CHARS = 64 * 1024
+# A quote opening a run of base64; the run is then followed to its closing quote
+_LONG_STRING = re.compile(rb'"[A-Za-z0-9+/]{%d}' % LONG_STRING_CHARS)
+
+
+def loads_large(body: bytearray) -> Any:
+    """orjson.loads for a large body, decoding long base64 strings outside orjson.
+
+    Each long string is decoded once into its final str and replaced in the
+    body by a short placeholder, so orjson parses only the rest. The body is
+    cleared once the strings are out, leaving the strings as the only copy.
+    """
+    view = memoryview(body)
+    strings, parts, position = [], [], 0
+    prefix = f"\0{os.urandom(8).hex()}:"
+    for match in _LONG_STRING.finditer(body):
+        start = match.start() + 1
+        if body[start - 2:start - 1] == b"\\":
+            continue  # An escaped quote inside another string
+        end = body.find(b'"', start)
+        # Escapes need JSON decoding; such strings (and unterminated ones) are left to orjson
+        if end == -1 or body.find(b"\\", start, end) != -1:
+            continue
+        try:
+            strings.append(str(view[start:end], "ascii"))
+        except UnicodeDecodeError:
+            continue
+        parts += [view[position:start], orjson.dumps(f"{prefix}{len(strings) - 1}")[1:]]
+        position = end + 1
+    if not strings:
+        return orjson.loads(body)
+    parts.append(view[position:])
+    rest = b"".join(parts)
+    del parts
+    view.release()
+    body.clear()
+    return _restore(orjson.loads(rest), prefix, strings)
+
+
+def _restore(node, prefix: str, strings: list):
+    if isinstance(node, str):
+        return strings[int(node[len(prefix):])] if node.startswith(prefix) else node
+    if isinstance(node, dict):
+        return {_restore(k, prefix, strings): _restore(v, prefix, strings) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_restore(v, prefix, strings) for v in node]
+    return node
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+class ORJSONRequest(Request):
+    """Request whose JSON body (e.g. multi-MB base64 images) is decoded with orjson.
+
+    The body is streamed into one buffer (Starlette keeps a list of chunks and
+    then joins them, holding the body twice), bodies over MAX_REQUEST_BYTES or
+    their own Content-Length are rejected before they are read in full, and the
+    buffer is released once decoded so a large upload is held only as the
+    parsed string.
+    """
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            length = int(self.headers.get("content-length") or 0)
+            if length > MAX_REQUEST_BYTES:
+                raise HTTPException(status_code=413, detail=f"Request body exceeds {MAX_REQUEST_BYTES} bytes")
+            # Grown as chunks arrive rather than sized from Content-Length, so a client that
+            # claims a large body and stalls holds no memory (bytearray over-allocates ~1/8)
+            buffer = bytearray()
+            async for chunk in self.stream():
+                if length and len(buffer) + len(chunk) > length:
+                    raise HTTPException(status_code=400, detail="Request body exceeds its Content-Length")
+                if len(buffer) + len(chunk) > MAX_REQUEST_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {MAX_REQUEST_BYTES} bytes")
+                buffer += chunk
+            self._body = buffer
+        return self._body
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            if len(body) < LARGE_BODY_BYTES or not isinstance(body, bytearray):
+                self._json = orjson.loads(body)
+            else:
+                self._json = loads_large(body)
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """Route class that hands endpoints an ORJSONRequest."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def orjson_route_handler(request: Request) -> Response:
+            return await handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+
+def model_response(model: BaseModel) -> Response:
+    """Serialize an already-validated response model directly.
+
+    Returning a Response bypasses FastAPI's response_model pass, which would
+    otherwise dump and re-validate the model a second time.
+    """
+    return Response(content=model.model_dump_json(), media_type="application/json")
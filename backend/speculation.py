@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from base_client import log
+from admission import request_context
+from token_budget import request_usage
+from lifecycle import drain
+
+SPECULATIVE_EXECUTION = os.environ.get("SPECULATIVE_EXECUTION", "").lower() in ("1", "true", "yes")
+SPECULATION_TTL_SECONDS = int(os.environ.get("SPECULATION_TTL_SECONDS", "600"))
+
+
+class _Speculation:
+    def __init__(self, key: str):
+        self.key = key
+        self.started_at = time.monotonic()
+        self.usage = {"input_tokens": 0, "output_tokens": 0}
+        self.task: Optional[asyncio.Task] = None
+
+
+class Speculator:
+    """Run the next pipeline step in the background while the user reviews the current one.
+
+    Speculated results are stored per (session, step) together with the request
+    key they were computed for. A later request with the same key claims the
+    stored result; any other request (or the TTL) discards it, cancelling the
+    call if it is still running, and the tokens it used are counted as wasted.
+    """
+
+    def __init__(self, enabled: bool = SPECULATIVE_EXECUTION, ttl_seconds: int = SPECULATION_TTL_SECONDS):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[str, str], _Speculation] = {}
+        self.stats = {"launched": 0, "hits": 0, "misses": 0, "expired": 0,
+                      "wasted_input_tokens": 0, "wasted_output_tokens": 0}
+
+    def launch(self, session_id: str, step: str, key: str, fn: Callable[[], Awaitable]):
+        """Start fn() in the background as the speculated result for (session_id, step)."""
+        # A draining worker starts no work that outlives the request
+        if not self.enabled or drain.draining:
+            return
+        self._expire()
+        existing = self._entries.get((session_id, step))
+        if existing and existing.key == key:
+            return
+        self._discard(session_id, step)
+
+        # Speculative calls run as batch traffic for the same tenant
+        tenant = request_context.get()[0]
+        spec = _Speculation(key)
+
+        async def run():
+            request_context.set((tenant, "batch"))
+            request_usage.set(spec.usage)
+            return await fn()
+
+        spec.task = asyncio.ensure_future(run())
+        spec.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._entries[(session_id, step)] = spec
+        self.stats["launched"] += 1
+        log("SPECULATE", f"Started speculative {step} for session {session_id}")
+
+    async def claim(self, session_id: str, step: str, key: str):
+        """Return the speculated result for a matching request, or None."""
+        if not self.enabled:
+            return None
+        spec = self._entries.pop((session_id, step), None)
+        if spec is None:
+            return None
+        if self._expired(spec, time.monotonic()):
+            self.stats["expired"] += 1
+            self._drop(spec)
+            log("SPECULATE", f"Discarded speculative {step} for session {session_id} (expired)")
+            return None
+        if spec.key != key:
+            self.stats["misses"] += 1
+            self._drop(spec)
+            log("SPECULATE", f"Discarded speculative {step} for session {session_id} (inputs changed)")
+            return None
+
+        try:
+            result = await asyncio.shield(spec.task)
+        except asyncio.CancelledError:
+            # Only a cancelled speculation falls back; a cancelled request must still stop
+            current = asyncio.current_task()
+            if not spec.task.cancelled() or (current is not None and current.cancelling()):
+                raise
+            self.stats["misses"] += 1
+            log("SPECULATE", f"Speculative {step} for session {session_id} was cancelled")
+            return None
+        except Exception as e:
+            self.stats["misses"] += 1
+            log("SPECULATE", f"Speculative {step} for session {session_id} failed: {e}")
+            return None
+        self.stats["hits"] += 1
+        log("SPECULATE", f"Serving speculative {step} for session {session_id}")
+        return result
+
+    def _discard(self, session_id: str, step: str):
+        spec = self._entries.pop((session_id, step), None)
+        if spec:
+            self._drop(spec)
+
+    def _drop(self, spec: _Speculation):
+        """Stop a discarded speculation and count its tokens once its call has finished."""
+        def count(_):
+            self.stats["wasted_input_tokens"] += spec.usage["input_tokens"]
+            self.stats["wasted_output_tokens"] += spec.usage["output_tokens"]
+        # Cancelling the waiter cancels its provider call unless a request shares it
+        spec.task.cancel()
+        spec.task.add_done_callback(count)
+
+    def _expired(self, spec: _Speculation, now: float) -> bool:
+        return now - spec.started_at > self.ttl_seconds
+
+    def _expire(self):
+        now = time.monotonic()
+        for entry_key, spec in list(self._entries.items()):
+            if self._expired(spec, now):
+                del self._entries[entry_key]
+                self.stats["expired"] += 1
+                self._drop(spec)
+
+    def cancel_all(self):
+        """Stop every pending speculation (on shutdown, when nothing else could claim its result)."""
+        for entry_key in list(self._entries):
+            self._drop(self._entries.pop(entry_key))
+
+    def metrics(self) -> dict:
+        claimed = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "pending": len(self._entries),
+            "hit_rate": self.stats["hits"] / claimed if claimed else 0.0,
+        }
@@ -0,0 +1,68 @@
+"""Shared test setup.
+
+Modules read their configuration from the environment when imported, so it is
+pinned here first: no database, no warm-up, no cassette. Tests that need
+Postgres run when TEST_DATABASE_URL points at a scratch database (its tables
+are emptied) and are skipped otherwise.
+"""
+import os
+import asyncio
+
+os.environ.update({
+    "DATABASE_URL": "",
+    "WARMUP_PROVIDERS": "",
+    "CASSETTE_MODE": "off",
+    "FAKE_LATENCY_SECONDS": "0",
+    "STRUCTURED_OUTPUT": "false",
+    "SPECULATIVE_EXECUTION": "false",
+    "MODEL_CASCADE": "false",
+    "PROFILE_TOKEN": "",
+})
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "")
+
+
+@pytest.fixture
+def fake_client():
+    from fake_client import FakeClient
+    return FakeClient(latency=0)
+
+
+@pytest.fixture
+def app_client(monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+    from lifecycle import drain
+
+    # Shutting the app down drains the worker; later tests expect a live one
+    monkeypatch.setattr(drain, "draining", False)
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Point the database module at TEST_DATABASE_URL; use with run_with_database."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import database
+    monkeypatch.setattr(database, "DATABASE_URL", TEST_DATABASE_URL)
+    return database
+
+
+def run_with_database(scenario):
+    """Run `await scenario()` with the pool open and the shared tables empty."""
+    import database
+
+    async def run():
+        assert await database.init_database()
+        try:
+            async with database.get_pool().connection() as conn:
+                await conn.execute("TRUNCATE threats, threat_counts, coalesced_results, session_results")
+            return await scenario()
+        finally:
+            await database.close_database()
+
+    return asyncio.run(run())
@@ -0,0 +1,179 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected, request_context
+from coalesce import SingleFlight
+
+
+@pytest.fixture
+def limit_fake(monkeypatch):
+    """Give the fake provider a fresh scheduler with the given slot limit."""
+    def limit(slots: int):
+        monkeypatch.setitem(admission.PROVIDER_MAX_CONCURRENCY, "fake", slots)
+        monkeypatch.setattr(admission.admission_controller, "_schedulers", {})
+        return admission.admission_controller
+    return limit
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrent_requests_queue_for_provider_slots(limit_fake):
+    from fake_client import FakeClient
+
+    controller = limit_fake(8)
+    client = FakeClient(latency=0.3)
+
+    async def scenario():
+        flights = SingleFlight(across_workers=False)
+        return await asyncio.gather(*(
+            flights.run(f"request-{n}", client.analyze_diagram, f"image-{n}") for n in range(16)
+        ))
+
+    start = time.perf_counter()
+    results = asyncio.run(scenario())
+    elapsed = time.perf_counter() - start
+
+    stats = controller.metrics()["fake"]
+    assert len(results) == 16
+    assert stats["max_concurrency"] == 8
+    assert stats["admitted"] == 16
+    assert stats["queued"] == 8  # The limit binds: half the calls waited for a slot
+    assert stats["active"] == 0
+    assert 0.6 <= elapsed < 1.5  # Two waves of 8, not 16 at once or four waves of 4
+    assert controller.thread_metrics()["max_busy"] >= 16
+
+
+def test_interactive_flows_get_the_larger_share(limit_fake):
+    controller = limit_fake(1)
+    granted = []
+    controller.acquire("fake")  # Hold the only slot while the queue fills
+
+    def request(tenant, traffic):
+        request_context.set((tenant, traffic))
+        with controller.slot("fake"):
+            granted.append(traffic)
+
+    threads = []
+    for tenant, traffic in [("bulk", "batch")] * 4 + [("alice", "interactive")] * 4:
+        thread = threading.Thread(target=request, args=(tenant, traffic))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: controller.metrics()["fake"]["queue_depth"] == len(threads))
+    controller.release("fake")
+    for thread in threads:
+        thread.join(2)
+
+    # Interactive has 4x the weight of batch: after the first grant, it gets the next four
+    assert granted == ["batch"] + ["interactive"] * 4 + ["batch"] * 3
+    assert controller.metrics()["fake"]["active"] == 0
+
+
+def test_full_tenant_queue_is_rejected(limit_fake, monkeypatch):
+    monkeypatch.setattr(admission, "TENANT_MAX_QUEUE", 2)
+    controller = limit_fake(1)
+    controller.acquire("fake")
+
+    threads = [threading.Thread(target=controller.acquire, args=("fake",)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: controller.metrics()["fake"]["queue_depth"] == 2)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("fake")
+    assert rejected.value.retry_after >= 1
+
+    # Another tenant still has room in its own queue
+    def other_tenant():
+        request_context.set(("bob", "interactive"))
+        controller.acquire("fake")
+        controller.release("fake")
+
+    other = threading.Thread(target=other_tenant)
+    other.start()
+    wait_until(lambda: controller.metrics()["fake"]["queue_depth"] == 3)
+    for _ in range(3):
+        controller.release("fake")
+    other.join(2)
+    assert controller.metrics()["fake"]["rejected"] == 1
+
+
+def test_calls_are_rejected_when_provider_threads_are_exhausted():
+    controller = AdmissionController(threads=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(controller.run_in_thread(release.wait, 2))
+        await asyncio.sleep(0.05)
+        with pytest.raises(AdmissionRejected):
+            await controller.run_in_thread(lambda: None)
+        release.set()
+        return await running
+
+    assert asyncio.run(scenario()) is True
+    assert controller.thread_metrics() == {"threads": 1, "busy": 0, "started": 1, "rejected": 1, "max_busy": 1}
+
+
+def test_provider_threads_see_the_request_context():
+    controller = AdmissionController(threads=2)
+
+    async def scenario():
+        request_context.set(("carol", "batch"))
+        return await controller.run_in_thread(request_context.get)
+
+    assert asyncio.run(scenario()) == ("carol", "batch")
+
+
+def test_each_worker_enforces_its_share_of_the_limits(limit_fake, monkeypatch):
+    monkeypatch.setattr(admission, "WEB_CONCURRENCY", 2)
+    monkeypatch.setattr(admission, "TENANT_MAX_QUEUE", 4)
+    controller = limit_fake(4)
+    assert controller.limit("fake") == 2
+    controller.acquire("fake")
+    controller.acquire("fake")
+
+    threads = [threading.Thread(target=controller.acquire, args=("fake",)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: controller.metrics()["fake"]["queue_depth"] == 2)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire("fake")
+
+    for _ in range(4):
+        controller.release("fake")
+    for thread in threads:
+        thread.join(2)
+    assert controller.metrics()["fake"]["active"] == 0
+
+
+def test_drained_flows_are_forgotten(limit_fake):
+    controller = limit_fake(1)
+    controller.acquire("fake")
+    sched = controller._schedulers["fake"]
+
+    def request(tenant):
+        request_context.set((tenant, "interactive"))
+        with controller.slot("fake"):
+            pass
+
+    # One-off tenants, as when tenant IDs come from request headers
+    threads = []
+    for n in range(50):
+        thread = threading.Thread(target=request, args=(f"tenant-{n}",))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: controller.metrics()["fake"]["queue_depth"] == len(threads))
+    controller.release("fake")
+    for thread in threads:
+        thread.join(2)
+
+    assert sched.queues == {} and sched.virtual_time == {}
+    assert controller.metrics()["fake"]["active"] == 0
@@ -0,0 +1,49 @@
+import pytest
+
+from attack import AttackIndex, attack_index
+
+
+def threat(tactic, technique):
+    return {"id": "TS01", "scenario": "An attacker uses leaked cloud credentials.",
+            "mitre_tactic": tactic, "mitre_technique": technique}
+
+
+@pytest.mark.parametrize("technique, expected", [
+    ("T1078.004 - Valid Accounts: Cloud Accounts", "T1078.004 - Valid Accounts: Cloud Accounts"),
+    ("t1190", "T1190 - Exploit Public-Facing Application"),
+    # A wrong ID next to a known name is corrected to that name's ID
+    ("T1999 - Exploit Public-Facing Application", "T1190 - Exploit Public-Facing Application"),
+    ("Cloud Accounts", "T1078.004 - Valid Accounts: Cloud Accounts"),
+])
+def test_technique_ids_are_normalized(technique, expected):
+    enriched = attack_index.enrich_threat(threat("TA0001 - Initial Access", technique))
+    assert enriched["mitre_technique"] == expected
+    assert enriched["invalid_mitre_ids"] == []
+
+
+def test_unknown_ids_are_dropped():
+    enriched = attack_index.enrich_threat(threat("TA0001, TA0099 - Made Up", "T1190, T9999.999 - Not A Technique"))
+    assert enriched["mitre_tactic"] == "TA0001 - Initial Access"
+    assert enriched["mitre_technique"] == "T1190 - Exploit Public-Facing Application"
+    assert enriched["invalid_mitre_ids"] == ["TA0099", "T9999.999"]
+
+
+def test_missing_tactics_are_filled_from_the_technique():
+    enriched = attack_index.enrich_threat(threat("", "T1078 - Valid Accounts"))
+    assert enriched["mitre_tactic"] == ("TA0005 - Defense Evasion, TA0003 - Persistence, "
+                                        "TA0004 - Privilege Escalation, TA0001 - Initial Access")
+
+
+def test_text_without_ids_or_known_names_is_left_alone():
+    enriched = attack_index.enrich_threat(threat("Lateral movement-ish", "Something custom"))
+    assert (enriched["mitre_tactic"], enriched["mitre_technique"]) == ("Lateral movement-ish", "Something custom")
+
+
+def test_missing_data_file_passes_threats_through(tmp_path):
+    index = AttackIndex(str(tmp_path / "missing.tsv"))
+    assert "missing.tsv" in index.error
+    assert index.metrics()["techniques"] == 0
+
+    original = threat("TA0001 - Initial Access", "T1190 - Exploit Public-Facing Application")
+    enriched = index.enrich_threat(dict(original))
+    assert enriched == {**original, "invalid_mitre_ids": []}
@@ -0,0 +1,67 @@
+import io
+import json
+import threading
+
+import boto3
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from bedrock_client import BEDROCK_CONFIG, BedrockClient, get_runtime_client
+from bench_bedrock import FakeBedrock, run_pool
+
+
+def runtime_client(region):
+    return boto3.client("bedrock-runtime", region_name=region, config=BEDROCK_CONFIG,
+                        aws_access_key_id="test", aws_secret_access_key="test")
+
+
+def bedrock_client(regions):
+    client = BedrockClient(regions=regions)
+    client.clients = {region: runtime_client(region) for region in regions}
+    return client
+
+
+def test_runtime_clients_are_shared_per_region():
+    assert get_runtime_client("us-west-2") is get_runtime_client("us-west-2")
+    assert get_runtime_client("us-west-2") is not get_runtime_client("us-east-2")
+    assert get_runtime_client("us-west-2").meta.config.max_pool_connections == BEDROCK_CONFIG.max_pool_connections
+
+
+def test_warm_up_opens_a_connection_in_every_region():
+    client = bedrock_client(["us-east-1", "us-west-2"])
+    stubs = [Stubber(runtime) for runtime in client.clients.values()]
+    stubs[0].add_response("list_async_invokes", {"asyncInvokeSummaries": []}, {"maxResults": 1})
+    # Without permission for async invokes the request still opened the connection
+    stubs[1].add_client_error("list_async_invokes", "AccessDeniedException", http_status_code=403)
+    for stub in stubs:
+        stub.activate()
+
+    client.warm_up()
+
+    for stub in stubs:
+        stub.assert_no_pending_responses()
+
+
+def test_warm_up_ping_sends_a_one_token_request():
+    client = bedrock_client(["us-east-1"])
+    body = json.dumps({"content": [{"type": "text", "text": "p"}], "stop_reason": "max_tokens",
+                       "usage": {"input_tokens": 8, "output_tokens": 1}}).encode()
+    with Stubber(client.clients["us-east-1"]) as stub:
+        stub.add_response("list_async_invokes", {"asyncInvokeSummaries": []})
+        stub.add_response("invoke_model", {"body": StreamingBody(io.BytesIO(body), len(body)),
+                                           "contentType": "application/json"})
+        client.warm_up(ping=True)
+        stub.assert_no_pending_responses()
+
+
+def test_connections_are_reused_across_bursts():
+    server = FakeBedrock(latency=0.05)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        reused = run_pool(server, "invoke", pool_size=8, concurrency=8, bursts=3, pause=0.05)
+        too_small = run_pool(server, "converse", pool_size=2, concurrency=8, bursts=3, pause=0.05)
+    finally:
+        server.shutdown()
+
+    assert reused["requests"] == 24 and reused["connections"] == 8
+    assert too_small["requests"] == 24 and too_small["connections"] > 8
@@ -0,0 +1,65 @@
+import sys
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import bulk
+import fake_batch_server
+from bulk import AnthropicBatchBackend, BulkPipeline
+from fake_client import FAKE_RESPONSES, FakeClient
+
+
+class RecordingBackend(AnthropicBatchBackend):
+    """The Anthropic backend talking to the in-process fake Message Batches API."""
+
+    def __init__(self, client):
+        super().__init__(client, api_key="test", base_url="http://testserver")
+        self.http = TestClient(fake_batch_server.app)
+        self.submitted = []
+
+    def submit(self, items, structured):
+        self.submitted.append([item.custom_id for item in items])
+        return super().submit(items, structured)
+
+
+def diagrams(count):
+    return [{"session_id": f"bulk_test_{n}", "image": "aGVsbG8=", "media_type": "image/png"} for n in range(count)]
+
+
+@pytest.mark.parametrize("structured", [False, True])
+def test_bulk_submit_poll_collect(monkeypatch, structured):
+    monkeypatch.setattr(fake_batch_server, "FAKE_BATCH_POLLS", 2)
+    client = FakeClient(latency=0, structured_output=structured)
+    backend = RecordingBackend(client)
+    pipeline = BulkPipeline(backend, client, ["baseline", "aws"], poll_interval=0)
+
+    sessions = asyncio.run(pipeline.run(diagrams(2)))
+
+    # Round 1: Step 1 and 2A/2B/2C per diagram; round 2: one Step 3 per diagram and template
+    assert [len(batch) for batch in backend.submitted] == [8, 4]
+    assert "d1-STEP-3-aws" in backend.submitted[1]
+    for session in sessions.values():
+        assert session["analysis"] == FAKE_RESPONSES["STEP-1"]
+        assert [c["name"] for c in session["components"]["in_scope_components"]] == [
+            "Application Load Balancer", "Amazon ECS", "Amazon RDS"]
+        assert set(session["threats"]) == {"baseline", "aws"}
+        assert session["threats"]["baseline"][0]["id"] == "TS01"
+        # The templates' shared threat appears once in the merged list
+        assert [t["id"] for t in session["merged_threats"]] == ["TS01"]
+
+
+def test_unknown_template_is_rejected_before_submitting():
+    client = FakeClient(latency=0)
+    backend = RecordingBackend(client)
+    with pytest.raises(ValueError, match="baselin"):
+        BulkPipeline(backend, client, ["baselin"])
+    assert backend.submitted == []
+
+
+def test_cli_rejects_unknown_templates(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(sys, "argv", ["bulk.py", str(tmp_path), "--templates", "baseline,netwrok"])
+    with pytest.raises(SystemExit) as exited:
+        bulk.main()
+    assert exited.value.code == 2
+    assert "netwrok" in capsys.readouterr().err
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import threading
+import contextvars
+from types import SimpleNamespace
+
+import pytest
+
+import cancellation
+import main
+from base_client import Completion, anthropic_stream_completion
+from bedrock_client import BedrockClient
+from cancellation import RequestCancelled, cancellable, disconnect_watched, run_cancellable, wait_cancelled
+from coalesce import SingleFlight
+
+
+class DisconnectingRequest:
+    """Stands in for the Starlette request; the client leaves after `seconds`."""
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+        self.url = SimpleNamespace(path="/api/test")
+
+    async def is_disconnected(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+def in_flight(fn, watched: bool):
+    """Run fn as a SingleFlight call from a request that is (or is not) watched for disconnects."""
+    async def scenario():
+        disconnect_watched.set(watched)
+        return await SingleFlight(across_workers=False).run("key", fn)
+    return asyncio.run(scenario())
+
+
+def test_calls_are_only_cancellable_when_a_disconnect_is_watched(monkeypatch):
+    assert in_flight(cancellable, watched=False) is False
+    assert in_flight(cancellable, watched=True) is True
+    monkeypatch.setattr(cancellation, "CANCEL_ON_DISCONNECT", False)
+    assert in_flight(cancellable, watched=True) is False
+
+
+def test_bedrock_converse_only_streams_when_cancellable(monkeypatch):
+    client = BedrockClient(regions=["us-east-1"], api="converse")
+    used = []
+    monkeypatch.setattr(client, "_converse", lambda *args: used.append("converse") or Completion())
+    monkeypatch.setattr(client, "_converse_stream", lambda *args: used.append("converse_stream") or Completion())
+
+    in_flight(lambda: client._invoke("prompt"), watched=False)
+    in_flight(lambda: client._invoke("prompt"), watched=True)
+    assert used == ["converse", "converse_stream"]
+
+
+def test_disconnect_returns_499_and_aborts_the_call(monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_POLL_SECONDS", 0.01)
+    flights = SingleFlight(across_workers=False)
+    seen = {}
+
+    def call():
+        seen["cancellable"] = cancellable()
+        start = time.monotonic()
+        if wait_cancelled(5):
+            seen["aborted_after"] = time.monotonic() - start
+            raise RequestCancelled()
+        return {"finished": True}
+
+    @main.cancel_on_disconnect
+    async def endpoint(http_request):
+        return await flights.run("key", call)
+
+    async def scenario():
+        disconnects = main.cancellation_stats.metrics()["disconnects"]
+        response = await endpoint(http_request=DisconnectingRequest(0.1))
+        # The provider thread notices the cancellation on its own
+        for _ in range(100):
+            if "aborted_after" in seen:
+                break
+            await asyncio.sleep(0.01)
+        return response, main.cancellation_stats.metrics()["disconnects"] - disconnects
+
+    response, disconnects = asyncio.run(scenario())
+    assert response.status_code == 499
+    assert disconnects == 1
+    assert seen["cancellable"] is True
+    assert seen["aborted_after"] < 1
+    assert flights.stats["cancelled"] == 1
+
+
+def test_connected_client_gets_the_result(monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_POLL_SECONDS", 0.01)
+
+    @main.cancel_on_disconnect
+    async def endpoint(http_request):
+        await asyncio.sleep(0.05)
+        return {"done": True}
+
+    assert asyncio.run(endpoint(http_request=DisconnectingRequest(60))) == {"done": True}
+
+
+def test_cancelled_stream_reports_the_output_so_far():
+    event = threading.Event()
+
+    def events():
+        for n in range(1000):
+            if n == 500:
+                event.set()
+            yield {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "abcd"}}
+
+    with pytest.raises(RequestCancelled) as cancelled:
+        contextvars.copy_context().run(run_cancellable, event, anthropic_stream_completion, events())
+    assert cancelled.value.output_tokens == 501
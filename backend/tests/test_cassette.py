@@ -0,0 +1,82 @@
+import io
+import base64
+
+import pytest
+
+import base_client
+from cassette import Cassette, CassetteMiss
+from fake_client import FakeClient
+
+TEMPLATES = ["baseline", "aws"]
+
+
+def diagram(color="white") -> str:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture
+def cassette(monkeypatch, tmp_path):
+    cassette = Cassette(path=str(tmp_path / "pipeline.jsonl.gz"), mode="record")
+    monkeypatch.setattr(base_client, "cassette", cassette)
+    return cassette
+
+
+@pytest.fixture
+def no_provider(monkeypatch):
+    """Fail any call that would reach the provider."""
+    def start():
+        monkeypatch.setattr(FakeClient, "_invoke", lambda *args, **kwargs: pytest.fail("called the provider"))
+    return start
+
+
+def pipeline(client, image):
+    analysis = client.analyze_diagram(image)
+    extraction = client.extract_components(image)
+    threats = {t: client.generate_threats(extraction["application_description"], extraction["in_scope_components"],
+                                          extraction["key_features"], t) for t in TEMPLATES}
+    return analysis, extraction, threats
+
+
+def test_pipeline_replays_offline(cassette, no_provider):
+    image = diagram()
+    recorded = pipeline(FakeClient(latency=0), image)
+    assert cassette.stats["recorded"] == 1 + 3 + len(TEMPLATES)  # Step 2 is three sub-steps
+
+    cassette.start_replay(latency_scale=0)
+    no_provider()
+    assert pipeline(FakeClient(latency=0), image) == recorded
+    assert cassette.stats["replayed"] == cassette.stats["recorded"]
+    assert cassette.stats["misses"] == 0
+
+
+def test_api_pipeline_replays_offline(cassette, no_provider, app_client):
+    image = diagram()
+
+    def run():
+        analysis = app_client.post("/api/analyze-diagram", json={"image": image, "provider": "fake"}).json()
+        extraction = app_client.post("/api/extract-components", json={"image": image, "provider": "fake"}).json()
+        threats = app_client.post("/api/generate-threats", json={
+            "application_description": extraction["application_description"],
+            "in_scope_components": extraction["in_scope_components"],
+            "key_features": extraction["key_features"], "template": "baseline", "provider": "fake"}).json()
+        return [{k: v for k, v in r.items() if k != "session_id"} for r in (analysis, extraction, threats)]
+
+    recorded = run()
+    cassette.start_replay(latency_scale=0)
+    no_provider()
+    assert run() == recorded
+    assert cassette.stats["replayed"] == cassette.stats["recorded"] > 0
+
+
+def test_unrecorded_request_is_a_miss(cassette, no_provider):
+    FakeClient(latency=0).analyze_diagram(diagram())
+    cassette.start_replay(latency_scale=0)
+    no_provider()
+
+    with pytest.raises(CassetteMiss):
+        FakeClient(latency=0).analyze_diagram(diagram("black"))
+    assert cassette.stats["misses"] == 1
@@ -0,0 +1,147 @@
+import time
+import asyncio
+
+from cancellation import wait_cancelled
+from coalesce import SingleFlight, request_key
+from conftest import run_with_database
+
+
+def test_request_key_separates_parts():
+    assert request_key("ab", "c") != request_key("a", "bc")
+    assert request_key("img", {"b": 1, "a": 2}) == request_key("img", {"a": 2, "b": 1})
+
+
+def test_identical_requests_share_one_call():
+    calls = []
+
+    def call(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return {"value": value}
+
+    async def scenario():
+        flights = SingleFlight(across_workers=False)
+        results = await asyncio.gather(*(flights.run("k", call, 1) for _ in range(5)),
+                                       flights.run("other", call, 2))
+        return flights, results
+
+    flights, results = asyncio.run(scenario())
+    assert results == [{"value": 1}] * 5 + [{"value": 2}]
+    assert sorted(calls) == [1, 2]
+    assert flights.stats == {"calls": 6, "coalesced": 4, "cancelled": 0}
+
+
+def test_call_is_cancelled_when_every_caller_leaves():
+    finished = []
+
+    def call():
+        finished.append("cancelled" if wait_cancelled(5) else "completed")
+
+    async def scenario():
+        flights = SingleFlight(across_workers=False)
+        callers = [asyncio.ensure_future(flights.run("k", call)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        callers[0].cancel()
+        await asyncio.sleep(0.05)
+        assert flights.stats["cancelled"] == 0  # One caller is still waiting
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.1)
+        return flights
+
+    start = time.perf_counter()
+    flights = asyncio.run(scenario())
+    assert finished == ["cancelled"]
+    assert flights.stats["cancelled"] == 1
+    assert time.perf_counter() - start < 2
+
+
+def test_across_workers_result_handoff(database):
+    """A second worker waits for the first one's call and reuses its result."""
+    calls = []
+
+    async def scenario():
+        gate = asyncio.Event()
+        key = request_key("handoff")
+        other_worker = database.AdvisoryLocks()
+
+        async def call(worker):
+            calls.append(worker)
+            await gate.wait()
+            return {"worker": worker}
+
+        leader = asyncio.ensure_future(database.run_with_advisory_lock(key, lambda: call("a")))
+        await asyncio.sleep(0.1)
+        follower = asyncio.ensure_future(database.run_with_advisory_lock(key, lambda: call("b"), other_worker))
+        await asyncio.sleep(0.3)
+        assert not follower.done()
+        gate.set()
+        try:
+            return await asyncio.wait_for(asyncio.gather(leader, follower), 2)
+        finally:
+            await other_worker.close()
+
+    assert run_with_database(scenario) == [{"worker": "a"}, {"worker": "a"}]
+    assert calls == ["a"]
+
+
+def test_follower_runs_the_call_when_the_leader_fails(database):
+    async def scenario():
+        key = request_key("leader-fails")
+        other_worker = database.AdvisoryLocks()
+
+        async def failing():
+            await asyncio.sleep(0.2)
+            raise RuntimeError("provider error")
+
+        async def succeeding():
+            return {"worker": "b"}
+
+        leader = asyncio.ensure_future(database.run_with_advisory_lock(key, failing))
+        await asyncio.sleep(0.05)
+        follower = database.run_with_advisory_lock(key, succeeding, other_worker)
+        try:
+            results = await asyncio.gather(leader, follower, return_exceptions=True)
+        finally:
+            await other_worker.close()
+        assert isinstance(results[0], RuntimeError)
+        return results[1]
+
+    assert run_with_database(scenario) == {"worker": "b"}
+
+
+def test_lock_holders_do_not_starve_the_pool(database, monkeypatch):
+    """Calls holding (or waiting on) advisory locks leave pooled connections free."""
+    monkeypatch.setattr(database, "DB_POOL_MIN_SIZE", 1)
+    monkeypatch.setattr(database, "DB_POOL_MAX_SIZE", 2)
+
+    async def scenario():
+        gate = asyncio.Event()
+        other_worker = database.AdvisoryLocks()
+
+        async def call():
+            await gate.wait()
+            return {"ok": True}
+
+        flights = []
+        for n in range(4):
+            key = request_key("pool", n)
+            flights.append(asyncio.ensure_future(database.run_with_advisory_lock(key, call)))
+            flights.append(asyncio.ensure_future(database.run_with_advisory_lock(key, call, other_worker)))
+        await asyncio.sleep(0.3)
+
+        async def query():
+            async with database.get_pool().connection() as conn:
+                return await (await conn.execute("SELECT 1 AS one")).fetchone()
+
+        try:
+            row = await asyncio.wait_for(query(), 2)
+        finally:
+            gate.set()
+            results = await asyncio.gather(*flights)
+            await other_worker.close()
+        return row, results
+
+    row, results = run_with_database(scenario)
+    assert row == {"one": 1}
+    assert results == [{"ok": True}] * 8
@@ -0,0 +1,92 @@
+import io
+import base64
+
+import base_client
+from dedup import affected_components, component_names, dedupe_threats
+from fake_client import FAKE_RESPONSES, FakeClient
+
+COMPONENTS = [{"name": "Application Load Balancer", "category": "network"},
+              {"name": "Amazon ECS", "category": "compute"},
+              {"name": "Amazon RDS", "category": "database"}]
+
+
+def threat(id, scenario, mitigations, stride="Information Disclosure", cia_triad="Confidentiality"):
+    return {"id": id, "scenario": scenario, "cia_triad": cia_triad, "stride": stride,
+            "mitre_tactic": "TA0010 - Exfiltration", "mitre_technique": "T1190 - Exploit Public-Facing Application",
+            "mitigations": mitigations}
+
+
+SCENARIO = ("An external attacker exfiltrates customer records from Amazon RDS via SQL injection "
+            "in the order service running on Amazon ECS")
+NEAR_DUPLICATES = [
+    threat("TS01", SCENARIO + ".", "Use parameterized queries."),
+    threat("TS07", SCENARIO.replace(" via ", " through ") + ".",
+           "Use parameterized queries. Encrypt the database at rest."),
+]
+
+
+def test_near_duplicates_in_one_category_are_merged():
+    merged = dedupe_threats(NEAR_DUPLICATES, components=COMPONENTS)
+
+    assert len(merged) == 1
+    assert merged[0]["id"] == "TS07"  # The longer scenario
+    assert merged[0]["mitigations"] == "Use parameterized queries. Encrypt the database at rest."
+    assert merged[0]["components"] == ["amazon ecs", "amazon rds"]
+
+
+def test_components_of_the_merged_member_are_kept():
+    components = COMPONENTS + [{"name": "Amazon S3", "category": "storage"}]
+    longer = threat("TS01", SCENARIO + " in the production account.", "Use parameterized queries.")
+    shorter = threat("TS02", SCENARIO + " into Amazon S3.", "Block public bucket access.")
+    merged = dedupe_threats([longer, shorter], threshold=0.75, components=components)
+
+    assert len(merged) == 1
+    assert merged[0]["id"] == "TS01"
+    assert merged[0]["components"] == ["amazon ecs", "amazon rds", "amazon s3"]
+    assert affected_components(merged[0], component_names(components)) == merged[0]["components"]
+
+
+def test_threats_in_different_categories_are_not_merged():
+    tampering = {**NEAR_DUPLICATES[1], "stride": "Tampering", "cia_triad": "Integrity"}
+    merged = dedupe_threats([NEAR_DUPLICATES[0], tampering], components=COMPONENTS)
+
+    assert [(t["id"], t["stride"], t["cia_triad"]) for t in merged] == [
+        ("TS01", "Information Disclosure", "Confidentiality"), ("TS07", "Tampering", "Integrity")]
+    assert merged[0]["mitigations"] == "Use parameterized queries."
+    assert "components" not in merged[0]
+
+
+def test_distinct_threats_are_kept_in_order():
+    denial = threat("TS02", "A flood of requests to the Application Load Balancer exhausts the ECS tasks.",
+                    "Enable AWS Shield and autoscaling.", stride="Denial of Service", cia_triad="Availability")
+    merged = dedupe_threats([NEAR_DUPLICATES[0], denial, NEAR_DUPLICATES[1]])
+    assert [t["id"] for t in merged] == ["TS07", "TS02"]
+
+
+def test_single_responses_are_not_merged_by_default(monkeypatch):
+    responses = {**FAKE_RESPONSES, "STEP-3": {"threats": NEAR_DUPLICATES}}
+    client = FakeClient(responses, latency=0)
+    assert len(client.generate_threats("An order service", COMPONENTS, [])["threats"]) == 2
+
+    monkeypatch.setattr(base_client, "THREAT_DEDUP", True)
+    assert len(client.generate_threats("An order service", COMPONENTS, [])["threats"]) == 1
+
+
+def test_pipeline_merges_threats_across_templates(app_client):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    start = {"type": "start", "image": base64.b64encode(buffer.getvalue()).decode(), "provider": "fake",
+             "templates": ["baseline", "aws"], "review": False}
+
+    with app_client.websocket_connect("/api/ws/pipeline") as websocket:
+        websocket.send_json(start)
+        events = []
+        while not events or events[-1]["type"] not in ("done", "error"):
+            events.append(websocket.receive_json())
+
+    merged = [e for e in events if e["type"] == "merged"]
+    assert [e["templates"] for e in merged] == [["baseline"], ["baseline", "aws"]]
+    # Both templates return the fake provider's threat; the merged list has it once
+    assert [t["id"] for t in merged[-1]["threats"]] == ["TS01"]
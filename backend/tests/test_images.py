@@ -0,0 +1,159 @@
+import io
+import os
+import base64
+import asyncio
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+import images
+from images import MAX_REQUEST_BYTES, EncodedImage, _ImageCache
+from serialization import ORJSONRequest, loads_large
+
+
+def b64(n_bytes: int) -> str:
+    return base64.b64encode(os.urandom(n_bytes)).decode()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = _ImageCache(max_bytes=10_000, max_images=3)
+    monkeypatch.setattr(images, "_cache", cache)
+    return cache
+
+
+def test_equal_images_share_an_entry(cache):
+    image = b64(300)
+    equal = (image + " ")[:-1]
+    assert equal is not image
+
+    assert images.encoded_image(image) is images.encoded_image(equal)
+    del image
+    # Entries outlive the request's string; only the bounds evict them
+    assert images.encoded_image(equal).base64 == equal
+    assert cache.metrics()["hits"] == 2 and cache.metrics()["misses"] == 1
+
+
+def test_least_recently_used_images_are_evicted_by_count(cache):
+    first, second, third, fourth = (b64(300) for _ in range(4))
+    for image in (first, second, third, first, fourth):
+        images.encoded_image(image)
+
+    assert list(cache._entries) == [third, first, fourth]
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_least_recently_used_images_are_evicted_by_size(cache):
+    small, large = b64(3000), b64(6000)
+    images.encoded_image(small)
+    images.encoded_image(small).json  # Grows the entry by its JSON encoding
+    images.encoded_image(large)
+
+    assert list(cache._entries) == [large]
+    assert cache.nbytes == len(large)
+
+
+def test_decoding_streams_in_chunks(monkeypatch):
+    monkeypatch.setattr(images, "DECODE_CHUNK_CHARS", 8)
+    data = os.urandom(1001)
+    assert EncodedImage(base64.b64encode(data).decode()).raw == data
+    # Line-wrapped base64 cannot be cut into aligned chunks and is decoded whole
+    wrapped = base64.encodebytes(data).decode()
+    assert EncodedImage(wrapped).raw == data
+
+
+def test_large_decoded_images_are_spooled_to_disk(cache, monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_SPOOL_BYTES", 1000)
+    small, large = os.urandom(500), os.urandom(5000)
+
+    for data in (small, large):
+        entry = images.encoded_image(base64.b64encode(data).decode())
+        with entry.file() as decoded:
+            assert decoded.read() == data
+    assert cache.metrics()["spooled"] == 1
+    # Only the small image's decoded bytes count against the memory bound
+    assert cache.nbytes == sum(len(base64.b64encode(d)) for d in (small, large)) + len(small)
+
+
+def test_uploaded_bytes_are_not_decoded_again(cache, monkeypatch):
+    data = os.urandom(2000)
+    image = images.uploaded_image(data)
+    monkeypatch.setattr(images.base64, "b64decode", lambda *args: pytest.fail("decoded again"))
+
+    assert images.encoded_image(image).raw == data
+    assert cache.metrics()["misses"] == 1
+
+
+@pytest.mark.parametrize("payload", [
+    {"image": b64(200_000), "provider": "fake", "nested": [1, {"short": "aGk="}]},
+    {"images": [b64(100_000), b64(100_000) + "AA=="], "quote": 'a"b'},
+    {"escaped": '\\"' + b64(100_000), "quoted": '"' + b64(100_000)},
+    {"backslash": "\\", "after": b64(100_000)},
+    {b64(100_000): "long key"},
+    {"text": "x" * 2_000_000, "unicode": "é" + b64(100_000), "newline": b64(100_000) + "\n"},
+], ids=["image", "several", "escaped", "backslash", "key", "not-base64"])
+def test_large_bodies_parse_like_orjson(payload):
+    body = bytearray(orjson.dumps(payload))
+    assert loads_large(body) == payload
+
+
+def test_large_body_is_released_once_parsed():
+    image = b64(2_000_000)
+    body = bytearray(orjson.dumps({"image": image}))
+    assert loads_large(body) == {"image": image}
+    assert len(body) == 0
+
+
+def test_large_invalid_body_is_rejected():
+    with pytest.raises(orjson.JSONDecodeError):
+        loads_large(bytearray(b'{"image": "' + b64(100_000).encode() + b'", "provider": '))
+
+
+def test_api_accepts_a_large_upload(app_client):
+    from PIL import Image
+
+    # Noise does not compress, so the body is well over LARGE_BODY_BYTES
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (800, 800), os.urandom(800 * 800 * 3)).save(buffer, format="PNG")
+    image = base64.b64encode(buffer.getvalue()).decode()
+    assert len(image) > 1024 * 1024
+
+    response = app_client.post("/api/analyze-diagram", json={"image": image, "provider": "fake"})
+    assert response.status_code == 200
+    assert response.json()["entry_points"]
+
+
+def receiving(*chunks):
+    """An ASGI receive callable that delivers `chunks` as the request body."""
+    messages = [{"type": "http.request", "body": c, "more_body": n < len(chunks) - 1} for n, c in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+    return receive
+
+
+def body_request(content_length, *chunks):
+    headers = [(b"content-length", str(content_length).encode())] if content_length is not None else []
+    return ORJSONRequest({"type": "http", "method": "POST", "path": "/", "headers": headers}, receiving(*chunks))
+
+
+def test_claimed_length_is_not_allocated_up_front():
+    import tracemalloc
+
+    request = body_request(MAX_REQUEST_BYTES, b'{"image": "')
+    tracemalloc.start()
+    try:
+        # The client claims the maximum, then sends a few bytes and stalls (here: ends)
+        assert asyncio.run(request.body()) == b'{"image": "'
+        assert tracemalloc.get_traced_memory()[1] < 1024 * 1024
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("content_length, status", [(None, 413), (MAX_REQUEST_BYTES + 1, 413), (10, 400)])
+def test_oversized_bodies_are_rejected(content_length, status):
+    chunk = b"a" * (MAX_REQUEST_BYTES // 2 + 1)
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(body_request(content_length, chunk, chunk).body())
+    assert rejected.value.status_code == status
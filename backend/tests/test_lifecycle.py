@@ -0,0 +1,29 @@
+import io
+import base64
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import lifecycle
+from lifecycle import drain
+
+
+def test_draining_closes_open_pipelines_with_1012(app_client, monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(lifecycle, "DRAIN_POLL_SECONDS", 0.01)
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    start = {"type": "start", "image": base64.b64encode(buffer.getvalue()).decode(), "provider": "fake",
+             "review": True}
+
+    with app_client.websocket_connect("/api/ws/pipeline") as websocket:
+        websocket.send_json(start)
+        while websocket.receive_json()["type"] != "review":
+            pass
+        # Waiting for the user's review when a deploy starts
+        monkeypatch.setattr(drain, "draining", True)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                websocket.receive_json()
+    assert closed.value.code == 1012
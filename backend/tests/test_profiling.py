@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+import main
+import profiling
+from profiling import Profiler, SlowRequests
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    profiler = Profiler(directory=str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", TOKEN)
+    monkeypatch.setattr(main, "PROFILE_TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "profiler", profiler)
+    monkeypatch.setattr(main, "profiler", profiler)
+    return profiler
+
+
+def test_only_http_requests_are_sampled_as_slow(app_client, monkeypatch):
+    slow = SlowRequests()
+    monkeypatch.setattr(profiling, "slow_requests", slow)
+
+    with app_client.websocket_connect("/api/ws/pipeline"):
+        pass
+    app_client.get("/health")
+
+    assert [(r["method"], r["path"]) for r in slow.slowest()] == [("GET", "/health")]
+
+
+def test_profiles_are_written_off_the_event_loop(app_client, profiler, monkeypatch, tmp_path):
+    writers = []
+    write = profiler._write
+    monkeypatch.setattr(profiler, "_write", lambda profile: writers.append(threading.get_ident()) or write(profile))
+    loop_thread = app_client.portal.call(threading.get_ident)
+
+    response = app_client.get("/health", headers={"X-Profile": TOKEN})
+    profile_id = response.headers["x-profile-id"]
+
+    assert writers and loop_thread not in writers
+    assert [p.name for p in tmp_path.iterdir()] == [f"request_{profile_id}.speedscope.json"]
+    assert profiler.get(profile_id) is not None
+
+
+def test_tokens_are_checked(app_client, profiler):
+    assert "x-profile-id" not in app_client.get("/health", headers={"X-Profile": "s3cre"}).headers
+    assert app_client.get("/api/profiling", headers={"X-Profile-Token": "s3cre"}).status_code == 403
+    assert app_client.get("/api/profiling").status_code == 403
+    assert app_client.get("/api/profiling", headers={"X-Profile-Token": TOKEN}).status_code == 200
@@ -0,0 +1,75 @@
+import asyncio
+import base64
+import io
+
+import pytest
+
+import base_client
+import prompt_eval
+from cassette import Cassette
+from database import get_prompt
+from fake_client import FakeClient
+from prompt_eval import Fixture, evaluate_prompt
+from routing import ModelRouter
+from token_budget import token_accountant
+
+
+def diagram() -> str:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture
+def shared_state(monkeypatch, tmp_path):
+    """A recording cassette and an empty router, to see what a call leaves behind."""
+    cassette = Cassette(path=str(tmp_path / "cassette.jsonl.gz"), mode="record")
+    router = ModelRouter(routes={}, cascade=False)
+    monkeypatch.setattr(base_client, "cassette", cassette)
+    monkeypatch.setattr(base_client, "model_router", router)
+    return cassette, router
+
+
+def history(step_key):
+    return list(token_accountant._output_history.get(("fake", step_key), []))
+
+
+@pytest.mark.parametrize("key, step_key", [("step1_analyze", "STEP-1"), ("step3_aws", "STEP-3:aws")])
+def test_evaluation_leaves_no_trace_in_shared_state(shared_state, key, step_key):
+    cassette, router = shared_state
+    before = history(step_key)
+    # No Step 2 sidecar, so Step 3 evaluation first extracts components from the image
+    fixtures = [Fixture("diagram", diagram(), "image/png")]
+    candidate = asyncio.run(get_prompt(key)) + "\nBe concise."
+
+    report = asyncio.run(evaluate_prompt(FakeClient(latency=0), key, candidate, fixtures, repeats=2))
+
+    assert report["candidate"]["runs"] == 2 and report["candidate"]["parse_success_rate"] == 1
+    assert cassette.stats["recorded"] == 0
+    assert router.metrics()["steps"] == {}
+    assert history(step_key) == before
+
+
+def test_regular_calls_are_still_recorded(shared_state):
+    cassette, router = shared_state
+    before = history("STEP-1")
+    FakeClient(latency=0).analyze_diagram(diagram())
+
+    assert cassette.stats["recorded"] == 1
+    assert "fake/STEP-1" in router.metrics()["steps"]
+    assert len(history("STEP-1")) == min(len(before) + 1, 100)
+
+
+def test_isolated_calls_still_replay(shared_state, monkeypatch):
+    cassette, _ = shared_state
+    image = diagram()
+    FakeClient(latency=0).analyze_diagram(image)
+    cassette.start_replay(latency_scale=0)
+    client = FakeClient(latency=0)
+    monkeypatch.setattr(client, "_invoke", lambda *args, **kwargs: pytest.fail("called the provider"))
+
+    outcome = prompt_eval.run_once(client, asyncio.run(get_prompt("step1_analyze")), "STEP-1", None,
+                                   Fixture("diagram", image, "image/png"))
+    assert outcome["parsed"] and cassette.stats["replayed"] == 1
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+import base_client
+from base_client import Completion
+from fake_client import FAKE_RESPONSES, FakeClient
+from routing import ModelRouter, output_problem
+
+FAST, STRONG = "fake-model-fast", "fake-model"
+
+
+def threat(n, **fields):
+    return {"id": f"TS{n:02}", "scenario": f"Scenario {n}", "cia_triad": "Integrity", "stride": "Tampering",
+            "mitre_tactic": "TA0040 - Impact", "mitre_technique": "T1565 - Data Manipulation",
+            "mitigations": "Restrict write access.", **fields}
+
+
+class CascadeClient(FakeClient):
+    """Fake provider whose fast model answers `step` with `fast` (a response dict or raw text)."""
+
+    def __init__(self, step, fast):
+        super().__init__(latency=0)
+        self.step, self.fast = step, fast
+        self.models = []
+
+    def _invoke(self, prompt, image_base64=None, media_type="image/png", max_tokens=4096,
+                step_name="INVOKE", structured=False, model=None):
+        self.models.append(model)
+        if model != FAST or step_name != self.step:
+            return super()._invoke(prompt, image_base64, media_type, max_tokens, step_name, structured, model)
+        text = self.fast if isinstance(self.fast, str) else json.dumps(self.fast)
+        return Completion(text=text, stop_reason="end_turn", usage={"input_tokens": 10, "output_tokens": 10})
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ModelRouter(routes={}, cascade=True)
+    monkeypatch.setattr(base_client, "model_router", router)
+    return router
+
+
+def test_normalizable_components_do_not_escalate(router):
+    client = CascadeClient("STEP-2C", {"in_scope_components": ["Amazon ECS", "Amazon RDS"]})
+    result = client.extract_components("aW1n")
+
+    assert client.models == [FAST, FAST, FAST]  # 2A, 2B and 2C
+    assert result["in_scope_components"] == [{"name": "Amazon ECS", "category": "other"},
+                                             {"name": "Amazon RDS", "category": "other"}]
+    assert router.metrics()["steps"]["fake/STEP-2C"]["escalated"] == 0
+
+
+def test_list_valued_threat_fields_do_not_escalate(router):
+    threats = [threat(n, mitigations=["Restrict write access.", "Audit changes."],
+                      mitre_technique=["T1565 - Data Manipulation"]) for n in range(3)]
+    client = CascadeClient("STEP-3", {"threats": threats})
+    result = client.generate_threats("An app", ["Amazon RDS"], [])
+
+    assert client.models == [FAST]
+    assert result["threats"][0]["mitigations"] == "Restrict write access. Audit changes."
+
+
+@pytest.mark.parametrize("fast, reason", [
+    ({"threats": [threat(1)]}, "fewer than 3 threats"),
+    ({"threats": [threat(n, stride="Phishing") for n in range(3)]}, "unknown STRIDE category"),
+    ({"threats": [threat(n, mitigations=7) for n in range(3)]}, "schema validation failed"),
+])
+def test_poor_output_escalates_to_the_default_model(router, fast, reason):
+    assert reason in output_problem("STEP-3", fast)
+    client = CascadeClient("STEP-3", fast)
+    result = client.generate_threats("An app", ["Amazon RDS"], [])
+
+    assert client.models == [FAST, STRONG]
+    assert result["threats"][0]["id"] == FAKE_RESPONSES["STEP-3"]["threats"][0]["id"]
+    stats = router.metrics()["steps"]["fake/STEP-3:baseline"]
+    assert stats["escalated"] == 1 and stats["served_by"] == {STRONG: 1}
+
+
+def test_unparseable_output_escalates(router):
+    client = CascadeClient("STEP-1", "I could not find any entry points.")
+    assert client.analyze_diagram("aW1n") == FAKE_RESPONSES["STEP-1"]
+    assert client.models == [FAST, STRONG]
+
+
+def test_explicit_route_without_cascade_uses_one_model(monkeypatch):
+    router = ModelRouter(routes={"fake": {"STEP-1": [FAST]}}, cascade=False)
+    monkeypatch.setattr(base_client, "model_router", router)
+    client = CascadeClient("STEP-1", FAKE_RESPONSES["STEP-1"])
+    client.analyze_diagram("aW1n")
+    client.extract_components("aW1n")
+
+    assert client.models == [FAST, STRONG, STRONG, STRONG]
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import pytest
+
+from cancellation import RequestCancelled, wait_cancelled
+from coalesce import SingleFlight
+from speculation import Speculator
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_matching_request_claims_the_speculated_result():
+    async def scenario():
+        speculator = Speculator(enabled=True)
+
+        async def step():
+            await asyncio.sleep(0.05)
+            return {"components": ["Amazon ECS"]}
+
+        speculator.launch("s1", "step2", "key", step)
+        return speculator, await speculator.claim("s1", "step2", "key")
+
+    speculator, result = run(scenario)
+    assert result == {"components": ["Amazon ECS"]}
+    assert speculator.metrics()["hits"] == 1
+
+
+def test_changed_inputs_discard_the_speculation():
+    async def scenario():
+        speculator = Speculator(enabled=True)
+        speculator.launch("s1", "step3", "unedited", lambda: asyncio.sleep(0, {"threats": []}))
+        result = await speculator.claim("s1", "step3", "edited")
+        await asyncio.sleep(0)
+        return speculator, result
+
+    speculator, result = run(scenario)
+    assert result is None
+    assert speculator.metrics()["misses"] == 1
+
+
+@pytest.mark.parametrize("outcome", ["cancelled", "failed"])
+def test_cancelled_or_failed_speculation_falls_back(outcome):
+    async def scenario():
+        speculator = Speculator(enabled=True)
+
+        async def step():
+            await asyncio.sleep(0.05)
+            if outcome == "failed":
+                raise RuntimeError("provider error")
+            raise asyncio.CancelledError()  # e.g. its shared provider call was cancelled
+
+        speculator.launch("s1", "step2", "key", step)
+        return speculator, await speculator.claim("s1", "step2", "key")
+
+    speculator, result = run(scenario)
+    assert result is None
+    assert speculator.metrics()["misses"] == 1
+
+
+def test_speculation_cancelled_while_claimed_falls_back():
+    async def scenario():
+        speculator = Speculator(enabled=True)
+        speculator.launch("s1", "step2", "key", lambda: asyncio.sleep(5))
+        spec = speculator._entries[("s1", "step2")]
+        claim = asyncio.ensure_future(speculator.claim("s1", "step2", "key"))
+        await asyncio.sleep(0.01)
+        spec.task.cancel()
+        return await claim
+
+    assert run(scenario) is None
+
+
+def test_cancelling_the_claiming_request_still_cancels_it():
+    async def scenario():
+        speculator = Speculator(enabled=True)
+        speculator.launch("s1", "step2", "key", lambda: asyncio.sleep(0.2, "done"))
+        spec = speculator._entries[("s1", "step2")]
+        claim = asyncio.ensure_future(speculator.claim("s1", "step2", "key"))
+        await asyncio.sleep(0.01)
+        claim.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await claim
+        # The speculation itself is shielded and still finishes
+        return await spec.task
+
+    assert run(scenario) == "done"
+
+
+def test_changed_inputs_cancel_the_running_speculation():
+    aborted = threading.Event()
+
+    def provider_call():
+        if wait_cancelled(5):
+            aborted.set()
+            raise RequestCancelled()
+        return {"threats": []}
+
+    async def scenario():
+        speculator = Speculator(enabled=True)
+        flights = SingleFlight(across_workers=False)
+        speculator.launch("s1", "step3", "unedited", lambda: flights.run("unedited", provider_call))
+        await asyncio.sleep(0.01)
+        result = await speculator.claim("s1", "step3", "edited")
+        await asyncio.to_thread(aborted.wait, 2)
+        return result
+
+    assert run(scenario) is None
+    assert aborted.is_set()
+
+
+def test_expired_speculation_is_not_served():
+    async def scenario():
+        speculator = Speculator(enabled=True, ttl_seconds=0.01)
+        speculator.launch("s1", "step2", "key", lambda: asyncio.sleep(0, {"components": []}))
+        await asyncio.sleep(0.05)
+        return speculator, await speculator.claim("s1", "step2", "key")
+
+    speculator, result = run(scenario)
+    assert result is None
+    assert speculator.metrics()["expired"] == 1 and speculator.metrics()["hits"] == 0
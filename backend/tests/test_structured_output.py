@@ -0,0 +1,133 @@
+import json
+from pathlib import Path
+
+import boto3
+import httpx
+import pytest
+from botocore.stub import Stubber
+
+from base_client import BaseClient, Completion, anthropic_completion, anthropic_stream_completion
+from schemas import STEP_SCHEMAS, TOOL_NAME, gemini_response_schema, json_schema, tool_definition
+
+FIXTURES = json.loads((Path(__file__).parent / "fixtures" / "structured_output.json").read_text())
+
+
+def walk(node):
+    yield node
+    children = node.values() if isinstance(node, dict) else node if isinstance(node, list) else []
+    for child in children:
+        yield from walk(child)
+
+
+@pytest.mark.parametrize("step", list(STEP_SCHEMAS))
+def test_step_schemas_are_self_contained(step):
+    schema = json_schema(step)
+    keys = {k for node in walk(schema) if isinstance(node, dict) for k in node}
+    assert not keys & {"$ref", "$defs", "title", "default"}
+    assert tool_definition(step)["input_schema"] == schema
+
+    gemini = gemini_response_schema(step)
+    assert gemini["type"] == "OBJECT"
+    assert not any("additionalProperties" in node for node in walk(gemini) if isinstance(node, dict))
+
+
+def test_threat_schema_leaves_out_server_side_fields():
+    threat = json_schema("STEP-3")["properties"]["threats"]["items"]
+    assert "invalid_mitre_ids" not in threat["properties"]
+    assert "scenario" in threat["required"]
+
+
+@pytest.mark.parametrize("case", FIXTURES["free_text"], ids=lambda c: c["step"])
+def test_free_text_extraction(fake_client, case):
+    parsed = fake_client._parse_completion(Completion(text=case["text"]), case["step"])
+    STEP_SCHEMAS[case["step"]].model_validate(parsed)
+
+
+def test_free_text_without_json_fails(fake_client):
+    with pytest.raises(ValueError):
+        fake_client._parse_completion(Completion(text=FIXTURES["free_text_unparseable"]), "STEP-2C")
+
+
+def test_tool_use_is_parsed_without_extraction(fake_client, monkeypatch):
+    monkeypatch.setattr(BaseClient, "_extract_json", lambda *a, **k: pytest.fail("fell back to text extraction"))
+    completion = anthropic_completion(FIXTURES["anthropic_tool_use"], TOOL_NAME)
+    assert completion.stop_reason == "tool_use"
+    assert completion.usage["output_tokens"] == 96
+
+    parsed = fake_client._parse_completion(completion, "STEP-3")
+    assert STEP_SCHEMAS["STEP-3"].model_validate(parsed).threats[0].id == "TS01"
+
+
+def test_streamed_tool_input_is_joined():
+    completion = anthropic_stream_completion(FIXTURES["anthropic_tool_stream"], TOOL_NAME)
+    assert completion.data == {"key_features": ["HTTPS termination", "Private subnets"]}
+    assert completion.usage == {"input_tokens": 640, "output_tokens": 21}
+
+
+def test_structured_call_without_tool_use_falls_back_to_text(fake_client):
+    body = {"content": [{"type": "text", "text": '{"key_features": ["HTTPS termination"]}'}], "stop_reason": "end_turn"}
+    completion = anthropic_completion(body, TOOL_NAME)
+    assert completion.data is None
+    assert fake_client._parse_completion(completion, "STEP-2B") == {"key_features": ["HTTPS termination"]}
+
+
+def test_fake_provider_structured_pipeline(monkeypatch):
+    from fake_client import FakeClient
+
+    monkeypatch.setattr(BaseClient, "_extract_json", lambda *a, **k: pytest.fail("fell back to text extraction"))
+    client = FakeClient(latency=0, structured_output=True)
+    result = client.extract_components("aGVsbG8=")
+    assert [c["name"] for c in result["in_scope_components"]] == ["Application Load Balancer", "Amazon ECS", "Amazon RDS"]
+
+
+def test_converse_tool_use():
+    from bedrock_client import BedrockClient
+
+    runtime = boto3.client("bedrock-runtime", region_name="us-east-1",
+                           aws_access_key_id="test", aws_secret_access_key="test")
+    client = BedrockClient(api="converse", structured_output=True)
+    client.clients = {"us-east-1": runtime}
+    with Stubber(runtime) as stub:
+        stub.add_response("converse", FIXTURES["converse"])
+        completion = client._invoke("Describe the application", step_name="STEP-2A", structured=True)
+    assert completion.data == {"application_description": "A containerized web application behind a load balancer."}
+    assert completion.usage == {"input_tokens": 700, "output_tokens": 30}
+
+
+def test_gemini_response_schema_request():
+    from gemini_client import GeminiClient
+
+    sent = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.update(json.loads(request.read()))
+        return httpx.Response(200, json=FIXTURES["gemini"])
+
+    client = GeminiClient(api_key="test", structured_output=True)
+    client.http = httpx.Client(transport=httpx.MockTransport(handler))
+    completion = client._invoke("List the components", step_name="STEP-2C", structured=True)
+
+    config = sent["generationConfig"]
+    assert config["responseMimeType"] == "application/json"
+    assert config["responseSchema"] == gemini_response_schema("STEP-2C")
+    assert completion.data == {"in_scope_components": [{"name": "Amazon ECS", "category": "compute"}]}
+
+
+def test_truncated_tool_stream_is_retried(monkeypatch):
+    from fake_client import FakeClient
+    from token_budget import token_accountant
+
+    events = FIXTURES["anthropic_tool_stream"]
+    truncated = events[:3] + [{"type": "message_delta", "delta": {"stop_reason": "max_tokens"},
+                               "usage": {"output_tokens": 12}}]
+    streams = [truncated, events]
+    calls = []
+    client = FakeClient(latency=0, structured_output=True)
+    monkeypatch.setattr(client, "_invoke", lambda *args, **kwargs: calls.append(kwargs["max_tokens"])
+                        or anthropic_stream_completion(streams.pop(0), TOOL_NAME))
+    output_tokens = token_accountant.totals["output_tokens"]
+
+    assert client._invoke_json("prompt", max_tokens=100, step_name="STEP-2B") == {
+        "key_features": ["HTTPS termination", "Private subnets"]}
+    assert calls[0] == 100 and calls[1] > 100
+    assert token_accountant.totals["output_tokens"] - output_tokens == 12 + 21
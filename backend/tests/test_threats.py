@@ -0,0 +1,78 @@
+import main
+from conftest import run_with_database
+
+COMPONENTS = [{"name": "Amazon ECS"}, {"name": "Amazon RDS"}]
+
+
+def threat(n, stride="Tampering", cia_triad="Integrity"):
+    return {"id": f"TS{n:02}", "scenario": f"Scenario {n}: an attacker modifies rows in Amazon RDS.",
+            "cia_triad": cia_triad, "stride": stride, "mitre_tactic": "TA0040 - Impact",
+            "mitre_technique": "T1565 - Data Manipulation", "mitigations": "Restrict write access."}
+
+
+def test_saving_a_result_again_stores_and_counts_it_once(database):
+    threats = [threat(1), threat(2, "Spoofing", "Confidentiality")]
+
+    async def scenario():
+        # The same result saved by every request sharing its flight, then a re-run with one new threat
+        for _ in range(3):
+            assert await database.save_threats("s1", threats, COMPONENTS, "fake", "baseline")
+        rerun = [{**threat(1), "id": "TS09", "scenario": "  scenario 1: An attacker modifies rows in Amazon RDS."},
+                 threat(3)]
+        assert await database.save_threats("s1", rerun, COMPONENTS, "fake", "baseline")
+        # Another template keeps its own copy
+        assert await database.save_threats("s1", threats[:1], COMPONENTS, "fake", "aws")
+        rows, _ = await database.query_threats(session_id="s1")
+        return rows, await database.count_threats(session_id="s1")
+
+    rows, counts = run_with_database(scenario)
+    assert sorted((r["template"], r["threat"]["id"]) for r in rows) == [
+        ("aws", "TS01"), ("baseline", "TS01"), ("baseline", "TS02"), ("baseline", "TS03")]
+    assert counts["total"] == 4
+    assert counts["stride"] == {"Tampering": 3, "Spoofing": 1}
+
+
+def test_cursor_pages_cover_every_threat_once(database):
+    async def scenario():
+        await database.save_threats("s1", [threat(n) for n in range(1, 8)], COMPONENTS, "fake", "baseline")
+        await database.save_threats("s2", [threat(n, "Spoofing") for n in range(1, 4)], COMPONENTS, "fake", "baseline")
+        pages, cursor = [], None
+        while True:
+            rows, cursor = await database.query_threats(limit=3, cursor=cursor, session_id="s1", component="amazon rds")
+            pages.append([r["threat"]["id"] for r in rows])
+            if cursor is None:
+                return pages
+
+    pages = run_with_database(scenario)
+    assert pages == [["TS07", "TS06", "TS05"], ["TS04", "TS03", "TS02"], ["TS01"]]
+
+
+def test_api_pages_and_counts_match(database, app_client):
+    async def seed():
+        # The app opened the pool on its own event loop at startup
+        async with database.get_pool().connection() as conn:
+            await conn.execute("TRUNCATE threats, threat_counts")
+        await database.save_threats("s1", [threat(n) for n in range(1, 6)], COMPONENTS, "fake", "baseline")
+        await database.save_threats("s1", [threat(n, "Spoofing", "Confidentiality") for n in range(6, 8)],
+                                    COMPONENTS, "fake", "aws")
+
+    app_client.portal.call(seed)
+    seen, cursor = [], None
+    while True:
+        params = {"session_id": "s1", "stride": "Tampering", "limit": 2, "counts": True}
+        if cursor:
+            params["cursor"] = cursor
+        page = app_client.get("/api/threats", params=params).json()
+        seen += [t["id"] for t in page["threats"]]
+        if not (cursor := page["next_cursor"]):
+            break
+
+    assert seen == ["TS05", "TS04", "TS03", "TS02", "TS01"]
+    assert page["counts"]["total"] == 5
+    counts = app_client.get("/api/threats", params={"session_id": "s1", "counts": True}).json()["counts"]
+    assert counts["cia_triad"] == {"Integrity": 5, "Confidentiality": 2}
+
+
+def test_session_ids_started_in_the_same_second_differ():
+    ids = {main.generate_session_id() for _ in range(1000)}
+    assert len(ids) == 1000
@@ -0,0 +1,138 @@
+import io
+import time
+import base64
+import threading
+
+import pytest
+
+import admission
+import main
+import tiling
+from fake_client import FakeClient
+from images import ImageRejected
+
+
+def diagram(width=5000, height=3000, truncate=False) -> str:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 500):
+        draw.rectangle((x + 50, 100, x + 400, 300), outline="black", width=3)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    data = buffer.getvalue()
+    return base64.b64encode(data[:len(data) // 2] if truncate else data).decode()
+
+
+class ConcurrencyClient(FakeClient):
+    """Fake provider that records how many of its calls overlap."""
+
+    def __init__(self):
+        super().__init__(latency=0.05)
+        self.lock = threading.Lock()
+        self.running = self.max_running = self.calls = 0
+
+    def _invoke(self, *args, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.calls += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            return super()._invoke(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def splits(monkeypatch):
+    """Count real splits, starting from an empty cache."""
+    monkeypatch.setattr(tiling, "_splits", tiling._SplitCache())
+    counted = []
+    split = tiling._split
+    monkeypatch.setattr(tiling, "_split", lambda image: counted.append(image) or split(image))
+    return counted
+
+
+def test_diagram_is_split_once_per_session(splits, fake_client):
+    image = diagram()
+    same_image = (image + " ")[:-1]  # An equal string from the session's next request
+    assert same_image is not image
+
+    tiling.analyze_diagram(fake_client, image)
+    tiling.extract_components(fake_client, same_image)
+
+    assert len(splits) == 1
+    overview, tiles = tiling.split_image(image)
+    assert 1 < len(tiles) <= tiling.MAX_TILES
+    assert tiling.split_image(same_image)[1][0][0] is tiles[0][0]  # Shared tile strings hit the image cache
+
+
+def test_concurrent_steps_share_one_split(splits):
+    image = diagram()
+    threads = [threading.Thread(target=tiling.split_image, args=((image + " ")[:-1],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(splits) == 1
+
+
+def test_callers_arriving_as_the_split_finishes_reuse_it(splits, monkeypatch):
+    split = tiling._split
+    monkeypatch.setattr(tiling, "_split", lambda image: time.sleep(0.05) or split(image))
+    image = diagram()
+    threads = []
+    # Staggered so some callers arrive while the first split is being stored
+    for _ in range(40):
+        threads.append(threading.Thread(target=tiling.split_image, args=((image + " ")[:-1],)))
+        threads[-1].start()
+        time.sleep(0.002)
+    for thread in threads:
+        thread.join()
+
+    tiling.split_image(image)
+
+    assert len(splits) == 1
+    assert tiling._splits._splitting == {}  # Cache hits leave no per-key locks behind
+
+
+def test_failed_split_releases_its_key(splits):
+    with pytest.raises(ImageRejected):
+        tiling.split_image(diagram(truncate=True))
+    assert tiling._splits._splitting == {}
+
+
+def test_tiled_step_uses_at_most_half_the_provider_slots(splits, monkeypatch):
+    monkeypatch.setitem(admission.PROVIDER_MAX_CONCURRENCY, "fake", 4)
+    monkeypatch.setattr(admission.admission_controller, "_schedulers", {})
+    client = ConcurrencyClient()
+
+    result = tiling.extract_components(client, diagram())
+
+    _, tiles = tiling.split_image(diagram())
+    assert client.calls == 2 * (len(tiles) + 1) + 1
+    assert client.max_running == 2
+    assert result["in_scope_components"]
+
+
+def test_oversized_image_is_rejected_before_decoding(splits, monkeypatch):
+    monkeypatch.setattr(tiling, "MAX_IMAGE_PIXELS", 1_000_000)
+    with pytest.raises(ImageRejected) as rejected:
+        tiling.split_image(diagram())
+    assert rejected.value.status_code == 413
+
+
+def test_api_rejects_images_over_the_pixel_limit(app_client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_IMAGE_PIXELS", 1_000_000)
+    response = app_client.post("/api/analyze-diagram", json={"image": diagram(2000, 1000), "provider": "fake"})
+    assert response.status_code == 413
+    assert "pixels" in response.json()["detail"]
+
+
+def test_api_rejects_undecodable_tiled_images(app_client, splits):
+    response = app_client.post("/api/extract-components",
+                               json={"image": diagram(truncate=True), "provider": "fake"})
+    assert response.status_code == 422
+    assert "Could not decode image" in response.json()["detail"]
@@ -0,0 +1,102 @@
+import contextvars
+
+import pytest
+
+import token_budget
+from admission import request_context
+from token_budget import TokenAccountant, TokenBudgetExceeded, token_accountant
+
+
+def threats_request(template="baseline"):
+    return {
+        "application_description": "A containerized web application behind a load balancer.",
+        "in_scope_components": [{"name": "Amazon ECS", "category": "compute"}],
+        "key_features": ["HTTPS termination"],
+        "template": template,
+        "provider": "fake",
+    }
+
+
+def as_tenant(tenant, fn, *args):
+    """Call fn for `tenant` without leaving the tenant set in the test's context."""
+    def call():
+        request_context.set((tenant, "interactive"))
+        return fn(*args)
+    return contextvars.copy_context().run(call)
+
+
+def test_request_over_its_token_budget_is_rejected(app_client, monkeypatch):
+    monkeypatch.setattr(token_budget, "REQUEST_TOKEN_BUDGET", 100)
+    before = dict(token_accountant.totals)
+
+    response = app_client.post("/api/generate-threats", json=threats_request(),
+                               headers={"x-tenant-id": "budget-request"})
+
+    assert response.status_code == 413
+    assert "Request token budget exceeded" in response.json()["detail"]
+    assert "retry-after" not in response.headers
+    assert token_accountant.totals == before  # Rejected before the provider was called
+
+
+def test_tenant_over_its_token_budget_is_throttled(app_client, monkeypatch):
+    headers = {"x-tenant-id": "budget-tenant"}
+    monkeypatch.setattr(token_budget, "TENANT_TOKEN_BUDGET", 10 ** 9)
+    before = token_accountant.totals["input_tokens"] + token_accountant.totals["output_tokens"]
+    assert app_client.post("/api/generate-threats", json=threats_request(), headers=headers).status_code == 200
+    used = token_accountant.totals["input_tokens"] + token_accountant.totals["output_tokens"] - before
+
+    # Room for one call, but the first call's usage counts against the tenant for the rest of the window
+    monkeypatch.setattr(token_budget, "TENANT_TOKEN_BUDGET", int(used * 1.5))
+    response = app_client.post("/api/generate-threats", json=threats_request("network"), headers=headers)
+    assert response.status_code == 429
+    assert "Tenant token budget exceeded" in response.json()["detail"]
+    assert 1 <= int(response.headers["retry-after"]) <= token_budget.TENANT_BUDGET_WINDOW_SECONDS
+
+    # Other tenants are unaffected
+    other = app_client.post("/api/generate-threats", json=threats_request("network"),
+                            headers={"x-tenant-id": "budget-other"})
+    assert other.status_code == 200
+
+
+@pytest.mark.parametrize("budget, status", [(0, 200), (10 ** 6, 200)])
+def test_disabled_or_ample_budget_allows_requests(app_client, monkeypatch, budget, status):
+    monkeypatch.setattr(token_budget, "REQUEST_TOKEN_BUDGET", budget)
+    response = app_client.post("/api/generate-threats", json=threats_request("aws"),
+                               headers={"x-tenant-id": "budget-ample"})
+    assert response.status_code == status
+    assert response.json()["threats"]
+
+
+def test_tenant_usage_is_only_kept_within_a_budget_window(monkeypatch):
+    accountant = TokenAccountant()
+    usage = {"input_tokens": 10, "output_tokens": 5}
+    for _ in range(1000):
+        accountant.record("fake", "STEP-1", 10, usage)
+    assert not accountant._tenant_usage  # No tenant budget configured
+
+    monkeypatch.setattr(token_budget, "TENANT_TOKEN_BUDGET", 10 ** 6)
+    clock = [1000.0]
+    monkeypatch.setattr(token_budget.time, "time", lambda: clock[0])
+    window = token_budget.TENANT_BUDGET_WINDOW_SECONDS
+    for tenant, calls in (("idle", 1), ("busy", 300)):
+        for _ in range(calls):
+            as_tenant(tenant, accountant.record, "fake", "STEP-1", 10, usage)
+            clock[0] += window / 150
+    # A tenant's entries leave as the window moves on
+    assert len(accountant._tenant_usage["busy"]) <= 151
+    assert accountant._tenant_used("busy", clock[0]) == 150 * 15
+
+    # Tenants idle for a window are dropped by the next sweep
+    as_tenant("busy", accountant.record, "fake", "STEP-1", 10, usage)
+    assert list(accountant._tenant_usage) == ["busy"]
+
+
+def test_each_worker_enforces_its_share_of_the_tenant_budget(monkeypatch):
+    monkeypatch.setattr(token_budget, "TENANT_TOKEN_BUDGET", 1000)
+    monkeypatch.setattr(token_budget, "WEB_CONCURRENCY", 4)
+    accountant = TokenAccountant()
+    as_tenant("budget-share", accountant.record, "fake", "STEP-1", 0, {"input_tokens": 200, "output_tokens": 0})
+
+    as_tenant("budget-share", accountant.check_budget, 50)
+    with pytest.raises(TokenBudgetExceeded):
+        as_tenant("budget-share", accountant.check_budget, 51)
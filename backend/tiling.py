@@ -0,0 +1,283 @@
+import io
+import os
+import re
+import math
+import base64
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
+
+from admission import admission_controller
+from base_client import BaseClient, load_prompt, log
+from token_budget import image_dimensions
+from images import MAX_IMAGE_PIXELS, ImageRejected, encoded_image
+from profiling import run_profiled
+
+# Diagrams whose long edge exceeds this are analyzed in tiles (0 disables tiling)
+TILE_THRESHOLD_PX = int(os.environ.get("TILE_THRESHOLD_PX", "4000"))
+# Claude models downscale anything above ~1568px, so tiles of this size keep labels legible
+TILE_SIZE_PX = int(os.environ.get("TILE_SIZE_PX", "1568"))
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", "0.1"))
+# A tiled Step 2 makes 2 * (tiles + 1) + 1 calls, so keep the grid small
+MAX_TILES = int(os.environ.get("MAX_TILES", "8"))
+# Tile calls of one request run at most this many at a time, and never on more
+# than half of the provider's slots, so one large diagram cannot crowd out other users
+TILE_CONCURRENCY = int(os.environ.get("TILE_CONCURRENCY", "4"))
+# Split diagrams kept for reuse by the session's other steps
+SPLIT_CACHE_IMAGES = int(os.environ.get("SPLIT_CACHE_IMAGES", "8"))
+
+ANALYSIS_FIELDS = ("entry_points", "data_flows", "security_boundaries", "public_resources", "private_resources")
+SIMILARITY_THRESHOLD = 0.85
+
+Tile = Tuple[str, str]  # (base64 data, media type)
+
+
+def should_tile(image_base64: str) -> bool:
+    """Whether a diagram is large enough to analyze in tiles (reads only the image header)."""
+    if not TILE_THRESHOLD_PX:
+        return False
+    dims = image_dimensions(image_base64)
+    return bool(dims) and max(dims) > TILE_THRESHOLD_PX
+
+
+def _encode(image) -> Tile:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=False)
+    return base64.b64encode(buffer.getvalue()).decode(), "image/png"
+
+
+def _open_image(image_base64: str):
+    """Decode a diagram, rejecting decompression bombs and undecodable data."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        # Shared with Step 1/Step 2 and the Converse API, so the diagram is decoded once
+        with encoded_image(image_base64).file() as decoded:
+            image = Image.open(decoded)
+            if image.size[0] * image.size[1] > MAX_IMAGE_PIXELS:
+                raise ImageRejected(f"Image exceeds {MAX_IMAGE_PIXELS} pixels", status_code=413)
+            image.load()
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e), status_code=413)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        raise ImageRejected(f"Could not decode image: {e}")
+    return image
+
+
+def _split(image_base64: str) -> Tuple[Tile, List[Tile]]:
+    from PIL import Image
+
+    image = _open_image(image_base64)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        # Flatten transparent diagrams onto white so dark labels stay readable
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    width, height = image.size
+
+    # Grow the tile size until the grid fits within MAX_TILES
+    tile = TILE_SIZE_PX
+    while True:
+        step = max(1, int(tile * (1 - TILE_OVERLAP)))
+        cols = max(1, math.ceil((width - tile) / step) + 1) if width > tile else 1
+        rows = max(1, math.ceil((height - tile) / step) + 1) if height > tile else 1
+        if cols * rows <= MAX_TILES:
+            break
+        tile = int(tile * 1.25)
+
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            left = min(col * step, max(0, width - tile))
+            top = min(row * step, max(0, height - tile))
+            tiles.append(_encode(image.crop((left, top, min(width, left + tile), min(height, top + tile)))))
+
+    overview = image.copy()
+    overview.thumbnail((TILE_SIZE_PX, TILE_SIZE_PX))
+    log("TILING", f"Split {width}x{height} diagram into {cols}x{rows} tiles of {tile}px plus overview")
+    return _encode(overview), tiles
+
+
+class _SplitCache:
+    """Split diagrams by content hash, so Step 1 and Step 2 of a session split once.
+
+    Reusing the same tile strings also lets every call that sends a tile share
+    its cached encoding. Concurrent requests for one diagram wait for the first
+    split instead of repeating it.
+    """
+
+    def __init__(self, max_images: int = SPLIT_CACHE_IMAGES):
+        self.max_images = max_images
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Tile, List[Tile]]]" = OrderedDict()
+        self._splitting: Dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, image_base64: str) -> Tuple[Tile, List[Tile]]:
+        digest = hashlib.sha256()
+        for start in range(0, len(image_base64), 1024 * 1024):
+            digest.update(image_base64[start:start + 1024 * 1024].encode())
+        key = digest.hexdigest()
+
+        with self._lock:
+            if key in self._entries:
+                return self._hit(key)
+            key_lock = self._splitting.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # Split meanwhile by the caller this one waited for
+                if key in self._entries:
+                    return self._hit(key)
+            try:
+                split = _split(image_base64)
+            except BaseException:
+                with self._lock:
+                    self._release(key, key_lock)
+                raise
+            # Stored before the key's lock is dropped, so no caller can start a second split
+            with self._lock:
+                self.stats["misses"] += 1
+                self._entries[key] = split
+                while len(self._entries) > self.max_images:
+                    self._entries.popitem(last=False)
+                self._release(key, key_lock)
+            return split
+
+    def _hit(self, key: str) -> Tuple[Tile, List[Tile]]:
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return self._entries[key]
+
+    def _release(self, key: str, key_lock: threading.Lock):
+        if self._splitting.get(key) is key_lock:
+            del self._splitting[key]
+
+
+_splits = _SplitCache()
+
+
+def split_image(image_base64: str) -> Tuple[Tile, List[Tile]]:
+    """Split a large diagram into an overview image plus overlapping full-resolution tiles."""
+    return _splits.get(image_base64)
+
+
+def split_cache_metrics() -> dict:
+    with _splits._lock:
+        return {"images": len(_splits._entries), **_splits.stats}
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s-]", " ", text.lower())).strip()
+
+
+def _head(text: str) -> str:
+    """The component name part of "Name - description" style entries."""
+    return _normalize(re.split(r"\s+[-–—:]\s+", text, maxsplit=1)[0])
+
+
+def merge_strings(lists: List[List[str]]) -> List[str]:
+    """Merge descriptive string lists from several tiles, dropping near-duplicates.
+
+    Entries naming the same component ("Amazon RDS - ...") or with near-identical
+    text are treated as one; the more detailed description wins.
+    """
+    merged: List[str] = []
+    for items in lists:
+        for item in items:
+            item = str(item)
+            norm, head = _normalize(item), _head(item)
+            for i, existing in enumerate(merged):
+                same_head = head and head != norm and head == _head(existing)
+                if same_head or SequenceMatcher(None, norm, _normalize(existing)).ratio() >= SIMILARITY_THRESHOLD:
+                    if len(item) > len(existing):
+                        merged[i] = item
+                    break
+            else:
+                merged.append(item)
+    return merged
+
+
+def merge_components(lists: List[List[dict]]) -> List[dict]:
+    """Merge component lists from several tiles by normalized name."""
+    merged: Dict[str, dict] = {}
+    for components in lists:
+        for component in components:
+            key = _normalize(component.get("name", ""))
+            if key and key not in merged:
+                merged[key] = component
+    return list(merged.values())
+
+
+def _run_concurrently(client: BaseClient, calls: list) -> list:
+    """Run (fn, args, kwargs) calls on a thread pool, each in a copy of the caller's context."""
+    workers = min(TILE_CONCURRENCY, max(1, admission_controller.limit(client.provider) // 2), len(calls))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, run_profiled, fn, *args, **kwargs)
+            for fn, args, kwargs in calls
+        ]
+        return [f.result() for f in futures]
+
+
+def analyze_diagram(client: BaseClient, image_base64: str, media_type: str = "image/png", custom_prompt: Optional[str] = None) -> dict:
+    """Step 1, tiled for very large diagrams.
+
+    The overview and tiles are analyzed concurrently (up to TILE_CONCURRENCY
+    at a time); results are merged with de-duplication.
+    """
+    if not should_tile(image_base64):
+        return client.analyze_diagram(image_base64, media_type, custom_prompt)
+
+    overview, tiles = split_image(image_base64)
+    results = _run_concurrently(client, [
+        (client.analyze_diagram, (data, tile_type, custom_prompt), {})
+        for data, tile_type in [overview] + tiles
+    ])
+
+    merged = {field: merge_strings([r.get(field, []) for r in results]) for field in ANALYSIS_FIELDS}
+    log("TILING", "Merged tiled analysis", {field: len(values) for field, values in merged.items()})
+    return merged
+
+
+def extract_components(client: BaseClient, image_base64: str, media_type: str = "image/png", custom_prompts: Optional[Dict[str, str]] = None) -> dict:
+    """Step 2, tiled for very large diagrams.
+
+    The application description comes from the overview; key features and
+    components are extracted from the overview and every tile and merged.
+    """
+    if not should_tile(image_base64):
+        return client.extract_components(image_base64, media_type, custom_prompts)
+
+    prompts = custom_prompts or {}
+    desc_prompt = prompts.get("app_desc") or load_prompt("step2_A_application_description.txt")
+    features_prompt = prompts.get("features") or load_prompt("step2_B_key_features.txt")
+    components_prompt = prompts.get("components") or load_prompt("step2_C_in_scope_components.txt")
+
+    overview, tiles = split_image(image_base64)
+    images = [overview] + tiles
+    calls = [(client._invoke_json, (desc_prompt, overview[0], overview[1]), {"step_name": "STEP-2A"})]
+    calls += [(client._invoke_json, (features_prompt, data, tile_type), {"step_name": "STEP-2B"}) for data, tile_type in images]
+    calls += [(client._invoke_json, (components_prompt, data, tile_type), {"step_name": "STEP-2C"}) for data, tile_type in images]
+    results = _run_concurrently(client, calls)
+
+    description = results[0]
+    features = results[1:1 + len(images)]
+    components = results[1 + len(images):]
+
+    merged = {
+        "application_description": description.get("application_description", ""),
+        "key_features": merge_strings([r.get("key_features", []) for r in features]),
+        "in_scope_components": merge_components([client._normalize_components(r) for r in components]),
+    }
+    log("TILING", "Merged tiled component extraction", {
+        "features_count": len(merged["key_features"]),
+        "components_count": len(merged["in_scope_components"])
+    })
+    return merged
@@ -0,0 +1,227 @@
+import os
+import math
+import time
+import base64
+import struct
+import binascii
+import threading
+from collections import deque, defaultdict
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from admission import request_context
+from lifecycle import WEB_CONCURRENCY
+
+# Output ceiling used until a step has enough history (and for retries after truncation)
+MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", "8192"))
+MIN_OUTPUT_TOKENS = int(os.environ.get("MIN_OUTPUT_TOKENS", "1024"))
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get("ADAPTIVE_MIN_SAMPLES", "5"))
+ADAPTIVE_HEADROOM = float(os.environ.get("ADAPTIVE_HEADROOM", "1.5"))
+
+# 0 disables the budget. The tenant budget is for the whole deployment; each of the WEB_CONCURRENCY workers gets its share
+REQUEST_TOKEN_BUDGET = int(os.environ.get("REQUEST_TOKEN_BUDGET", "0"))
+TENANT_TOKEN_BUDGET = int(os.environ.get("TENANT_TOKEN_BUDGET", "0"))
+TENANT_BUDGET_WINDOW_SECONDS = int(os.environ.get("TENANT_BUDGET_WINDOW_SECONDS", "3600"))
+
+TRUNCATED_STOP_REASONS = ("max_tokens", "MAX_TOKENS")
+
+# Tokens consumed by the HTTP request currently being served
+request_usage: ContextVar[Optional[dict]] = ContextVar("request_usage", default=None)
+# Set for calls that must not shape shared state (prompt evaluation): their output
+# sizes are not learned, and routing stats and cassettes do not record them
+isolated_calls: ContextVar[bool] = ContextVar("isolated_calls", default=False)
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised before a provider call that would exceed a request or tenant budget."""
+
+    def __init__(self, message: str, status_code: int = 429, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def start_request_budget():
+    """Begin per-request token accounting for the current request."""
+    request_usage.set({"input_tokens": 0, "output_tokens": 0})
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Rough token count for English/JSON prompt text (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def image_dimensions(image_base64: str) -> Optional[Tuple[int, int]]:
+    """Read width/height from a PNG, JPEG, GIF or WebP header without decoding the whole image."""
+    # A 64 KB prefix covers the header (and any EXIF block before the JPEG frame) for typical files
+    try:
+        head = base64.b64decode(image_base64[:65536])
+    except (binascii.Error, ValueError):
+        return None
+    try:
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            chunk = head[12:16]
+            if chunk == b"VP8X":
+                w = int.from_bytes(head[24:27], "little") + 1
+                h = int.from_bytes(head[27:30], "little") + 1
+                return w, h
+            if chunk == b"VP8 ":
+                w, h = struct.unpack("<HH", head[26:30])
+                return w & 0x3FFF, h & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if head[:2] == b"\xff\xd8":
+            i = 2
+            while i + 9 < len(head):
+                if head[i] != 0xFF:
+                    i += 1
+                    continue
+                marker = head[i + 1]
+                if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                    h, w = struct.unpack(">HH", head[i + 5:i + 9])
+                    return w, h
+                i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+    except struct.error:
+        pass
+    return None
+
+
+def estimate_image_tokens(image_base64: str, provider: str) -> int:
+    """Estimate input tokens for an image from its pixel dimensions."""
+    dims = image_dimensions(image_base64)
+    if not dims:
+        return 1600  # Roughly a max-size image for Claude
+    width, height = dims
+
+    if provider == "gemini":
+        # 258 tokens for small images, otherwise 258 per 768x768 tile
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * (-(-width // 768)) * (-(-height // 768))
+
+    # Anthropic: long edge scaled to 1568px and ~1.15 megapixels, then w*h/750
+    scale = min(1.0, 1568 / max(width, height), (1_150_000 / (width * height)) ** 0.5)
+    return int(width * scale * height * scale / 750) + 1
+
+
+class TokenAccountant:
+    """Pre-flight estimates, adaptive max_tokens, budgets and usage records."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._output_history = defaultdict(lambda: deque(maxlen=100))
+        self._tenant_usage = defaultdict(deque)  # tenant -> deque of (timestamp, tokens)
+        self._next_tenant_sweep = 0.0
+        self.totals = {"input_tokens": 0, "output_tokens": 0, "estimated_input_tokens": 0, "truncation_retries": 0}
+
+    def estimate_input(self, provider: str, prompt: str, image_base64: Optional[str] = None) -> int:
+        tokens = estimate_text_tokens(prompt)
+        if image_base64:
+            tokens += estimate_image_tokens(image_base64, provider)
+        return tokens
+
+    def max_tokens_for(self, provider: str, step_key: str) -> int:
+        """Pick max_tokens from the p95 of recent output sizes for this step."""
+        with self._lock:
+            history = sorted(self._output_history[(provider, step_key)])
+        if len(history) < ADAPTIVE_MIN_SAMPLES:
+            return MAX_OUTPUT_TOKENS
+        p95 = history[min(len(history) - 1, int(len(history) * 0.95))]
+        return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, int(p95 * ADAPTIVE_HEADROOM)))
+
+    def typical_output_tokens(self, provider: str, step_key: str) -> int:
+        """Median recent output size for this step (0 before any call completes)."""
+        with self._lock:
+            history = sorted(self._output_history[(provider, step_key)])
+        return history[len(history) // 2] if history else 0
+
+    def _prune_tenant(self, tenant: str, now: float):
+        """Drop the tenant's usage older than the budget window (and the tenant, once it has none)."""
+        usage = self._tenant_usage.get(tenant)
+        if usage is None:
+            return
+        while usage and usage[0][0] < now - TENANT_BUDGET_WINDOW_SECONDS:
+            usage.popleft()
+        if not usage:
+            del self._tenant_usage[tenant]
+
+    def _tenant_used(self, tenant: str, now: float) -> int:
+        self._prune_tenant(tenant, now)
+        return sum(tokens for _, tokens in self._tenant_usage.get(tenant, ()))
+
+    def check_budget(self, estimated_input: int):
+        """Reject a call whose estimated input would exceed the request or tenant budget."""
+        usage = request_usage.get()
+        if REQUEST_TOKEN_BUDGET and usage is not None:
+            spent = usage["input_tokens"] + usage["output_tokens"]
+            if spent + estimated_input > REQUEST_TOKEN_BUDGET:
+                raise TokenBudgetExceeded(
+                    f"Request token budget exceeded ({spent} used + ~{estimated_input} estimated > {REQUEST_TOKEN_BUDGET})",
+                    status_code=413
+                )
+
+        if TENANT_TOKEN_BUDGET:
+            tenant = request_context.get()[0]
+            now = time.time()
+            with self._lock:
+                used = self._tenant_used(tenant, now)
+                oldest = self._tenant_usage[tenant][0][0] if tenant in self._tenant_usage else now
+            if used + estimated_input > math.ceil(TENANT_TOKEN_BUDGET / WEB_CONCURRENCY):
+                retry_after = max(1, int(oldest + TENANT_BUDGET_WINDOW_SECONDS - now))
+                raise TokenBudgetExceeded(
+                    f"Tenant token budget exceeded ({used} used in the last {TENANT_BUDGET_WINDOW_SECONDS}s)",
+                    retry_after=retry_after
+                )
+
+    def record(self, provider: str, step_key: str, estimated_input: int, usage: dict, truncated: bool = False):
+        """Record actual usage reported by the provider (isolated calls count as spend only)."""
+        input_tokens = usage.get("input_tokens") or estimated_input
+        output_tokens = usage.get("output_tokens") or 0
+        with self._lock:
+            if output_tokens and not truncated and not isolated_calls.get():
+                self._output_history[(provider, step_key)].append(output_tokens)
+            # Usage is only kept while a tenant budget needs it, and only for the window
+            if TENANT_TOKEN_BUDGET:
+                now = time.time()
+                tenant = request_context.get()[0]
+                self._tenant_usage[tenant].append((now, input_tokens + output_tokens))
+                self._prune_tenant(tenant, now)
+                if now >= self._next_tenant_sweep:
+                    for idle in list(self._tenant_usage):
+                        self._prune_tenant(idle, now)
+                    self._next_tenant_sweep = now + TENANT_BUDGET_WINDOW_SECONDS
+            self.totals["input_tokens"] += input_tokens
+            self.totals["output_tokens"] += output_tokens
+            self.totals["estimated_input_tokens"] += estimated_input
+            if truncated:
+                self.totals["truncation_retries"] += 1
+
+            # Calls for one request may run on several threads (e.g. tiled analysis)
+            current = request_usage.get()
+            if current is not None:
+                current["input_tokens"] += input_tokens
+                current["output_tokens"] += output_tokens
+
+    def metrics(self) -> dict:
+        with self._lock:
+            steps = {
+                f"{provider}/{step}": {
+                    "samples": len(history),
+                    "avg_output_tokens": sum(history) / len(history) if history else 0,
+                    "max_output_tokens": max(history) if history else 0,
+                }
+                for (provider, step), history in self._output_history.items()
+            }
+            totals = dict(self.totals)
+        for key, stats in steps.items():
+            provider, step = key.split("/", 1)
+            stats["max_tokens"] = self.max_tokens_for(provider, step)
+        return {"totals": totals, "steps": steps}
+
+
+token_accountant = TokenAccountant()
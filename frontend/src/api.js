@@ -57,6 +57,42 @@ export async function generateThreats(applicationDescription, inScopeComponents,
   return response.json();
 }
 
+// One WebSocket for the whole session: Steps 1 and 2 run together, progress
+// events arrive as they happen, and edits can be sent mid-pipeline.
+// `image` is an ArrayBuffer/Blob (sent as a binary frame) or a base64 string.
+export function runPipeline(image, { mediaType = 'image/png', sessionId = null, provider = 'bedrock', templates = ['baseline'], review = true, onEvent = () => {} } = {}) {
+  console.log(`[API] Pipeline: Opening channel (provider: ${provider}, templates: ${templates.join(', ')})...`);
+  const socket = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/api/ws/pipeline`);
+  const send = (message) => socket.send(JSON.stringify(message));
+
+  socket.onopen = () => {
+    const start = { type: 'start', media_type: mediaType, provider, templates, review };
+    if (sessionId) start.session_id = sessionId;
+    if (typeof image === 'string') {
+      send({ ...start, image });
+    } else {
+      send(start);
+      socket.send(image);
+    }
+  };
+  socket.onmessage = (message) => {
+    const event = JSON.parse(message.data);
+    if (event.type === 'error') console.log(`[API] Pipeline error (${event.status}):`, event.detail);
+    onEvent(event);
+  };
+  // 1012: the server is restarting (a deploy); the session has to be started again
+  socket.onclose = (close) => {
+    if (close.code === 1012) onEvent({ type: 'error', status: 503, detail: 'The server is restarting, please run the analysis again' });
+  };
+
+  return {
+    edit: (changes) => send({ type: 'edit', ...changes }),
+    continue: () => send({ type: 'continue' }),
+    generate: (template) => send({ type: 'generate', template }),
+    close: () => socket.close()
+  };
+}
+
 export async function checkHealth() {
   const response = await fetch(`${API_BASE}/health`);
   return response.json();